@@ -0,0 +1,88 @@
+"""
+Admission control for polling endpoints.
+
+Each session gets a token bucket, so one client cannot poll faster than
+RATE requests per second on average (with BURST of slack). The controller
+also tracks requests in flight and a smoothed request latency. From those it
+derives the load that decides the next_poll_ms hint sent back to clients:
+polls slow down as load rises, and speed up again when a phase is about to
+complete. Past MAX_IN_FLIGHT the polling endpoints answer 429 right away
+instead of queueing.
+"""
+
+import math
+import threading
+import time
+
+RATE = 4.0  # Sustained polls per second per session
+BURST = 8.0
+MAX_IN_FLIGHT = 64  # Requests in flight before polls are shed
+TARGET_LATENCY = 0.05  # Seconds; slower average responses count as load
+MIN_POLL_MS = 250
+MAX_POLL_MS = 10000
+IDLE_BUCKET_SECONDS = 120  # Buckets unused this long are dropped
+EWMA_WEIGHT = 0.1
+
+
+class AdmissionController:
+    def __init__(self, rate=RATE, burst=BURST, max_in_flight=MAX_IN_FLIGHT):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.latency = 0.0  # Smoothed seconds per request
+        self._buckets = {}  # Format: {key: [tokens, last refill time]}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + IDLE_BUCKET_SECONDS
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, elapsed):
+        with self._lock:
+            self.in_flight -= 1
+            self.latency += EWMA_WEIGHT * (elapsed - self.latency)
+
+    def load(self):
+        """0 when idle, 1 at capacity, above 1 when overloaded"""
+        return max(self.in_flight / self.max_in_flight, self.latency / TARGET_LATENCY - 1, 0.0)
+
+    def admit(self, key):
+        """Take a token for key; returns (admitted, seconds until a retry can succeed)"""
+        now = time.monotonic()
+        with self._lock:
+            if self.in_flight > self.max_in_flight:
+                return False, max(1, math.ceil(self.in_flight / self.max_in_flight))
+            if now >= self._next_sweep:
+                self._sweep(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False, max(1, math.ceil((1 - tokens) / self.rate))
+            bucket[0] = tokens - 1
+            return True, 0
+
+    def _sweep(self, now):
+        cutoff = now - IDLE_BUCKET_SECONDS
+        for key in [k for k, (_tokens, seen) in self._buckets.items() if seen < cutoff]:
+            del self._buckets[key]
+        self._next_sweep = now + IDLE_BUCKET_SECONDS
+
+    def next_poll_ms(self, base_ms, progress=None):
+        """Suggested delay before the client polls again.
+
+        ``progress`` is (done, total) for endpoints that report a phase
+        barrier; when the phase is one step from completing, the delay is
+        cut so everyone moves on together.
+        """
+        delay = base_ms * (1 + 3 * self.load())
+        if progress:
+            done, total = progress
+            if total and total - done <= max(1, total // 10):
+                delay /= 2
+        return int(min(max(delay, MIN_POLL_MS), MAX_POLL_MS))
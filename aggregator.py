@@ -0,0 +1,154 @@
+"""
+Precomputed cross-room overview for the admin dashboard.
+
+A background thread rebuilds a compact summary of every live room every few
+seconds. Dashboard requests only filter and sort that list, and identical
+queries against the same build share one rendered response, so adding
+viewers does not add work on the live state.
+
+A room counts as stalled from the last build in which its phase or progress
+changed, so a room sitting at 4/5 voted for ten minutes shows up even though
+its phase is unchanged.
+"""
+
+import json
+import threading
+import time
+
+STALL_SECONDS = 120  # Rooms without progress for this long count as stalled in the totals
+MAX_LIMIT = 1000
+CACHED_VIEWS = 64  # Rendered responses kept per build
+
+SORT_KEYS = {
+    'stalled': lambda room, now: now - room['last_progress_at'],
+    'members': lambda room, now: room['members'],
+    'online': lambda room, now: room['online'],
+    'progress': lambda room, now: room['done'] / room['total'] if room['total'] else 1.0,
+    'created': lambda room, now: room['created_date'] or '',
+    'phase': lambda room, now: room['phase'],
+    'room_code': lambda room, now: room['room_code'],
+}
+
+
+class OverviewError(ValueError):
+    pass
+
+
+class OverviewAggregator:
+    """Rebuild ``build()`` (a list of room summaries) every ``interval`` seconds"""
+
+    def __init__(self, build, interval):
+        self.build = build
+        self.interval = interval
+        self.rooms = []
+        self.totals = {}
+        self.generation = 0
+        self.generated_at = None
+        self.build_ms = None
+        self._progress = {}  # Format: {room_code: ((phase, done, total), last_progress_at)}
+        self._views = {}  # Format: {query key: rendered JSON} for the current generation
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='overview', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self):
+        with self._build_lock:
+            self._refresh()
+
+    def _refresh(self):
+        start = time.perf_counter()
+        now = time.time()
+        rooms = self.build()
+        progress = {}
+        for room in rooms:
+            signature = (room['phase'], room['done'], room['total'])
+            previous = self._progress.get(room['room_code'])
+            if previous is None:
+                since = room['phase_changed_at']  # First build that sees the room
+            elif previous[0] == signature:
+                since = previous[1]
+            else:
+                since = now
+            progress[room['room_code']] = (signature, since)
+            room['last_progress_at'] = since
+
+        by_phase = {}
+        for room in rooms:
+            by_phase[room['phase']] = by_phase.get(room['phase'], 0) + 1
+        totals = {
+            'rooms': len(rooms),
+            'members': sum(room['members'] for room in rooms),
+            'online': sum(room['online'] for room in rooms),
+            'by_phase': by_phase,
+            'stalled': sum(1 for room in rooms if now - room['last_progress_at'] >= STALL_SECONDS),
+        }
+        with self._lock:
+            self.rooms = rooms
+            self.totals = totals
+            self._progress = progress
+            self._views = {}
+            self.generation += 1
+            self.generated_at = now
+            self.build_ms = round((time.perf_counter() - start) * 1000, 3)
+
+    def view(self, phases=None, stalled_over=None, min_members=None, search=None,
+             sort='stalled', descending=True, limit=100, offset=0):
+        """(generation, JSON text) for one filtered, sorted page of the latest build"""
+        if sort not in SORT_KEYS:
+            raise OverviewError(f'sort must be one of {", ".join(SORT_KEYS)}')
+        if not 1 <= limit <= MAX_LIMIT or offset < 0:
+            raise OverviewError(f'limit must be 1-{MAX_LIMIT} and offset at least 0')
+        if self.generated_at is None:
+            self.refresh()
+
+        key = (tuple(sorted(phases or ())), stalled_over, min_members, search, sort, descending, limit, offset)
+        with self._lock:
+            generation, rooms, totals, generated_at = self.generation, self.rooms, self.totals, self.generated_at
+            cached = self._views.get(key)
+        if cached is not None:
+            return generation, cached
+
+        # Stall times are measured from the build, so one rendering serves every viewer of this generation
+        now = generated_at
+        search = search.upper() if search else None
+        matched = [
+            room for room in rooms
+            if (not phases or room['phase'] in phases)
+            and (stalled_over is None or now - room['last_progress_at'] >= stalled_over)
+            and (min_members is None or room['members'] >= min_members)
+            and (not search or search in room['room_code'] or search in room['name'].upper())
+        ]
+        sort_key = SORT_KEYS[sort]
+        matched.sort(key=lambda room: sort_key(room, now), reverse=descending)
+        page = [
+            dict(room, stalled_seconds=round(now - room['last_progress_at'], 1))
+            for room in matched[offset:offset + limit]
+        ]
+        rendered = json.dumps({
+            'generation': generation,
+            'generated_at': generated_at,
+            'build_ms': self.build_ms,
+            'totals': totals,
+            'matched': len(matched),
+            'rooms': page,
+        })
+        with self._lock:
+            if generation == self.generation and len(self._views) < CACHED_VIEWS:
+                self._views[key] = rendered
+        return generation, rendered
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f'Overview refresh failed: {e}')
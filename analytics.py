@@ -0,0 +1,192 @@
+"""
+Turnout and voting analytics for a room.
+
+Ballots are laid out as a voter x proposal matrix of int8 choice codes
+(0 = no ballot, then yes / no / abstain, the codes ballots.py packs two bits
+each) and every aggregate is computed from that matrix with NumPy:
+
+- turnout, abstention rate and yes/no split per position (users.position)
+- totals per proposal
+- agreement between positions: the chance that two delegates from those
+  positions cast the same ballot on a proposal they both voted on
+- agreement between individual delegates, for rooms small enough that the
+  full delegate x delegate matrix is worth sending
+
+The pure-Python versions at the bottom compute the same numbers one ballot
+at a time; benchmark.py compares the two.
+"""
+
+import numpy as np
+
+from ballots import CHOICE_CODES, CHOICES
+
+NO_BALLOT = 0
+DELEGATE_MATRIX_LIMIT = 200  # Rooms with more voters only get the per-position matrix
+
+
+def choice_matrix(voter_ids, columns):
+    """Build the voter x proposal matrix.
+
+    ``voter_ids`` is a sorted array of positive user ids; ``columns`` has
+    one {voter_id: choice} dict per proposal. Ballots from users outside
+    ``voter_ids`` are ignored.
+    """
+    n_voters = len(voter_ids)
+    # Row of every user id up to the largest voter; anyone else lands in a spare last row
+    lookup = np.full(int(voter_ids[-1]) + 2 if n_voters else 1, n_voters, dtype=np.int64)
+    lookup[voter_ids] = np.arange(n_voters)
+    matrix = np.zeros((n_voters + 1, len(columns)), dtype=np.int8)
+    for column, ballots in enumerate(columns):
+        if not ballots:
+            continue
+        ids = np.fromiter(ballots.keys(), dtype=np.int64, count=len(ballots))
+        codes = np.fromiter(map(CHOICE_CODES.__getitem__, ballots.values()), dtype=np.int8, count=len(ballots))
+        np.minimum(ids, len(lookup) - 1, out=ids)
+        matrix[lookup[ids], column] = codes
+    return matrix[:n_voters]
+
+
+def unpack_choices(packed):
+    """Choice codes per slot from a BallotBox's 2-bit packed choices"""
+    raw = np.frombuffer(packed, dtype=np.uint8)
+    return ((raw[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3).astype(np.int8).ravel()
+
+
+def ballot_box_matrix(boxes, slot_rows):
+    """Voter x proposal matrix from BallotBoxes; matrix row i is room slot slot_rows[i]"""
+    matrix = np.zeros((len(boxes), len(slot_rows)), dtype=np.int8)
+    for column, box in enumerate(boxes):
+        codes = unpack_choices(box.choices)
+        known = slot_rows < len(codes)
+        matrix[column, known] = codes[slot_rows[known]]
+    return matrix.T
+
+
+def _ratio(numerator, denominator):
+    """Elementwise numerator / denominator, with None where the denominator is 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    out = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+
+def _rounded(array, digits=4):
+    """Nested lists of floats for JSON, NaN -> None"""
+    if array.ndim > 1:
+        return [_rounded(row, digits) for row in array]
+    return [None if np.isnan(x) else round(float(x), digits) for x in array]
+
+
+def room_analytics(matrix, positions, voter_ids=None, delegate_limit=DELEGATE_MATRIX_LIMIT):
+    """Aggregate a choice matrix; ``positions`` has one label per matrix row"""
+    n_voters, n_proposals = matrix.shape
+    labels, group = np.unique(np.asarray(positions, dtype=object).astype(str), return_inverse=True)
+    n_groups = len(labels)
+
+    # counts[g, p, c]: ballots with choice code c on proposal p from position g
+    cells = (group[:, None] * n_proposals + np.arange(n_proposals)) * 4 + matrix
+    counts = np.bincount(cells.ravel(), minlength=n_groups * n_proposals * 4).reshape(n_groups, n_proposals, 4)
+
+    by_group = counts.sum(axis=1)  # (groups, 4)
+    delegates = np.bincount(group, minlength=n_groups)
+    cast = by_group[:, 1:].sum(axis=1)
+    turnout = _ratio(cast, delegates * n_proposals)
+    abstention = _ratio(by_group[:, 3], cast)
+    yes_share = _ratio(by_group[:, 1], by_group[:, 1] + by_group[:, 2])
+
+    by_proposal = counts.sum(axis=0)  # (proposals, 4)
+    proposal_turnout = _ratio(by_proposal[:, 1:].sum(axis=1), n_voters)
+
+    position_agreement = agreement_between_positions(counts)
+
+    result = {
+        'voters': n_voters,
+        'proposals': n_proposals,
+        'turnout': round(int(cast.sum()) / (n_voters * n_proposals), 4) if n_voters and n_proposals else None,
+        'by_position': [
+            {
+                'position': str(labels[g]),
+                'delegates': int(delegates[g]),
+                'ballots': int(cast[g]),
+                'yes': int(by_group[g, 1]),
+                'no': int(by_group[g, 2]),
+                'abstain': int(by_group[g, 3]),
+                'turnout': t,
+                'abstention_rate': a,
+                'yes_share': y,
+            }
+            for g, t, a, y in zip(range(n_groups), _rounded(turnout), _rounded(abstention), _rounded(yes_share))
+        ],
+        'by_proposal': [
+            {'yes': int(row[1]), 'no': int(row[2]), 'abstain': int(row[3]), 'turnout': t}
+            for row, t in zip(by_proposal, _rounded(proposal_turnout))
+        ],
+        'position_agreement': {
+            'positions': [str(label) for label in labels],
+            'matrix': _rounded(position_agreement),
+        },
+        'delegate_agreement': None,
+    }
+    if voter_ids is not None and n_voters <= delegate_limit:
+        result['delegate_agreement'] = {
+            'user_ids': [int(v) for v in voter_ids],
+            'matrix': _rounded(agreement_between_delegates(matrix)),
+        }
+    return result
+
+
+def agreement_between_positions(counts):
+    """Chance that delegates from two positions agree, given counts[g, p, c].
+
+    Pairs are (delegate from a, delegate from b) ballots on the same
+    proposal; within one position a delegate is not paired with itself.
+    """
+    ballots = counts[:, :, 1:].astype(np.float64)  # (groups, proposals, 3)
+    same = np.einsum('apc,bpc->ab', ballots, ballots)
+    voted = ballots.sum(axis=2)  # (groups, proposals)
+    both = voted @ voted.T
+    own = voted.sum(axis=1)
+    same[np.diag_indices_from(same)] -= own
+    both[np.diag_indices_from(both)] -= own
+    return _ratio(same, both)
+
+
+def agreement_between_delegates(matrix):
+    """Fraction of shared proposals on which each pair of delegates cast the same ballot"""
+    onehot = np.concatenate([matrix == code for code in CHOICE_CODES.values()], axis=1).astype(np.float32)
+    voted = (matrix != NO_BALLOT).astype(np.float32)
+    return _ratio(onehot @ onehot.T, voted @ voted.T)
+
+
+def room_analytics_python(voter_ids, positions, columns):
+    """Reference implementation: per-position totals and agreement, one ballot at a time"""
+    position_of = dict(zip(voter_ids, positions))
+    labels = sorted(set(positions))
+    totals = {label: {'yes': 0, 'no': 0, 'abstain': 0} for label in labels}
+    same = {(a, b): 0 for a in labels for b in labels}
+    both = {(a, b): 0 for a in labels for b in labels}
+
+    for ballots in columns:
+        per_position = {label: {'yes': 0, 'no': 0, 'abstain': 0} for label in labels}
+        for voter_id, choice in ballots.items():
+            label = position_of.get(voter_id)
+            if label is None:
+                continue
+            totals[label][choice] += 1
+            per_position[label][choice] += 1
+        for a in labels:
+            voted_a = sum(per_position[a].values())
+            for b in labels:
+                voted_b = sum(per_position[b].values())
+                agreeing = sum(per_position[a][c] * per_position[b][c] for c in CHOICES)
+                if a == b:
+                    agreeing -= voted_a
+                    voted_pairs = voted_a * voted_b - voted_a
+                else:
+                    voted_pairs = voted_a * voted_b
+                same[a, b] += agreeing
+                both[a, b] += voted_pairs
+
+    agreement = [[same[a, b] / both[a, b] if both[a, b] else None for b in labels] for a in labels]
+    return totals, agreement
@@ -1,26 +1,378 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, g, make_response, send_file
 import sqlite3
 import hashlib
+import os
+import signal
+import time
+import atexit
+import hmac
+import threading
+import gc
+import random
+from datetime import datetime
 from functools import wraps
+from werkzeug.exceptions import HTTPException
+from jinja2 import FileSystemBytecodeCache
+import snapshot
+import shard_transfer
+import ledger
+import sharding
+from admission import AdmissionController
+import profiling
+import analytics
+import traffic
+import maintenance
+import memory_report
+import presence
+import aggregator
+import room_directory
+import ranked_choice
+import jobs
+import read_replica
+import numpy as np
+from rotation import ProposerRotation
+from ballots import BallotBox, VoterSlots
+import tiebreak
+from tiebreak import RoomPhase
 
 app = Flask(__name__)
 app.secret_key = '4e1_voting_secret_key_2026'
-DATABASE = 'un_voting.db'
+DATABASE = os.environ.get('DATABASE', 'un_voting.db')
+
+# Startup: compile every template into TEMPLATE_CACHE_DIR before serving (see create_app)
+APP_WARMUP = os.environ.get('APP_WARMUP', '1') == '1'
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', 'template_cache')
+
+# Live state snapshots (restored on startup, rewritten periodically and on SIGTERM)
+SNAPSHOT_ENABLED = os.environ.get('SNAPSHOT_ENABLED', '1') == '1'
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'state.snapshot')
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', '15'))
+
+# Append-only ballot ledger for audits (opened by start_background_services). One process
+# appends to a file; {pid} in the path gives each worker its own, otherwise a second one waits
+# LEDGER_LOCK_TIMEOUT seconds (e.g. for the worker it replaces to exit) and then refuses to start
+LEDGER_PATH = os.environ.get('LEDGER_PATH', 'votes.ledger')
+LEDGER_LOCK_TIMEOUT = float(os.environ.get('LEDGER_LOCK_TIMEOUT', '30'))
+vote_ledger = None
+
+# Admin/internal endpoints require this token in the X-Admin-Token header (disabled when empty)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Token buckets and load tracking for the polling endpoints
+admission = AdmissionController()
+
+# Opt-in profiling: a fraction of requests (or any admin request sending X-Profile: 1)
+# runs under cProfile with its SQL traced; see GET /api/admin/slow-requests
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+profiler = profiling.Profiler(PROFILE_SAMPLE_RATE, PROFILE_DIR)
+
+# Record every request to a trace file for replaying later (see traffic.py)
+TRAFFIC_RECORD = os.environ.get('TRAFFIC_RECORD', '')
+if TRAFFIC_RECORD:
+    app.wsgi_app = traffic.TrafficRecorder(
+        app.wsgi_app, TRAFFIC_RECORD, bytes.fromhex(os.environ.get('TRAFFIC_RECORD_KEY', '')) or None
+    )
+    atexit.register(app.wsgi_app.close)
+
+# Online backups and archival of old rows (see maintenance.py and POST /api/admin/maintenance)
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+ARCHIVE_PATH = os.environ.get('ARCHIVE_PATH', 'archive.db')
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+maintenance_status = {'running': False, 'started': None, 'finished': None, 'progress': None, 'result': None, 'error': None}
+maintenance_lock = threading.Lock()
+
+# Exports, statistics, archival, imports and ledger checks run as jobs in a separate
+# process pool (see jobs.py and /api/jobs); finished jobs are kept for JOB_RETENTION seconds
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_QUEUE = int(os.environ.get('JOB_QUEUE', '16'))
+JOB_RETENTION = float(os.environ.get('JOB_RETENTION', '3600'))
+JOB_EXPORT_DIR = os.environ.get('JOB_EXPORT_DIR', 'exports')
+job_runner = jobs.JobRunner(JOB_WORKERS, JOB_QUEUE, JOB_RETENTION)
+
+# Result and history reads (and exports) use a read-only copy of the database republished every
+# REPLICA_INTERVAL seconds (see read_replica.py); X-Data-Age says how old a response's data is
+REPLICA_INTERVAL = float(os.environ.get('REPLICA_INTERVAL', '5'))  # 0 reads the live database
+REPLICA_DIR = os.environ.get('REPLICA_DIR', 'replica')
+REPLICA_POOL = int(os.environ.get('REPLICA_POOL', '8'))
+REPLICA_MMAP_MB = int(os.environ.get('REPLICA_MMAP_MB', '256'))
+REPLICA_JOB_TYPES = ('export_results', 'position_statistics')
+replica = read_replica.ReadReplica(
+    lambda: sqlite3.connect(DATABASE, timeout=10.0), REPLICA_DIR, REPLICA_INTERVAL, REPLICA_POOL, REPLICA_MMAP_MB << 20
+)
+
+# Optional tracemalloc baselines for GET/POST /api/admin/memory
+memory_tracker = memory_report.TracemallocTracker()
+
+# Members who stop sending requests and heartbeats for PRESENCE_TIMEOUT seconds stop counting
+# towards their room's totals until they come back (0 disables expiry). Browsers can stretch a
+# background tab's heartbeat to about a minute, so the default outlasts several throttled beats
+PRESENCE_TIMEOUT = float(os.environ.get('PRESENCE_TIMEOUT', '180'))
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', '15'))
+
+# Seconds between batched writes of proposer picks to proposer_history
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', '5'))
+HISTORY_BACKLOG = 100000  # proposer_history rows kept for a retry while the database is failing
+
+# Seconds between rebuilds of the admin overview (GET /api/admin/overview)
+OVERVIEW_INTERVAL = float(os.environ.get('OVERVIEW_INTERVAL', '2'))
+
+# Multi-node deployments: this node's URL and every node in the cluster (see router.py)
+NODE_URL = os.environ.get('NODE_URL', '')
+cluster_ring = sharding.HashRing([n for n in os.environ.get('CLUSTER_NODES', '').split(',') if n])
+
 ready_users = set()  # Track which users are ready
 logged_in_users = set()  # Track currently logged-in users
-proposal_submissions = {}  # Track proposal submissions by user_id
+proposal_submissions = {}  # Format: {user_id: {'title': str, 'body_hash': str, 'user_name': str, 'user_id': user_id}}
+proposal_bodies = {}  # Format: {body_hash: description}, each description stored once (GET /api/proposal-body/<hash>)
 users_skipped_proposal = set()  # Track users who skipped proposal submission
-submission_votes = {}  # Format: {proposer_user_id: {'yes': X, 'no': Y, 'abstain': Z}}
-users_finished_voting = set()  # Track users who have finished voting
-tiebreaker_votes = {}  # Format: {proposer_user_id: {'yes': X, 'no': Y}}
-users_finished_tiebreaker = set()  # Track users who have finished tie breaking
-users_agreed_to_tiebreak = set()  # Track users who agreed to break tie
-users_arrived_tiebreak = set()  # Track users who have loaded the tiebreaker page
-tiebreak_rejected = False  # Flag: if any user rejected tiebreak, skip for everyone
+submission_votes = {}  # Format: {proposer_user_id: BallotBox over the voters' room slots}
 
 # Room management
-voting_rooms = {}  # Format: {room_code: {'name': str, 'passcode': str, 'created_by': user_id, 'users': set(), 'created_date': timestamp}}
+voting_rooms = {}  # Format: {room_code: {'name': str, 'passcode': str, 'created_by': user_id, 'users': set(), 'created_date': timestamp, 'slots': VoterSlots, 'rotation': ProposerRotation, 'phase': RoomPhase, 'election': RankedElection or None}}
 user_rooms = {}  # Format: {user_id: room_code}
+rooms_index = room_directory.RoomDirectory()  # Name and code indexes over voting_rooms for GET /api/rooms
+room_lock = threading.RLock()  # Serializes membership changes and phase transitions (stress.py exercises both)
+unsaved_history = []  # proposer_history rows from closed rooms (or a failed write) waiting for the next flush
+
+def body_hash(description):
+    return hashlib.sha256(description.encode()).hexdigest()
+
+def store_proposal(user_id, title, description, user_name):
+    """Record a user's proposal; the description is kept once under its content hash"""
+    key = body_hash(description)
+    with room_lock:
+        proposal_bodies.setdefault(key, description)
+        previous = proposal_submissions.get(user_id)
+        proposal_submissions[user_id] = {
+            'title': title,
+            'body_hash': key,
+            'user_name': user_name,
+            'user_id': user_id
+        }
+        if previous and previous.get('body_hash') != key:
+            prune_proposal_bodies()
+
+def prune_proposal_bodies():
+    """Forget descriptions no current proposal refers to"""
+    with room_lock:
+        referenced = {p['body_hash'] for p in list(proposal_submissions.values())}
+        for key in [k for k in proposal_bodies if k not in referenced]:
+            del proposal_bodies[key]
+
+def hash_proposal_bodies(submissions, bodies):
+    """Move descriptions out of proposals saved before bodies were content-addressed"""
+    for proposal in submissions.values():
+        if 'description' in proposal:
+            description = proposal.pop('description')
+            proposal['body_hash'] = body_hash(description)
+            bodies.setdefault(proposal['body_hash'], description)
+
+def new_room_state(name, passcode, created_by):
+    """A fresh, empty entry for voting_rooms"""
+    slots = VoterSlots()
+    return {
+        'name': name,
+        'passcode': passcode,
+        'created_by': created_by,
+        'users': set(),
+        'created_date': datetime.now().isoformat(),
+        'slots': slots,
+        'rotation': ProposerRotation(),
+        'phase': RoomPhase(slots),
+        'election': None
+    }
+
+def owned_shards():
+    """Shards this node may create rooms in (all of them on a single node)"""
+    if not cluster_ring.nodes or not NODE_URL:
+        return range(sharding.SHARD_COUNT)
+    return cluster_ring.shards_of(NODE_URL) or range(sharding.SHARD_COUNT)
+
+def open_room(room_code, room):
+    """Add a new room to voting_rooms and the room directory"""
+    voting_rooms[room_code] = room
+    rooms_index.add(room_code, room['name'])
+
+def get_user_room(user_id):
+    """Return (room_code, room) for a user, or (None, None) if they are not in a room"""
+    room_code = user_rooms.get(user_id)
+    room = voting_rooms.get(room_code) if room_code else None
+    if not room:
+        return None, None
+    return room_code, room
+
+def session_room():
+    """get_user_room() for the signed-in user, resolved once per request (and once per /api/batch)"""
+    if 'session_room' not in g:
+        g.session_room = get_user_room(session['user_id'])
+    return g.session_room
+
+def add_room_member(room_code, user_id, user_name):
+    """Put a user in a room, leaving their previous one; returns False if the room has closed"""
+    with room_lock:
+        room = voting_rooms.get(room_code)
+        if not room:
+            return False
+        previous = user_rooms.get(user_id)
+        if previous and previous != room_code:
+            remove_room_member(previous, user_id)
+        room['users'].add(user_id)
+        room['slots'].assign(user_id)
+        room['rotation'].add(user_id, user_name)
+        user_rooms[user_id] = room_code
+    # The session is valid; on a multi-node setup the login may have happened on another node
+    mark_present(user_id)
+    return True
+
+def remove_room_member(room_code, user_id):
+    """Take a user out of a room, closing the room once it is empty"""
+    with room_lock:
+        if user_rooms.get(user_id) == room_code:
+            del user_rooms[user_id]
+        room = voting_rooms.get(room_code)
+        if not room:
+            return
+        room['users'].discard(user_id)
+        room['rotation'].remove(user_id)
+        room['phase'].discard_member(user_id)
+        # Drop their proposal and their ballots on this round's proposals: boxes are bound to this room's slots
+        proposal_submissions.pop(user_id, None)
+        submission_votes.pop(user_id, None)
+        users_skipped_proposal.discard(user_id)
+        for proposer_user_id in room['users']:
+            box = submission_box(proposer_user_id, room)
+            if box:
+                box.withdraw(user_id)
+        prune_proposal_bodies()
+        if not room['users']:
+            close_room(room_code)
+        else:
+            advance_phase(room)
+
+def mark_present(user_id):
+    """Count a user as online and push back their presence deadline"""
+    presence_tracker.touch(user_id)
+    logged_in_users.add(user_id)
+
+def expire_absent_users(user_ids):
+    """Stop counting silent users, then let their rooms finish any phase they were holding up"""
+    for user_id in user_ids:
+        logged_in_users.discard(user_id)
+    for room_code in {user_rooms.get(user_id) for user_id in user_ids}:
+        room = voting_rooms.get(room_code)
+        if room:
+            advance_phase(room)
+
+presence_tracker = presence.PresenceTracker(PRESENCE_TIMEOUT, expire_absent_users)
+
+def submission_box(proposer_user_id, room, create=False):
+    """The proposer's ballot box if it belongs to the room's voter slots; with create, a new one replaces a missing or stale box"""
+    box = submission_votes.get(proposer_user_id)
+    if box is not None and box.slots is room['slots']:
+        return box
+    if not create:
+        return None
+    with room_lock:
+        box = submission_votes.get(proposer_user_id)
+        if box is None or box.slots is not room['slots']:
+            box = submission_votes[proposer_user_id] = BallotBox(room['slots'])
+        return box
+
+def find_tied_proposals(room):
+    """Proposer ids in the room whose YES and NO counts are equal"""
+    tied = []
+    for proposer_user_id in list(room['users']):
+        box = submission_box(proposer_user_id, room)
+        if proposer_user_id in proposal_submissions and box:
+            votes_data = box.totals()
+            if votes_data['yes'] == votes_data['no'] and votes_data['yes'] > 0:
+                tied.append(proposer_user_id)
+    return tied
+
+def record_ballot(kind, proposal_id, user_id, vote_choice):
+    """Append a ballot to the audit ledger and return the voter's receipt"""
+    if vote_ledger is None:
+        return None
+    index, leaf = vote_ledger.append({
+        'kind': kind,
+        'room': user_rooms.get(user_id),
+        'proposal': proposal_id,
+        'voter': user_id,
+        'vote': vote_choice,
+        'ts': round(time.time(), 3)
+    })
+    return {'index': index, 'leaf': leaf.hex()}
+
+def advance_phase(room):
+    """Let the room's phase machine move on if its current phase is complete"""
+    with room_lock:
+        active_users = room['users'] & logged_in_users
+        return room['phase'].advance(active_users, lambda: find_tied_proposals(room))
+
+def record_phase_event(room, done, user_id):
+    """Add a member to one of the room's phase sets, then advance; a user who left meanwhile is not added"""
+    with room_lock:
+        if user_id in room['users']:
+            done.add(user_id)
+        advance_phase(room)
+
+def barrier_progress(room, done):
+    """(done, total) for a room barrier, both counted among the room's logged-in members"""
+    active_users = room['users'] & logged_in_users
+    return len(active_users & done), len(active_users)
+
+def start_next_round(room):
+    """Clear a finished round's proposals and ballots for this room only; returns False unless the round was final"""
+    with room_lock:
+        if room['phase'].phase != tiebreak.FINAL:
+            return False
+        for uid in room['users']:
+            proposal_submissions.pop(uid, None)
+            submission_votes.pop(uid, None)
+            users_skipped_proposal.discard(uid)
+        prune_proposal_bodies()
+        room['phase'].reset()
+        return True
+
+def close_room(room_code):
+    """Delete a room, keeping its unsaved proposer history for the next flush"""
+    room = voting_rooms.pop(room_code, None)
+    rooms_index.remove(room_code)
+    if not room:
+        return
+    unsaved_history.extend(room['rotation'].take_unsaved(room_code))
+
+def flush_proposer_history():
+    """Write every room's new proposer picks to proposer_history in one batch; returns the row count"""
+    with room_lock:
+        rows = unsaved_history[:]
+        del unsaved_history[:]
+        for room_code, room in list(voting_rooms.items()):
+            rows.extend(room['rotation'].take_unsaved(room_code))
+    if not rows:
+        return 0
+    # The write happens outside room_lock so joins and phase changes never wait on the database
+    db = get_db()
+    try:
+        db.executemany(
+            'INSERT INTO proposer_history (room_code, user_id, cycle, picked_date) VALUES (?, ?, ?, ?)',
+            rows
+        )
+        db.commit()
+    except sqlite3.Error as e:
+        print(f'Saving {len(rows)} proposer picks failed, retrying on the next flush: {e}')
+        with room_lock:
+            unsaved_history[:0] = rows[-HISTORY_BACKLOG:]
+        return 0
+    finally:
+        db.close()
+    return len(rows)
+
+def _flush_history_periodically():
+    while True:
+        time.sleep(HISTORY_FLUSH_INTERVAL)
+        flush_proposer_history()
 
 # Security decorator to require authentication
 def login_required(f):
@@ -40,16 +392,141 @@ def api_login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Admission control for endpoints the templates poll
+def too_many_requests(retry_after):
+    response = jsonify({'error': 'Too many requests', 'next_poll_ms': retry_after * 1000})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def poll_endpoint(base_ms):
+    """Rate-limit a polling endpoint per session and attach a next_poll_ms hint.
+
+    Handlers may set g.poll_progress = (done, total) so the hint shrinks
+    when the phase is about to complete.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # A batch is admitted once for all the polls in it
+            if not g.get('batch_admitted'):
+                admitted, retry_after = admission.admit(session.get('user_id') or request.remote_addr)
+                if not admitted:
+                    return too_many_requests(retry_after)
+            
+            g.poll_progress = None
+            response = make_response(f(*args, **kwargs))
+            next_poll_ms = admission.next_poll_ms(base_ms, g.poll_progress)
+            response.headers['X-Next-Poll-Ms'] = str(next_poll_ms)
+            data = response.get_json(silent=True)
+            if isinstance(data, dict):
+                data['next_poll_ms'] = next_poll_ms
+                response.set_data(app.json.dumps(data))
+            return response
+        return decorated_function
+    return decorator
+
+# GET endpoints /api/batch may answer in-process (read-only, scoped to the session's user)
+BATCHABLE = set()
+MAX_BATCH = 10
+
+def batchable(f):
+    BATCHABLE.add(f.__name__)
+    return f
+
+@app.before_request
+def track_request_start():
+    g.request_started = time.perf_counter()
+    admission.begin()
+    if profiler.wants(forced=request.headers.get('X-Profile') == '1' and is_admin_request()):
+        g.profile = profiler.begin(request.endpoint, request.method, request.path)
+
+@app.before_request
+def track_presence():
+    # Any authenticated request is a sign of life, not just /api/heartbeat
+    user_id = session.get('user_id')
+    if user_id is not None and request.endpoint != 'static':
+        mark_present(user_id)
+
+@app.after_request
+def record_response_status(response):
+    if 'profile' in g:
+        g.profile.status = response.status_code
+    return response
+
+@app.after_request
+def add_data_age(response):
+    # Seconds since the replica a read was served from was last known current (0 for the live database)
+    if 'read_db' in g:
+        generation = g.read_generation
+        response.headers['X-Data-Age'] = f'{generation.age():.1f}' if generation else '0'
+    return response
+
+@app.teardown_request
+def release_read_db(exc):
+    db = g.pop('read_db', None)
+    if db is not None:
+        generation = g.pop('read_generation', None)
+        if generation:
+            replica.release(db, generation)
+        else:
+            db.close()
+
+@app.teardown_request
+def track_request_end(exc):
+    if 'request_started' in g:
+        elapsed = time.perf_counter() - g.request_started
+        admission.end(elapsed)
+        if 'profile' in g:
+            profiler.finish(g.profile, elapsed, g.profile.status or 500)
+
+# Security decorator for admin and node-to-node endpoints
+def is_admin_request():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 def get_db():
-    db = sqlite3.connect(DATABASE, timeout=10.0, check_same_thread=False)
+    # Connections opened while a request is being profiled record their SQL
+    factory = profiling.TracedConnection if profiling.active() else sqlite3.Connection
+    db = sqlite3.connect(DATABASE, timeout=10.0, check_same_thread=False, factory=factory)
     db.row_factory = sqlite3.Row
     db.isolation_level = 'DEFERRED'
     return db
 
+def get_read_db():
+    """Connection for read-only result and history queries, held until the request ends.
+
+    Served from the read replica, unless this session has written since the
+    replica was copied (so users see their own votes) or none is published yet.
+    """
+    if 'read_db' not in g:
+        # Profiled requests get a traced replica connection too, like get_db()
+        db, generation = replica.lease(profiling.TracedConnection if profiling.active() else sqlite3.Connection)
+        if generation is not None and session.get('db_write_at', 0) >= generation.as_of:
+            replica.release(db, generation)
+            db, generation = None, None
+        g.read_db, g.read_generation = (db, generation) if db is not None else (get_db(), None)
+    return g.read_db
+
+def note_db_write():
+    """Send this session's next reads to the live database until the replica catches up"""
+    session['db_write_at'] = time.time()
+
 def init_db():
     with app.app_context():
         db = get_db()
         db.executescript('''
+            PRAGMA auto_vacuum = INCREMENTAL; -- Only takes effect on a new database; see maintenance.py vacuum --convert
+            PRAGMA journal_mode = WAL; -- Readers (and the replica copy) never block vote commits; persists in the file
+            
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT UNIQUE NOT NULL,
@@ -77,6 +554,21 @@ def init_db():
                 FOREIGN KEY(user_id) REFERENCES users(id),
                 UNIQUE(proposal_id, user_id)
             );
+            
+            CREATE TABLE IF NOT EXISTS proposer_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                room_code TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                cycle INTEGER NOT NULL,
+                picked_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+            
+            -- Query plans for these are checked by sql_benchmark.py
+            CREATE INDEX IF NOT EXISTS idx_users_created_date ON users(created_date);
+            CREATE INDEX IF NOT EXISTS idx_proposals_created_date ON proposals(created_date);
+            CREATE INDEX IF NOT EXISTS idx_votes_proposal_vote ON votes(proposal_id, vote);
+            CREATE INDEX IF NOT EXISTS idx_votes_user ON votes(user_id);
         ''')
         db.commit()
         db.close()
@@ -84,16 +576,19 @@ def init_db():
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+def password_matches(user_id, password):
+    """Check a ballot's password against the user's; the connection is closed either way"""
+    db = get_db()
+    try:
+        user = db.execute('SELECT password FROM users WHERE id = ?', (user_id,)).fetchone()
+    finally:
+        db.close()
+    return bool(user) and user['password'] == hash_password(password or '')
+
 @app.route('/lobby')
 @login_required
 def lobby_page():
-    # Reset voting state when entering lobby
-    global ready_users, proposal_submissions, submission_votes, users_finished_voting
-    # Don't clear ready_users if we're just refreshing
-    # But clear voting state from previous round
-    proposal_submissions.clear()
-    submission_votes.clear()
-    users_finished_voting.clear()
+    # A plain page load changes nothing; the room's next round starts from the ready/back-to-lobby POSTs
     # Determine user's current room (if any)
     user_id = session.get('user_id')
     room_code = None
@@ -114,9 +609,6 @@ def room_page():
 @app.route('/voting')
 @login_required
 def voting_page():
-    global tiebreak_rejected
-    # Reset tiebreak flag for new voting session
-    tiebreak_rejected = False
     return render_template('voting.html', user_name=session.get('user_name'), user_position=session.get('user_position'), user_id=session.get('user_id'))
 
 @app.route('/tiebreaker')
@@ -156,8 +648,8 @@ def login_page():
                 session['user_name'] = user['name']
                 session['user_position'] = user['position']
                 # Add user to logged_in_users set
-                logged_in_users.add(user['id'])
-                return jsonify({'success': True, 'message': 'Logged in successfully'}), 200
+                mark_present(user['id'])
+                return jsonify({'success': True, 'message': 'Logged in successfully', 'user_id': user['id']}), 200
             else:
                 return jsonify({'error': 'Invalid credentials'}), 401
         finally:
@@ -192,9 +684,9 @@ def register():
             session['user_name'] = name
             session['user_position'] = position
             # Add user to logged_in_users set
-            logged_in_users.add(user_id)
+            mark_present(user_id)
             
-            return jsonify({'success': True, 'message': 'Registered successfully'}), 201
+            return jsonify({'success': True, 'message': 'Registered successfully', 'user_id': user_id}), 201
         finally:
             db.close()
     except sqlite3.IntegrityError:
@@ -204,30 +696,22 @@ def register():
 @app.route('/api/room/create', methods=['POST'])
 @api_login_required
 def create_room():
-    import random
-    import string
-    from datetime import datetime
-    
     data = request.json
     room_name = data.get('room_name', f"Room {random.randint(1000, 9999)}")
     passcode = data.get('passcode', '')
     
     user_id = session['user_id']
     
-    # Generate unique room code
-    room_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    
-    # Create room
-    voting_rooms[room_code] = {
-        'name': room_name,
-        'passcode': passcode,
-        'created_by': user_id,
-        'users': {user_id},
-        'created_date': datetime.now().isoformat()
-    }
+    # Generate unique room code in a shard this node owns
+    shards = list(owned_shards())
+    room_code = sharding.make_room_code(shards)
+    while room_code in voting_rooms:
+        room_code = sharding.make_room_code(shards)
     
-    # Add user to room
-    user_rooms[user_id] = room_code
+    # Create room and add the creator (under the lock, so nobody can close it in between)
+    with room_lock:
+        open_room(room_code, new_room_state(room_name, passcode, user_id))
+        add_room_member(room_code, user_id, session['user_name'])
     
     return jsonify({
         'success': True,
@@ -255,9 +739,9 @@ def join_room():
     if room['passcode'] and room['passcode'] != passcode:
         return jsonify({'error': 'Invalid passcode'}), 401
     
-    # Add user to room
-    room['users'].add(user_id)
-    user_rooms[user_id] = room_code
+    # Add user to room (leaving any other room); it may have closed since the check above
+    if not add_room_member(room_code, user_id, session['user_name']):
+        return jsonify({'error': 'Room not found'}), 404
     
     return jsonify({
         'success': True,
@@ -267,16 +751,13 @@ def join_room():
     }), 200
 
 @app.route('/api/room/current', methods=['GET'])
+@batchable
 @api_login_required
 def get_current_room():
-    user_id = session['user_id']
-    
-    if user_id not in user_rooms:
+    room_code, room = session_room()
+    if not room:
         return jsonify({'error': 'User not in any room'}), 404
     
-    room_code = user_rooms[user_id]
-    room = voting_rooms[room_code]
-    
     return jsonify({
         'room_code': room_code,
         'room_name': room['name'],
@@ -285,6 +766,34 @@ def get_current_room():
         'created_date': room['created_date']
     }), 200
 
+@app.route('/api/rooms', methods=['GET'])
+@api_login_required
+def list_rooms():
+    """Browse open rooms by name (or code) prefix, one page at a time"""
+    try:
+        room_codes, next_cursor = rooms_index.search(
+            request.args.get('prefix', ''),
+            by=request.args.get('by', 'name'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 20, type=int)
+        )
+    except room_directory.DirectoryError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rooms = []
+    for room_code in room_codes:
+        room = voting_rooms.get(room_code)
+        if room:  # Closed since the index was read
+            rooms.append({
+                'room_code': room_code,
+                'room_name': room['name'],
+                'users_count': len(room['users']),
+                'has_passcode': bool(room['passcode']),
+                'created_date': room['created_date'],
+                'phase': room['phase'].phase
+            })
+    return jsonify({'rooms': rooms, 'next_cursor': next_cursor, 'total_rooms': len(rooms_index)})
+
 @app.route('/api/room/info/<room_code>', methods=['GET'])
 @api_login_required
 def get_room_info(room_code):
@@ -308,36 +817,79 @@ def get_room_info(room_code):
 def leave_room():
     user_id = session['user_id']
     
-    if user_id not in user_rooms:
+    room_code = user_rooms.get(user_id)
+    if not room_code:
         return jsonify({'error': 'User not in any room'}), 404
     
-    room_code = user_rooms[user_id]
-    room = voting_rooms[room_code]
-    
-    # Remove user from room
-    room['users'].discard(user_id)
-    del user_rooms[user_id]
-    
-    # Delete room if empty
-    if not room['users']:
-        del voting_rooms[room_code]
+    # Remove user from room (deletes the room if it is now empty)
+    remove_room_member(room_code, user_id)
     
     return jsonify({'success': True, 'message': 'Left room successfully'}), 200
 
+@app.route('/api/heartbeat', methods=['POST'])
+@api_login_required
+def heartbeat():
+    """Keep the user counted as present (track_presence already did the work)"""
+    return jsonify({
+        'success': True,
+        'next_heartbeat_ms': int(HEARTBEAT_INTERVAL * 1000),
+        'timeout_ms': int(PRESENCE_TIMEOUT * 1000)
+    })
+
+@app.route('/api/batch', methods=['GET'])
+@api_login_required
+def batch():
+    """Answer several GETs in one round trip: /api/batch?path=/api/users&path=/api/ready-status
+
+    Each path is dispatched straight to its view in this request, so the
+    session, the room lookup and admission control are resolved once.
+    """
+    paths = list(dict.fromkeys(request.args.getlist('path')))
+    if not paths or len(paths) > MAX_BATCH:
+        return jsonify({'error': f'Send 1-{MAX_BATCH} path parameters'}), 400
+    
+    admitted, retry_after = admission.admit(session['user_id'])
+    if not admitted:
+        return too_many_requests(retry_after)
+    g.batch_admitted = True
+    
+    adapter = app.create_url_adapter(request)
+    responses = {}
+    hints = []
+    for path in paths:
+        if '?' in path:
+            responses[path] = {'status': 400, 'body': {'error': 'Query strings are not supported in a batch'}}
+            continue
+        try:
+            endpoint, view_args = adapter.match(path, method='GET')
+        except HTTPException:
+            responses[path] = {'status': 404, 'body': {'error': 'Not found'}}
+            continue
+        if endpoint not in BATCHABLE:
+            responses[path] = {'status': 400, 'body': {'error': 'Not available in a batch'}}
+            continue
+        response = app.make_response(app.view_functions[endpoint](**view_args))
+        if 'X-Next-Poll-Ms' in response.headers:
+            hints.append(int(response.headers['X-Next-Poll-Ms']))
+        responses[path] = {'status': response.status_code, 'body': response.get_json(silent=True)}
+    
+    result = {'responses': responses}
+    if hints:
+        # Poll again when the most urgent part of the batch is due
+        result['next_poll_ms'] = min(hints)
+    response = jsonify(result)
+    if hints:
+        response.headers['X-Next-Poll-Ms'] = str(result['next_poll_ms'])
+    return response
+
 @app.route('/api/users', methods=['GET'])
+@batchable
 @api_login_required
+@poll_endpoint(2000)
 def get_users():
-    user_id = session['user_id']
-    
-    # Check if user is in a room
-    if user_id not in user_rooms:
-        return jsonify({'error': 'User not in any room'}), 400
-    
-    room_code = user_rooms[user_id]
-    room = voting_rooms.get(room_code)
-    
+    room_code, room = session_room()
     if not room:
-        return jsonify({'error': 'Room not found'}), 404
+        return jsonify({'error': 'User not in any room'}), 400
     
     db = get_db()
     users = db.execute('SELECT id, name, position FROM users ORDER BY created_date').fetchall()
@@ -364,28 +916,25 @@ def mark_user_ready(user_id):
     
     # Add to global ready_users set
     ready_users.add(user_id)
+    _, room = get_user_room(user_id)
+    if room:
+        start_next_round(room)
     
     return jsonify({'success': True}), 200
 
 @app.route('/api/ready-status', methods=['GET'])
+@batchable
 @api_login_required
+@poll_endpoint(2000)
 def get_ready_status():
-    user_id = session['user_id']
-    
-    # Check if user is in a room
-    if user_id not in user_rooms:
-        return jsonify({'error': 'User not in any room'}), 400
-    
-    room_code = user_rooms[user_id]
-    room = voting_rooms.get(room_code)
-    
+    room_code, room = session_room()
     if not room:
-        return jsonify({'error': 'Room not found'}), 404
+        return jsonify({'error': 'User not in any room'}), 400
     
     # Count only users in the same room and logged in
-    total_users = len(room['users'] & logged_in_users)
-    ready_count = len(ready_users & room['users'] & logged_in_users)
+    ready_count, total_users = barrier_progress(room, ready_users)
     all_ready = ready_count == total_users and total_users > 0
+    g.poll_progress = (ready_count, total_users)
     
     return jsonify({'ready': ready_count, 'total': total_users, 'all_ready': all_ready})
 
@@ -405,34 +954,127 @@ def reset_ready_status():
     if not room:
         return jsonify({'error': 'Room not found'}), 404
     
-    # Only clear proposals for users in THIS room
-    room_users = room['users']
-    for uid in list(proposal_submissions.keys()):
-        if uid in room_users:
-            proposal_submissions.pop(uid, None)
-    
-    for uid in list(submission_votes.keys()):
-        if uid in room_users:
-            submission_votes.pop(uid, None)
-    
-    for uid in list(users_skipped_proposal):
-        if uid in room_users:
-            users_skipped_proposal.discard(uid)
+    start_next_round(room)
     
     return jsonify({'success': True}), 200
 
 @app.route('/api/random-proposer', methods=['GET'])
 @api_login_required
 def get_random_proposer():
-    import random
-    db = get_db()
-    users = db.execute('SELECT id, name FROM users').fetchall()
+    """Pick the next proposer from the room's rotation (no database access)"""
+    room_code, room = get_user_room(session['user_id'])
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
     
-    if not users:
+    rotation = room['rotation']
+    selected = rotation.pick()
+    if selected is None:
         return jsonify({'error': 'No users available'}), 404
     
-    selected = random.choice(users)
-    return jsonify({'user_id': selected['id'], 'user_name': selected['name']})
+    return jsonify({
+        'user_id': selected,
+        'user_name': rotation.names.get(selected),
+        'cycle': rotation.cycle,
+        'remaining_in_cycle': rotation.remaining()
+    })
+
+@app.route('/api/room/proposer-weights', methods=['POST'])
+@api_login_required
+def set_proposer_weights():
+    """Room creator sets optional proposer weights: {"weights": {user_id: weight}}"""
+    user_id = session['user_id']
+    room_code, room = get_user_room(user_id)
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    if room['created_by'] != user_id:
+        return jsonify({'error': 'Only the room creator can set weights'}), 403
+    
+    weights = (request.json or {}).get('weights', {})
+    try:
+        weights = {int(uid): float(w) for uid, w in weights.items()}
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'Weights must map user ids to numbers'}), 400
+    
+    if any(w <= 0 for w in weights.values()):
+        return jsonify({'error': 'Weights must be positive'}), 400
+    
+    room['rotation'].set_weights(weights)
+    return jsonify({'success': True, 'weights': room['rotation'].weights}), 200
+
+@app.route('/api/room/proposer-history', methods=['GET'])
+@batchable
+@api_login_required
+def get_proposer_history():
+    """Recent proposer picks for the user's room"""
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    rotation = room['rotation']
+    return jsonify({
+        'cycle': rotation.cycle,
+        'remaining_in_cycle': rotation.remaining(),
+        'history': [
+            {'user_id': uid, 'user_name': name, 'cycle': cycle, 'picked_at': picked_at}
+            for uid, name, cycle, picked_at in rotation.history
+        ]
+    })
+
+@app.route('/api/room/<room_code>/analytics', methods=['GET'])
+@api_login_required
+def get_room_analytics(room_code):
+    """Turnout, abstention and yes/no split by position, plus agreement between delegates"""
+    started = time.perf_counter()
+    room_code = room_code.upper()
+    room = voting_rooms.get(room_code)
+    if not room:
+        return jsonify({'error': 'Room not found'}), 404
+    if session['user_id'] not in room['users']:
+        return jsonify({'error': 'Not a member of this room'}), 403
+    
+    voter_ids = sorted(room['users'])
+    db = get_read_db()
+    positions = {}
+    db_ballots = {}  # Format: {proposal_id: {'title': str, 'voters': {user_id: choice}}}
+    # Chunked so large rooms stay under SQLite's bound-parameter limit
+    for start in range(0, len(voter_ids), 500):
+        chunk = voter_ids[start:start + 500]
+        marks = ','.join('?' * len(chunk))
+        for row in db.execute(f'SELECT id, position FROM users WHERE id IN ({marks})', chunk):
+            positions[row['id']] = row['position']
+        for row in db.execute(f'''
+            SELECT v.proposal_id, v.user_id, v.vote, p.title FROM votes v
+            JOIN proposals p ON p.id = v.proposal_id
+            WHERE v.user_id IN ({marks})
+        ''', chunk):
+            entry = db_ballots.setdefault(row['proposal_id'], {'title': row['title'], 'voters': {}})
+            entry['voters'][row['user_id']] = row['vote']
+    
+    # This round's submissions first, then saved proposals room members voted on
+    proposals = []
+    boxes = []
+    for proposer_id in voter_ids:
+        if proposer_id in proposal_submissions:
+            proposals.append({'source': 'round', 'id': proposer_id, 'title': proposal_submissions[proposer_id]['title']})
+            boxes.append(submission_box(proposer_id, room) or BallotBox(room['slots']))
+    db_columns = []
+    for proposal_id in sorted(db_ballots):
+        proposals.append({'source': 'proposal', 'id': proposal_id, 'title': db_ballots[proposal_id]['title']})
+        db_columns.append(db_ballots[proposal_id]['voters'])
+    
+    voters = np.array(voter_ids, dtype=np.int64)
+    slot_rows = np.array([room['slots'].assign(uid) for uid in voter_ids], dtype=np.int64)
+    matrix = np.hstack([
+        analytics.ballot_box_matrix(boxes, slot_rows),
+        analytics.choice_matrix(voters, db_columns)
+    ])
+    result = analytics.room_analytics(matrix, [positions.get(uid, 'Unknown') for uid in voter_ids], voters)
+    for proposal, totals in zip(proposals, result['by_proposal']):
+        totals.update(proposal)
+    result['room_code'] = room_code
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(result)
 
 @app.route('/api/proposal-submission', methods=['POST'])
 @api_login_required
@@ -448,12 +1090,7 @@ def submit_proposal_data():
     user_name = session['user_name']
     
     # Store proposal submission
-    proposal_submissions[user_id] = {
-        'title': title,
-        'description': description,
-        'user_name': user_name,
-        'user_id': user_id
-    }
+    store_proposal(user_id, title, description, user_name)
     
     # Remove from skipped set if they were skipping
     users_skipped_proposal.discard(user_id)
@@ -470,82 +1107,81 @@ def skip_proposal():
     users_skipped_proposal.add(user_id)
     
     # Remove from proposals if they submitted earlier
-    proposal_submissions.pop(user_id, None)
+    if proposal_submissions.pop(user_id, None):
+        prune_proposal_bodies()
     
     return jsonify({'success': True}), 200
 
 @app.route('/api/all-proposals-submitted', methods=['GET'])
+@batchable
 @api_login_required
+@poll_endpoint(1000)
 def check_all_proposals():
-    user_id = session['user_id']
-    
-    # Get current user's room
-    if user_id not in user_rooms:
-        return jsonify({'error': 'User not in any room'}), 400
-    
-    room_code = user_rooms[user_id]
-    room = voting_rooms.get(room_code)
-    
+    room_code, room = session_room()
     if not room:
-        return jsonify({'error': 'Room not found'}), 404
+        return jsonify({'error': 'User not in any room'}), 400
     
-    # Count only users in the same room
-    total_users = len(room['users'] & logged_in_users)
-    # Count users who submitted OR skipped
-    room_users = room['users']
-    submitted_or_skipped = len([uid for uid in room_users if uid in proposal_submissions or uid in users_skipped_proposal])
+    # Count only logged-in users in the same room, and of those the ones who submitted OR skipped
+    active_users = room['users'] & logged_in_users
+    total_users = len(active_users)
+    submitted_or_skipped = len([uid for uid in active_users if uid in proposal_submissions or uid in users_skipped_proposal])
+    g.poll_progress = (submitted_or_skipped, total_users)
     
     return jsonify({'submitted': submitted_or_skipped, 'total': total_users, 'all_submitted': submitted_or_skipped == total_users})
 
 @app.route('/api/proposals-to-vote', methods=['GET'])
+@batchable
 @api_login_required
 def get_proposals_to_vote():
     current_user_id = session.get('user_id')
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
     
-    # Convert proposal_submissions to list, excluding own proposal, with randomized order
-    proposals_list = [p for user_id, p in proposal_submissions.items() if user_id != current_user_id]
+    # Convert the room's proposal_submissions to list, excluding own proposal, with randomized order
+    proposals_list = [p for user_id, p in list(proposal_submissions.items()) if user_id != current_user_id and user_id in room['users']]
     
-    import random
     random.shuffle(proposals_list)
-    
+
     return jsonify(proposals_list)
 
+@app.route('/api/proposal-body/<content_hash>', methods=['GET'])
+@api_login_required
+def get_proposal_body(content_hash):
+    """The description stored under a body_hash from the proposal lists"""
+    description = proposal_bodies.get(content_hash)
+    if description is None:
+        return jsonify({'error': 'Proposal body not found'}), 404
+    # The hash names this exact text, so the browser never needs to ask again
+    response = jsonify({'hash': content_hash, 'description': description})
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    response.set_etag(content_hash)
+    return response.make_conditional(request)
+
 @app.route('/logout')
 def logout():
     user_id = session.get('user_id')
     # Clear user from all tracking sets for safe state management
     if user_id in logged_in_users:
         logged_in_users.discard(user_id)
+    presence_tracker.forget(user_id)
     if user_id in ready_users:
         ready_users.discard(user_id)
-    if user_id in users_finished_voting:
-        users_finished_voting.discard(user_id)
-    if user_id in users_finished_tiebreaker:
-        users_finished_tiebreaker.discard(user_id)
-    if user_id in users_agreed_to_tiebreak:
-        users_agreed_to_tiebreak.discard(user_id)
-    if user_id in users_arrived_tiebreak:
-        users_arrived_tiebreak.discard(user_id)
-    # Remove user from any room they are in
+    # Remove user from any room they are in (also clears their phase state)
     try:
-        if user_id in user_rooms:
-            room_code = user_rooms.get(user_id)
-            room = voting_rooms.get(room_code)
-            if room:
-                room['users'].discard(user_id)
-                # delete room if empty
-                if not room['users']:
-                    del voting_rooms[room_code]
-            del user_rooms[user_id]
+        room_code = user_rooms.get(user_id)
+        if room_code:
+            remove_room_member(room_code, user_id)
     except Exception:
         pass
     session.clear()
     return redirect(url_for('login_page'))
 
 @app.route('/api/proposals', methods=['GET'])
+@batchable
 @api_login_required
 def get_proposals():
-    db = get_db()
+    db = get_read_db()
     proposals = db.execute('SELECT * FROM proposals ORDER BY created_date DESC').fetchall()
     return jsonify([dict(p) for p in proposals])
 
@@ -567,6 +1203,7 @@ def create_proposal():
         (title, description, proposed_by)
     )
     db.commit()
+    note_db_write()
     return jsonify({
         'id': cursor.lastrowid,
         'title': title,
@@ -598,14 +1235,16 @@ def vote(proposal_id):
             (proposal_id, user_id, vote_choice)
         )
         db.commit()
-        return jsonify({'success': True}), 201
+        note_db_write()
+        receipt = record_ballot('proposal', proposal_id, user_id, vote_choice)
+        return jsonify({'success': True, 'receipt': receipt}), 201
     except sqlite3.IntegrityError:
         return jsonify({'error': 'You have already voted on this proposal'}), 400
 
 @app.route('/api/proposals/<int:proposal_id>/results', methods=['GET'])
 @api_login_required
 def get_results(proposal_id):
-    db = get_db()
+    db = get_read_db()
     
     votes = db.execute('''
         SELECT vote, COUNT(*) as count FROM votes 
@@ -634,51 +1273,55 @@ def vote_on_submission(proposer_user_id):
     user_id = session.get('user_id')
     
     # Verify password
-    db = get_db()
-    user = db.execute('SELECT password FROM users WHERE id = ?', (user_id,)).fetchone()
-    
-    if not user or user['password'] != hash_password(password):
+    if not password_matches(user_id, password):
         return jsonify({'error': 'Invalid password'}), 401
     
     if vote_choice not in ['yes', 'no', 'abstain']:
         return jsonify({'error': 'Invalid vote choice'}), 400
     
-    # Initialize vote entry if needed
-    if proposer_user_id not in submission_votes:
-        submission_votes[proposer_user_id] = {'yes': 0, 'no': 0, 'abstain': 0, 'voters': set()}
+    room_code, room = get_user_room(user_id)
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
     
-    # Check if user already voted on this submission
-    if user_id in submission_votes[proposer_user_id]['voters']:
-        return jsonify({'error': 'You have already voted on this proposal'}), 400
+    # Only proposals from the voter's own room: the box is bound to this room's voter slots
+    if proposer_user_id not in room['users'] or proposer_user_id not in proposal_submissions:
+        return jsonify({'error': 'Proposal not found in your room'}), 404
     
-    # Record the vote
-    submission_votes[proposer_user_id][vote_choice] += 1
-    submission_votes[proposer_user_id]['voters'].add(user_id)
+    # Initialize vote entry if needed (under room_lock, so two first voters share one box)
+    box = submission_box(proposer_user_id, room, create=True)
     
-    return jsonify({'success': True}), 201
+    # Record the vote (a set bit means the user already voted on this submission)
+    if not box.cast(user_id, vote_choice):
+        return jsonify({'error': 'You have already voted on this proposal'}), 400
+    receipt = record_ballot('regular', proposer_user_id, user_id, vote_choice)
+    
+    return jsonify({'success': True, 'receipt': receipt}), 201
 
 @app.route('/api/submission-results/<int:proposer_user_id>', methods=['GET'])
+@batchable
 @api_login_required
 def get_submission_results(proposer_user_id):
     # Return vote counts for this submission
     if proposer_user_id in submission_votes:
-        votes = submission_votes[proposer_user_id]
-        return jsonify({
-            'yes': votes['yes'],
-            'no': votes['no'],
-            'abstain': votes['abstain']
-        })
+        return jsonify(submission_votes[proposer_user_id].totals())
     else:
         return jsonify({'yes': 0, 'no': 0, 'abstain': 0})
 
 @app.route('/api/all-voting-results', methods=['GET'])
+@batchable
 @api_login_required
 def get_all_voting_results():
-    """Return all proposals with their aggregated vote results"""
+    """Return the room's proposals with their aggregated vote results"""
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
     results = []
     
-    for proposer_user_id, proposal_data in proposal_submissions.items():
-        votes = submission_votes.get(proposer_user_id, {'yes': 0, 'no': 0, 'abstain': 0})
+    for proposer_user_id, proposal_data in list(proposal_submissions.items()):
+        if proposer_user_id not in room['users']:
+            continue
+        box = submission_box(proposer_user_id, room)
+        votes = box.totals() if box else {'yes': 0, 'no': 0, 'abstain': 0}
         
         yes_count = votes['yes']
         no_count = votes['no']
@@ -697,7 +1340,7 @@ def get_all_voting_results():
         results.append({
             'proposer_id': proposer_user_id,
             'title': proposal_data['title'],
-            'description': proposal_data['description'],
+            'body_hash': proposal_data['body_hash'],
             'proposed_by': proposal_data['user_name'],
             'yes': yes_count,
             'no': no_count,
@@ -718,107 +1361,89 @@ def get_all_voting_results():
 @api_login_required
 def mark_voting_complete():
     """Mark current user as finished voting"""
-    user_id = session.get('user_id')
-    users_finished_voting.add(user_id)
+    room_code, room = get_user_room(session['user_id'])
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    record_phase_event(room, room['phase'].finished_voting, session['user_id'])
     return jsonify({'success': True}), 200
 
 @app.route('/api/check-all-voted', methods=['GET'])
+@batchable
 @api_login_required
+@poll_endpoint(1000)
 def check_all_voted():
     """Check if all users have finished voting"""
-    user_id = session['user_id']
-    if user_id not in user_rooms:
-        return jsonify({'error': 'User not in any room'}), 400
-    
-    room_code = user_rooms[user_id]
-    room = voting_rooms.get(room_code)
+    room_code, room = session_room()
     if not room:
-        return jsonify({'error': 'Room not found'}), 404
+        return jsonify({'error': 'User not in any room'}), 400
     
+    phase = room['phase']
     # Count only room members who are logged in
-    total_users = len(room['users'] & logged_in_users)
-    finished_users = len(users_finished_voting & room['users'])
-    
-    all_voted = finished_users == total_users and total_users > 0
+    finished_users, total_users = barrier_progress(room, phase.finished_voting)
+    g.poll_progress = (finished_users, total_users)
     
     return jsonify({
-        'all_voted': all_voted,
+        'all_voted': phase.is_past(tiebreak.VOTING),
         'finished': finished_users,
-        'total': total_users
+        'total': total_users,
+        'phase': phase.phase
     })
 
 @app.route('/api/mark-voted', methods=['POST'])
 @api_login_required
 def mark_voted():
     """Mark user as voted (for auto-voting when no proposals)"""
-    user_id = session.get('user_id')
-    users_finished_voting.add(user_id)
-    return jsonify({'success': True}), 200
-
-@app.route('/api/start-tiebreaker', methods=['POST'])
-@api_login_required
-def start_tiebreaker():
-    """Initialize tiebreaker voting"""
-    global tiebreaker_votes, users_finished_tiebreaker
-    tiebreaker_votes.clear()
-    users_finished_tiebreaker.clear()
-    return jsonify({'success': True}), 200
-
-@app.route('/api/reset-tiebreak-agreement', methods=['POST'])
-@api_login_required
-def reset_tiebreak_agreement():
-    """Reset tiebreak agreement after all users loaded tiebreaker page"""
-    global users_agreed_to_tiebreak
-    users_agreed_to_tiebreak.clear()
-    return jsonify({'success': True}), 200
+    return mark_voting_complete()
 
 @app.route('/api/agree-to-tiebreak', methods=['POST'])
 @api_login_required
 def agree_to_tiebreak():
     """User agrees to break tie"""
-    user_id = session.get('user_id')
-    users_agreed_to_tiebreak.add(user_id)
-    return jsonify({'success': True}), 200
+    room_code, room = get_user_room(session['user_id'])
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    record_phase_event(room, room['phase'].agreed, session['user_id'])
+    return jsonify({'success': True, 'phase': room['phase'].phase}), 200
 
 @app.route('/api/decline-tiebreak', methods=['POST'])
 @api_login_required
 def decline_tiebreak():
-    """User declines to break tie - reject tiebreak for everyone"""
-    global tiebreak_rejected
-    user_id = session.get('user_id')
-    # Mark tiebreak as rejected - everyone should return to results
-    tiebreak_rejected = True
-    # Remove from agreed set (if they were in it)
-    users_agreed_to_tiebreak.discard(user_id)
-    return jsonify({'success': True}), 200
+    """User declines to break tie - reject tiebreak for everyone in the room"""
+    room_code, room = get_user_room(session['user_id'])
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    phase = room['phase']
+    if phase.phase in (tiebreak.TIE_DETECTED, tiebreak.AGREEMENT):
+        # Mark tiebreak as rejected - everyone should return to results
+        phase.rejected = True
+        phase.agreed.discard(session['user_id'])
+        advance_phase(room)
+    return jsonify({'success': True, 'phase': phase.phase}), 200
 
 @app.route('/api/check-tiebreak-agreement', methods=['GET'])
+@batchable
 @api_login_required
+@poll_endpoint(1000)
 def check_tiebreak_agreement():
     """Check if all users agreed to break tie"""
-    user_id = session['user_id']
-    if user_id not in user_rooms:
-        return jsonify({'error': 'User not in any room'}), 400
-    
-    room_code = user_rooms[user_id]
-    room = voting_rooms.get(room_code)
+    room_code, room = session_room()
     if not room:
-        return jsonify({'error': 'Room not found'}), 404
-    
-    # Get all room members who are currently logged in
-    room_users = room['users']
-    total_users = len([uid for uid in room_users if uid in logged_in_users])
-    
-    # Count how many have agreed
-    agreed_users = len([uid for uid in room_users if uid in users_agreed_to_tiebreak])
+        return jsonify({'error': 'User not in any room'}), 400
     
-    all_agreed = agreed_users == total_users and total_users > 0
+    phase = room['phase']
+    # Count only room members who are logged in
+    agreed_users, total_users = barrier_progress(room, phase.agreed)
+    g.poll_progress = (agreed_users, total_users)
     
     return jsonify({
-        'all_agreed': all_agreed,
+        'all_agreed': phase.is_past(tiebreak.AGREEMENT) and not phase.rejected,
         'agreed': agreed_users,
         'total': total_users,
-        'rejected': tiebreak_rejected  # If any user declined, return rejected flag
+        'rejected': phase.rejected,  # If any user declined, return rejected flag
+        'phase': phase.phase
     })
 
 
@@ -826,67 +1451,48 @@ def check_tiebreak_agreement():
 @api_login_required
 def arrived_tiebreaker():
     """Mark that a user has loaded the tiebreaker page"""
-    user_id = session.get('user_id')
-    users_arrived_tiebreak.add(user_id)
-    
-    if user_id not in user_rooms:
-        return jsonify({'error': 'User not in any room'}), 400
-    
-    room_code = user_rooms[user_id]
-    room = voting_rooms.get(room_code)
+    room_code, room = get_user_room(session['user_id'])
     if not room:
-        return jsonify({'error': 'Room not found'}), 404
+        return jsonify({'error': 'User not in any room'}), 400
     
-    # Count only room members who are logged in
-    total_users = len(room['users'] & logged_in_users)
-    arrived = len(users_arrived_tiebreak & room['users'])
-    all_arrived = arrived == total_users and total_users > 0
-    # If all arrived, initialize tiebreaker state and clear agreements
-    if all_arrived:
-        tiebreaker_votes.clear()
-        users_finished_tiebreaker.clear()
-        users_agreed_to_tiebreak.clear()
-    return jsonify({'arrived': arrived, 'total': total_users, 'all_arrived': all_arrived}), 200
+    record_phase_event(room, room['phase'].arrived, session['user_id'])
+    return check_arrived()
 
 @app.route('/api/check-arrived', methods=['GET'])
+@batchable
 @api_login_required
+@poll_endpoint(1000)
 def check_arrived():
     """Check arrival counts for tiebreaker page"""
-    db = get_db()
-    total_users = db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
-    arrived = len(users_arrived_tiebreak)
-    all_arrived = arrived == total_users and total_users > 0
-    # If all arrived, ensure tiebreaker is initialized
-    if all_arrived:
-        tiebreaker_votes.clear()
-        users_finished_tiebreaker.clear()
-        users_agreed_to_tiebreak.clear()
-    return jsonify({'arrived': arrived, 'total': total_users, 'all_arrived': all_arrived}), 200
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    phase = room['phase']
+    arrived, total_users = barrier_progress(room, phase.arrived)
+    g.poll_progress = (arrived, total_users)
+    all_arrived = phase.is_past(tiebreak.ARRIVAL) and not phase.rejected
+    return jsonify({'arrived': arrived, 'total': total_users, 'all_arrived': all_arrived, 'phase': phase.phase}), 200
 
 @app.route('/api/get-tied-proposals', methods=['GET'])
+@batchable
 @api_login_required
 def get_tied_proposals():
-    """Get proposals that are tied"""
-    db = get_db()
-    total_users = db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    """Get proposals that were tied when the room's voting closed"""
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
     
     tied_proposals = []
-    
-    for proposer_user_id, votes_data in submission_votes.items():
-        yes_count = votes_data.get('yes', 0)
-        no_count = votes_data.get('no', 0)
-        abstain_count = votes_data.get('abstain', 0)
-        
-        # Determine if tied (yes and no are equal, abstain doesn't count towards pass/fail)
-        if yes_count == no_count and yes_count > 0:
-            proposal = proposal_submissions.get(proposer_user_id)
-            if proposal:
-                tied_proposals.append({
-                    'user_id': proposer_user_id,
-                    'title': proposal['title'],
-                    'description': proposal['description'],
-                    'proposed_by': proposal['user_name']
-                })
+    for proposer_user_id in room['phase'].tied:
+        proposal = proposal_submissions.get(proposer_user_id)
+        if proposal:
+            tied_proposals.append({
+                'user_id': proposer_user_id,
+                'title': proposal['title'],
+                'body_hash': proposal['body_hash'],
+                'proposed_by': proposal['user_name']
+            })
     
     return jsonify({'tied_proposals': tied_proposals})
 
@@ -904,60 +1510,80 @@ def record_tiebreaker_vote(proposer_user_id):
     if not password:
         return jsonify({'error': 'Password required'}), 400
     
+    room_code, room = get_user_room(session.get('user_id'))
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    phase = room['phase']
+    if phase.phase != tiebreak.TIEBREAK_VOTING:
+        return jsonify({'error': 'Tiebreak voting is not open'}), 409
+    
+    if proposer_user_id not in phase.tiebreaker_votes:
+        return jsonify({'error': 'Proposal is not tied'}), 404
+    
     # Verify password
     user_id = session.get('user_id')
-    user_name = session.get('user_name')
-    db = get_db()
-    user = db.execute('SELECT password FROM users WHERE id = ?', (user_id,)).fetchone()
-    
-    if not user or user['password'] != hash_password(password):
+    if not password_matches(user_id, password):
         return jsonify({'error': 'Invalid password'}), 401
     
-    # Initialize if not exists
-    if proposer_user_id not in tiebreaker_votes:
-        tiebreaker_votes[proposer_user_id] = {'yes': 0, 'no': 0, 'abstain': 0}
-    
     # Record the vote
-    tiebreaker_votes[proposer_user_id][vote_choice] += 1
+    if not phase.tiebreaker_votes[proposer_user_id].cast(user_id, vote_choice):
+        return jsonify({'error': 'You have already voted on this proposal'}), 400
+    receipt = record_ballot('tiebreak', proposer_user_id, user_id, vote_choice)
     
-    return jsonify({'success': True}), 201
+    return jsonify({'success': True, 'receipt': receipt}), 201
 
 @app.route('/api/mark-tiebreaker-complete', methods=['POST'])
 @api_login_required
 def mark_tiebreaker_complete():
     """Mark user as finished with tie breaking"""
-    user_id = session.get('user_id')
-    users_finished_tiebreaker.add(user_id)
+    room_code, room = get_user_room(session['user_id'])
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    
+    record_phase_event(room, room['phase'].finished_tiebreak, session['user_id'])
     return jsonify({'success': True}), 200
 
 @app.route('/api/check-all-tiebreaker-complete', methods=['GET'])
+@batchable
 @api_login_required
+@poll_endpoint(1000)
 def check_all_tiebreaker_complete():
     """Check if all users have finished tie breaking"""
-    db = get_db()
-    total_users = db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
-    finished_users = len(users_finished_tiebreaker)
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
     
-    all_complete = finished_users == total_users and total_users > 0
+    phase = room['phase']
+    finished_users, total_users = barrier_progress(room, phase.finished_tiebreak)
+    g.poll_progress = (finished_users, total_users)
     
     return jsonify({
-        'all_complete': all_complete,
+        'all_complete': phase.phase == tiebreak.FINAL,
         'finished': finished_users,
-        'total': total_users
+        'total': total_users,
+        'phase': phase.phase
     })
 
 @app.route('/api/final-voting-results', methods=['GET'])
+@batchable
 @api_login_required
 def get_final_voting_results():
     """Get final results after tie breaking"""
-    db = get_db()
-    total_users = db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
     
+    tiebreaker_votes = room['phase'].tiebreaker_votes
     results = []
     
-    for proposer_user_id, proposal in proposal_submissions.items():
+    for proposer_user_id in list(room['users']):
+        proposal = proposal_submissions.get(proposer_user_id)
+        if not proposal:
+            continue
         # Use tiebreaker votes if available, otherwise use regular votes
-        votes_data = tiebreaker_votes.get(proposer_user_id) or submission_votes.get(proposer_user_id, {})
+        box = tiebreaker_votes.get(proposer_user_id) or submission_box(proposer_user_id, room)
+        votes_data = box.totals() if box else {}
         
         yes_count = votes_data.get('yes', 0)
         no_count = votes_data.get('no', 0)
@@ -980,7 +1606,7 @@ def get_final_voting_results():
         results.append({
             'user_id': proposer_user_id,
             'title': proposal['title'],
-            'description': proposal['description'],
+            'body_hash': proposal['body_hash'],
             'proposed_by': proposal['user_name'],
             'yes': yes_count,
             'no': no_count,
@@ -996,6 +1622,665 @@ def get_final_voting_results():
     
     return jsonify(results)
 
+# Ranked-choice elections (one per room at a time; see ranked_choice.py)
+def election_summary(election, user_id):
+    return {
+        'title': election.title,
+        'candidates': election.candidates,
+        'seats': election.seats,
+        'method': 'irv' if election.seats == 1 else 'stv',
+        'closed': election.closed,
+        'ballots': election.ballot_count,
+        'my_ranking': election.ranking_of(user_id)
+    }
+
+@app.route('/api/room/election', methods=['POST'])
+@api_login_required
+def create_election():
+    """Start a ranked election in the room: {"title": str, "candidates": [str], "seats": 1} (room creator)"""
+    user_id = session['user_id']
+    room_code, room = get_user_room(user_id)
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    if room['created_by'] != user_id:
+        return jsonify({'error': 'Only the room creator can start an election'}), 403
+    current = room.get('election')
+    if current is not None and not current.closed:
+        return jsonify({'error': 'An election is already open in this room'}), 409
+    
+    data = request.json or {}
+    title = str(data.get('title', '')).strip()
+    candidates = data.get('candidates')
+    seats = data.get('seats', 1)
+    if not title:
+        return jsonify({'error': 'Title is required'}), 400
+    if not isinstance(candidates, list) or not all(isinstance(c, str) and c.strip() for c in candidates):
+        return jsonify({'error': 'candidates must be a list of names'}), 400
+    if not isinstance(seats, int) or isinstance(seats, bool):
+        return jsonify({'error': 'seats must be an integer'}), 400
+    try:
+        election = ranked_choice.RankedElection(title, [c.strip() for c in candidates], seats, room['slots'])
+    except ranked_choice.RankedError as e:
+        return jsonify({'error': str(e)}), 400
+    room['election'] = election
+    return jsonify(election_summary(election, user_id)), 201
+
+@app.route('/api/room/election', methods=['GET'])
+@batchable
+@api_login_required
+def get_election():
+    """The room's current election and the user's own ranking"""
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    election = room.get('election')
+    if election is None:
+        return jsonify({'error': 'No election in this room'}), 404
+    return jsonify(election_summary(election, session['user_id']))
+
+@app.route('/api/room/election/ballot', methods=['POST'])
+@api_login_required
+def cast_ranked_ballot():
+    """Rank the candidates: {"ranking": [name or index, ...], "password": str}"""
+    data = request.json or {}
+    user_id = session['user_id']
+    
+    # Verify password
+    if not password_matches(user_id, data.get('password')):
+        return jsonify({'error': 'Invalid password'}), 401
+    
+    room_code, room = get_user_room(user_id)
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    election = room.get('election')
+    if election is None:
+        return jsonify({'error': 'No election in this room'}), 404
+    try:
+        ranking = ranked_choice.parse_ranking(data.get('ranking'), election.candidates)
+    except ranked_choice.RankedError as e:
+        return jsonify({'error': str(e)}), 400
+    status = election.cast(user_id, ranking)
+    if status == ranked_choice.CLOSED:
+        return jsonify({'error': 'The election is closed'}), 409
+    if status == ranked_choice.ALREADY_VOTED:
+        return jsonify({'error': 'You have already voted in this election'}), 400
+    receipt = record_ballot('ranked', election.title, user_id, [election.candidates[c] for c in ranking])
+    
+    return jsonify({'success': True, 'receipt': receipt}), 201
+
+@app.route('/api/room/election/close', methods=['POST'])
+@api_login_required
+def close_election():
+    """Stop accepting ballots and publish the count (room creator)"""
+    user_id = session['user_id']
+    room_code, room = get_user_room(user_id)
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    election = room.get('election')
+    if election is None:
+        return jsonify({'error': 'No election in this room'}), 404
+    if room['created_by'] != user_id:
+        return jsonify({'error': 'Only the room creator can close the election'}), 403
+    return jsonify({'success': True, 'elected': election.close()['elected']}), 200
+
+@app.route('/api/ranked-voting-results', methods=['GET'])
+@batchable
+@api_login_required
+def get_ranked_voting_results():
+    """Round-by-round count of the room's closed election"""
+    room_code, room = session_room()
+    if not room:
+        return jsonify({'error': 'User not in any room'}), 400
+    election = room.get('election')
+    if election is None:
+        return jsonify({'error': 'No election in this room'}), 404
+    if not election.closed:
+        return jsonify({'error': 'Results are published when the election closes', 'ballots': election.ballot_count}), 409
+    return jsonify({'title': election.title, 'candidates': election.candidates, **election.result()})
+
+# Audit ledger
+@app.route('/api/ledger/root', methods=['GET'])
+@api_login_required
+def get_ledger_root():
+    """Current ledger size, chain head and Merkle root"""
+    if vote_ledger is None:
+        return jsonify({'error': 'Ledger is not enabled'}), 503
+    return jsonify({
+        'tree_size': len(vote_ledger),
+        'chain_head': vote_ledger.head.hex(),
+        'root': vote_ledger.tree.root().hex()
+    })
+
+@app.route('/api/ledger/my-receipts', methods=['GET'])
+@api_login_required
+def get_my_receipts():
+    """Inclusion proofs for every ballot the current user has cast"""
+    if vote_ledger is None:
+        return jsonify({'error': 'Ledger is not enabled'}), 503
+    user_id = session['user_id']
+    receipts = []
+    for index in vote_ledger.by_voter.get(user_id, []):
+        receipt = vote_ledger.receipt(index)
+        receipt['entry'] = vote_ledger.entry(index)
+        receipts.append(receipt)
+    return jsonify({'receipts': receipts})
+
+@app.route('/api/ledger/proof/<int:index>', methods=['GET'])
+@api_login_required
+def get_ledger_proof(index):
+    """Inclusion proof for one ledger entry (hashes only, no ballot contents)"""
+    if vote_ledger is None:
+        return jsonify({'error': 'Ledger is not enabled'}), 503
+    if not 0 <= index < len(vote_ledger):
+        return jsonify({'error': 'Entry not found'}), 404
+    return jsonify(vote_ledger.receipt(index))
+
+# Profiling
+@app.route('/api/admin/slow-requests', methods=['GET'])
+@admin_required
+def slow_requests():
+    """Slowest profiled requests with their top functions and SQL"""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), profiling.SLOWEST_KEPT)
+    return jsonify({
+        'sample_rate': profiler.sample_rate,
+        'requests': profiler.slowest_requests(limit)
+    })
+
+# Consistency checks
+def check_invariants():
+    """Violations of the live-state invariants, as readable strings (empty when everything holds)"""
+    violations = []
+    seen = {}
+    with room_lock:
+        for room_code, room in voting_rooms.items():
+            users = room['users']
+            for uid in users:
+                if uid in seen:
+                    violations.append(f'user {uid} is in rooms {seen[uid]} and {room_code}')
+                seen[uid] = room_code
+                if user_rooms.get(uid) != room_code:
+                    violations.append(f'user {uid} is in room {room_code} but mapped to {user_rooms.get(uid)}')
+            slots = room['slots']
+            if len(slots.slot_of) != len(slots) or any(slots.user_ids[slot] != uid for uid, slot in slots.slot_of.items()):
+                violations.append(f'room {room_code} has inconsistent voter slots')
+            phase = room['phase']
+            barriers = {'ready': ready_users, 'finished_voting': phase.finished_voting, 'agreed': phase.agreed,
+                        'arrived': phase.arrived, 'finished_tiebreak': phase.finished_tiebreak}
+            for name, done in barriers.items():
+                count, total = barrier_progress(room, done)
+                if count > total or total > len(users):
+                    violations.append(f'room {room_code} {name} barrier at {count}/{total} with {len(users)} members')
+                if name != 'ready' and not done <= users:
+                    violations.append(f'room {room_code} {name} holds non-members {sorted(done - users)}')
+            for proposer_id, box in phase.tiebreaker_votes.items():
+                violations.extend(ballot_violations(f'room {room_code} tiebreak box {proposer_id}', box))
+            election = room.get('election')
+            if election and election.ballot_count > len(slots):
+                violations.append(f'room {room_code} election has {election.ballot_count} ballots for {len(slots)} slots')
+        for uid, room_code in user_rooms.items():
+            if seen.get(uid) != room_code:
+                violations.append(f'user {uid} is mapped to room {room_code} but not a member of it')
+    for proposer_id, box in list(submission_votes.items()):
+        violations.extend(ballot_violations(f'ballot box {proposer_id}', box))
+    return violations
+
+def ballot_violations(label, box):
+    """Counters that disagree with a BallotBox's bitsets"""
+    totals, recount, voters = box.audit()
+    if recount is None:
+        return [f'{label} has a voted slot with no choice']
+    if totals != recount or sum(totals.values()) != voters:
+        return [f'{label} counts {totals} but holds {recount} from {voters} voters']
+    return []
+
+@app.route('/api/admin/invariants', methods=['GET'])
+@admin_required
+def get_invariants():
+    """Run check_invariants() over the live state (stress.py polls this)"""
+    violations = check_invariants()
+    return jsonify({'ok': not violations, 'violations': violations, 'rooms': len(voting_rooms), 'members': len(user_rooms)})
+
+# Database maintenance
+def run_maintenance(options):
+    def progress(table, moved):
+        maintenance_status['progress'] = {'table': table, 'moved': moved}
+    try:
+        maintenance_status['result'] = maintenance.run_all(
+            DATABASE,
+            backup_dir=BACKUP_DIR if options.get('backup', True) else None,
+            archive_path=ARCHIVE_PATH if options.get('archive', True) else None,
+            older_than=float(options.get('older_than_days', ARCHIVE_AFTER_DAYS)),
+            vacuum_into=bool(options.get('vacuum_into', False)),
+            progress=progress
+        )
+    except Exception as e:
+        maintenance_status['error'] = str(e)
+    finally:
+        maintenance_status['finished'] = time.time()
+        maintenance_status['running'] = False
+
+@app.route('/api/admin/maintenance', methods=['GET', 'POST'])
+@admin_required
+def database_maintenance():
+    """Start a backup + archive + incremental vacuum run in the background, or show the last one"""
+    if request.method == 'POST':
+        options = request.json or {}
+        try:
+            float(options.get('older_than_days', ARCHIVE_AFTER_DAYS))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'older_than_days must be a number'}), 400
+        with maintenance_lock:
+            if maintenance_status['running']:
+                return jsonify({'error': 'Maintenance is already running', **maintenance_status}), 409
+            maintenance_status.update(running=True, started=time.time(), finished=None, progress=None, result=None, error=None)
+        threading.Thread(target=run_maintenance, args=(options,), name='maintenance', daemon=True).start()
+        return jsonify(maintenance_status), 202
+    return jsonify(maintenance_status)
+
+# Background jobs
+def job_params(job_type, data):
+    """Parameters for a job from the request body, or an error message"""
+    params = {'database': DATABASE}
+    if job_type == 'export_results':
+        params['export_dir'] = JOB_EXPORT_DIR
+    elif job_type == 'archive':
+        try:
+            params['older_than_days'] = float(data.get('older_than_days', ARCHIVE_AFTER_DAYS))
+        except (TypeError, ValueError):
+            return None, 'older_than_days must be a number'
+        params['archive_path'] = ARCHIVE_PATH
+    elif job_type == 'import_users':
+        users = data.get('users')
+        if not isinstance(users, list) or not users:
+            return None, 'users must be a non-empty list'
+        fields = ('name', 'password', 'position')
+        if not all(isinstance(u, dict) and all(isinstance(u.get(f), str) and u[f].strip() for f in fields) for u in users):
+            return None, 'Every user needs a name, password and position'
+        params['users'] = [{'name': u['name'].strip(), 'password': u['password'], 'position': u['position'].strip()} for u in users]
+    elif job_type == 'verify_ledger':
+        if vote_ledger is None:
+            return None, 'Ledger is not enabled'
+        params['ledger_path'] = vote_ledger.path
+        if data.get('root') is not None:
+            params['root'] = str(data['root'])
+    return params, None
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@admin_required
+def job_list():
+    """Start a job ({"type": ..., plus its options}) or list recent jobs"""
+    if request.method == 'POST':
+        data = request.json or {}
+        job_type = data.get('type')
+        if job_type not in jobs.JOB_TYPES:
+            return jsonify({'error': f'type must be one of {", ".join(jobs.JOB_TYPES)}'}), 400
+        params, error = job_params(job_type, data)
+        if error:
+            return jsonify({'error': error}), 400
+        # Read-only jobs read a pinned replica file, released when the job ends
+        generation = replica.pin() if job_type in REPLICA_JOB_TYPES else None
+        on_done = None
+        if generation:
+            params.update(database=generation.path, read_only=True)
+            on_done = lambda: replica.release(None, generation)
+        try:
+            job = job_runner.submit(job_type, params, on_done)
+        except jobs.JobQueueFull as e:
+            if on_done:
+                on_done()
+            return jsonify({'error': f'Too many jobs: {e}'}), 429
+        response = jsonify(job)
+        response.headers['Location'] = url_for('job_status', job_id=job['id'])
+        if generation:
+            response.headers['X-Data-Age'] = f'{generation.age():.1f}'
+        return response, 202
+    status = request.args.get('status')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), jobs.MAX_LISTED)
+    return jsonify({'jobs': job_runner.list(status, limit), 'counts': job_runner.counts()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+@admin_required
+def job_status(job_id):
+    """A job's status, progress and result; DELETE cancels it"""
+    if request.method == 'DELETE':
+        try:
+            job = job_runner.cancel(job_id)
+        except jobs.JobError as e:
+            return jsonify({'error': str(e)}), 409
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 202
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+@admin_required
+def job_download(job_id):
+    """The file a finished export job wrote"""
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    path = (job['result'] or {}).get('file')
+    if job['status'] != 'succeeded' or not path:
+        return jsonify({'error': 'Job has no file to download'}), 409
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f'{job["type"]}-{job_id}.csv')
+
+# Memory accounting
+@app.route('/api/admin/memory', methods=['GET'])
+@admin_required
+def memory_usage():
+    """Approximate deep size of each live-state structure, in total and for the largest rooms"""
+    start = time.perf_counter()
+    limit = min(max(request.args.get('rooms', memory_report.TOP_ROOMS, type=int), 0), 1000)
+    structures = dict(live_state())
+    structures['tiebreak'] = {code: room.get('phase') for code, room in list(voting_rooms.items())}
+    sizes = memory_report.structure_sizes(structures)
+    return jsonify({
+        'process': memory_report.process_memory(),
+        'structures': sizes,
+        'rooms': memory_report.room_sizes(voting_rooms, user_rooms, proposal_submissions, submission_votes, limit),
+        'tracemalloc': memory_tracker.status(),
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+    })
+
+@app.route('/api/admin/memory/tracemalloc', methods=['POST'])
+@admin_required
+def memory_tracemalloc():
+    """Start tracing, mark a baseline, diff against it or stop: {"action": "start"|"mark"|"diff"|"stop"}"""
+    data = request.json or {}
+    action = data.get('action')
+    if action == 'start':
+        frames = data.get('frames', 1)
+        if not isinstance(frames, int) or not 1 <= frames <= 50:
+            return jsonify({'error': 'frames must be an integer from 1 to 50'}), 400
+        memory_tracker.start(frames)
+    elif action == 'mark':
+        if not memory_tracker.mark():
+            return jsonify({'error': 'tracemalloc is not running'}), 409
+    elif action == 'diff':
+        group_by = data.get('group_by', 'lineno')
+        if group_by not in ('lineno', 'filename', 'traceback'):
+            return jsonify({'error': 'group_by must be lineno, filename or traceback'}), 400
+        limit = data.get('limit', 25)
+        if not isinstance(limit, int) or limit < 1:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        diff = memory_tracker.diff(limit, group_by)
+        if diff is None:
+            return jsonify({'error': 'tracemalloc is not running'}), 409
+        return jsonify({**memory_tracker.status(), 'top': diff})
+    elif action == 'stop':
+        memory_tracker.stop()
+    else:
+        return jsonify({'error': 'action must be start, mark, diff or stop'}), 400
+    return jsonify(memory_tracker.status())
+
+# Cross-room overview
+def room_summaries():
+    """One compact row per live room for the overview aggregator"""
+    rows = []
+    for room_code, room in list(voting_rooms.items()):
+        members = frozenset(room['users'])
+        online = members & logged_in_users
+        phase = room['phase']
+        done, total = phase.progress(online)
+        rows.append({
+            'room_code': room_code,
+            'name': room['name'],
+            'created_date': room['created_date'],
+            'members': len(members),
+            'online': len(online),
+            'ready': len(online & ready_users),
+            'proposals': sum(1 for user_id in members if user_id in proposal_submissions),
+            'skipped': len(members & users_skipped_proposal),
+            'phase': phase.phase,
+            'phase_changed_at': phase.changed_at,
+            'done': done,
+            'total': total,
+            'tied': len(phase.tied),
+        })
+    return rows
+
+overview = aggregator.OverviewAggregator(room_summaries, OVERVIEW_INTERVAL)
+
+@app.route('/api/admin/overview', methods=['GET'])
+@admin_required
+def admin_overview():
+    """Every live room's phase and progress from the last background build, filtered and sorted"""
+    args = request.args
+    phases = [p for p in args.get('phase', '').split(',') if p]
+    if any(p not in tiebreak.PHASES for p in phases):
+        return jsonify({'error': f'phase must be one of {", ".join(tiebreak.PHASES)}'}), 400
+    try:
+        generation, rendered = overview.view(
+            phases=phases,
+            stalled_over=args.get('stalled_over', type=float),
+            min_members=args.get('min_members', type=int),
+            search=args.get('q') or None,
+            sort=args.get('sort', 'stalled'),
+            descending=args.get('order', 'desc') != 'asc',
+            limit=args.get('limit', 100, type=int),
+            offset=args.get('offset', 0, type=int)
+        )
+    except aggregator.OverviewError as e:
+        return jsonify({'error': str(e)}), 400
+    # Dashboards re-polling an unchanged build get a 304
+    response = app.response_class(rendered, mimetype='application/json')
+    response.set_etag(f'{generation}-{hash(rendered) & 0xffffffff:x}')
+    return response.make_conditional(request)
+
+# Cluster membership and shard moves (called by router.py during rebalancing)
+def capture_rooms(room_codes):
+    """The slice of live_state() that belongs to the given rooms and their members"""
+    rooms = {code: voting_rooms[code] for code in room_codes if code in voting_rooms}
+    members = set()
+    for room in rooms.values():
+        members |= room['users']
+    return {
+        'ready_users': ready_users & members,
+        'logged_in_users': logged_in_users & members,
+        'proposal_submissions': {uid: p for uid, p in proposal_submissions.items() if uid in members},
+        'proposal_bodies': {p['body_hash']: proposal_bodies.get(p['body_hash'], '') for uid, p in proposal_submissions.items() if uid in members},
+        'users_skipped_proposal': users_skipped_proposal & members,
+        'submission_votes': {uid: v for uid, v in submission_votes.items() if uid in members},
+        'voting_rooms': rooms,
+        'user_rooms': {uid: user_rooms[uid] for uid in members if uid in user_rooms},
+    }
+
+def merge_rooms(state):
+    """Add rooms captured on another node to this node's live state"""
+    hash_proposal_bodies(state.get('proposal_submissions', {}), state.setdefault('proposal_bodies', {}))
+    with room_lock:
+        for name, target in live_state().items():
+            target.update(state.get(name, ()))
+    for room_code, room in state.get('voting_rooms', {}).items():
+        rooms_index.add(room_code, room['name'])
+    presence_tracker.touch_all(state.get('logged_in_users', ()))
+
+def drop_rooms(room_codes):
+    """Forget rooms that now live on another node"""
+    with room_lock:
+        for code in room_codes:
+            room = voting_rooms.pop(code, None)
+            rooms_index.remove(code)
+            if not room:
+                continue
+            for uid in room['users']:
+                if user_rooms.get(uid) == code:
+                    del user_rooms[uid]
+                logged_in_users.discard(uid)
+                presence_tracker.forget(uid)
+                ready_users.discard(uid)
+                users_skipped_proposal.discard(uid)
+                proposal_submissions.pop(uid, None)
+                submission_votes.pop(uid, None)
+        prune_proposal_bodies()
+
+def rooms_in_shards(shards):
+    shards = set(shards)
+    return [code for code in list(voting_rooms) if sharding.shard_of(code) in shards]
+
+@app.route('/api/internal/cluster', methods=['GET', 'POST'])
+@admin_required
+def cluster_config():
+    """Show or replace this node's view of the cluster: {"nodes": [...], "node_url": str}"""
+    global cluster_ring, NODE_URL
+    if request.method == 'POST':
+        data = request.json or {}
+        NODE_URL = data.get('node_url', NODE_URL)
+        cluster_ring = sharding.HashRing(data.get('nodes', []))
+    return jsonify({
+        'node_url': NODE_URL,
+        'nodes': cluster_ring.nodes,
+        'owned_shards': len(owned_shards()),
+        'rooms': len(voting_rooms)
+    })
+
+@app.route('/api/internal/shards/export', methods=['POST'])
+@admin_required
+def export_shards():
+    """Every room in the given shards, in the JSON format of shard_transfer.py (rooms stay here until dropped)"""
+    room_codes = rooms_in_shards((request.json or {}).get('shards', []))
+    data = shard_transfer.encode(capture_rooms(room_codes))
+    return app.response_class(data, mimetype='application/json', headers={'X-Room-Count': str(len(room_codes))})
+
+@app.route('/api/internal/shards/import', methods=['POST'])
+@admin_required
+def import_shards():
+    """Merge rooms exported by another node"""
+    try:
+        state = shard_transfer.decode(request.get_data())
+    except shard_transfer.TransferError as e:
+        return jsonify({'error': str(e)}), 400
+    merge_rooms(state)
+    return jsonify({'success': True, 'rooms': len(state.get('voting_rooms', {}))})
+
+@app.route('/api/internal/shards/drop', methods=['POST'])
+@admin_required
+def drop_shards():
+    """Forget every room in the given shards after they were imported elsewhere"""
+    room_codes = rooms_in_shards((request.json or {}).get('shards', []))
+    drop_rooms(room_codes)
+    return jsonify({'success': True, 'rooms': len(room_codes)})
+
+# Live state snapshots
+def live_state():
+    """Every in-process structure that should survive a restart, by name"""
+    return {
+        'ready_users': ready_users,
+        'logged_in_users': logged_in_users,
+        'proposal_submissions': proposal_submissions,
+        'proposal_bodies': proposal_bodies,
+        'users_skipped_proposal': users_skipped_proposal,
+        'submission_votes': submission_votes,
+        'voting_rooms': voting_rooms,
+        'user_rooms': user_rooms,
+    }
+
+def restore_state(state):
+    """Load a captured state into the live structures in place"""
+    for name, target in live_state().items():
+        target.clear()
+        target.update(state.get(name, ()))
+    hash_proposal_bodies(proposal_submissions, proposal_bodies)
+    rooms_index.rebuild(voting_rooms)
+
+snapshot_writer = snapshot.SnapshotWriter(SNAPSHOT_PATH, live_state, SNAPSHOT_INTERVAL)
+_services_pid = None
+
+def _save_snapshot_on_exit():
+    if vote_ledger is not None:
+        vote_ledger.sync()
+    flush_proposer_history()
+    if not SNAPSHOT_ENABLED:
+        return
+    try:
+        snapshot_writer.save_now()
+    except Exception as e:
+        print(f'Final snapshot failed: {e}')
+
+def start_background_services():
+    """Open the ledger, restore the last snapshot and start the periodic writers (once per process)"""
+    global _services_pid, vote_ledger
+    if _services_pid == os.getpid():
+        return
+    _services_pid = os.getpid()
+    
+    if LEDGER_PATH:
+        vote_ledger = ledger.VoteLedger(LEDGER_PATH.replace('{pid}', str(os.getpid())), lock_timeout=LEDGER_LOCK_TIMEOUT)
+        vote_ledger.start()
+    
+    replica.start()
+    
+    if SNAPSHOT_ENABLED:
+        try:
+            state = snapshot.read_snapshot(SNAPSHOT_PATH)
+            if state:
+                restore_state(state)
+        except (snapshot.SnapshotError, OSError) as e:
+            print(f'Ignoring snapshot {SNAPSHOT_PATH}: {e}')
+        snapshot_writer.start()
+    
+    # Restored users get a full timeout to reconnect
+    presence_tracker.touch_all(logged_in_users)
+    presence_tracker.start()
+    overview.start()
+    if HISTORY_FLUSH_INTERVAL > 0:
+        threading.Thread(target=_flush_history_periodically, name='proposer-history', daemon=True).start()
+    
+    atexit.register(_save_snapshot_on_exit)
+    atexit.register(job_runner.shutdown)
+    atexit.register(replica.stop)
+    
+    # Write a final snapshot on SIGTERM, then let the previous handler run
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+        def on_sigterm(signum, frame):
+            _save_snapshot_on_exit()
+            job_runner.shutdown()  # Before concurrent.futures' exit hook waits for running jobs
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(0)
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        pass  # Not on the main thread; atexit still covers normal shutdown
+
+# App setup
+_app_ready = False
+
+def warm_templates():
+    """Compile every template now instead of on each worker's first request to it"""
+    if TEMPLATE_CACHE_DIR:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def create_app(start_services=True):
+    """Set the app up once per process and return it.
+
+    Checks the schema and warms the templates. Importing this module does
+    none of that, so tools can point DATABASE and LEDGER_PATH elsewhere
+    first. Pass start_services=False when a forking server (gunicorn
+    --preload, see gunicorn.conf.py) will call start_background_services()
+    in each worker instead: threads, the ledger file and SQLite connections
+    must not be shared across fork().
+    """
+    global _app_ready
+    if not _app_ready:
+        _app_ready = True
+        init_db()
+        if APP_WARMUP:
+            warm_templates()
+    if start_services:
+        start_background_services()
+    return app
+
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True, port=5000)
+    # Only the reloader's serving child owns the live state
+    create_app(start_services=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
+    app.run(debug=True, port=int(os.environ.get('PORT', '5000')))
@@ -0,0 +1,134 @@
+"""
+Compact ballot storage.
+
+Every room member gets a dense slot number (VoterSlots). A BallotBox keeps
+one proposal's ballots as a bitset of the slots that voted, a 2-bit choice
+code per slot and three counters, so 5,000 voters cost about 2 KB per
+proposal instead of a set or dict entry per voter. Checking for a repeat
+vote is a single bit test.
+
+Slots are never reused: a member who leaves and rejoins gets the same slot
+back. Their ballots on the round's submissions are withdrawn when they
+leave, so a box only ever counts members of the room whose slots it uses.
+
+Allocating a slot and casting a ballot are read-modify-writes on shared
+bytes and counters, so both run under one module-wide lock; they take well
+under a microsecond, and reads (totals, has_voted) never wait for it.
+"""
+
+import threading
+from array import array
+
+CHOICES = ('yes', 'no', 'abstain')
+CHOICE_CODES = {choice: code for code, choice in enumerate(CHOICES, start=1)}  # 0 = no ballot
+
+_lock = threading.Lock()  # Module-wide rather than per box, so boxes stay small and picklable
+
+
+class VoterSlots:
+    """Dense slot numbers for the users of one room"""
+
+    __slots__ = ('slot_of', 'user_ids')
+
+    def __init__(self):
+        self.slot_of = {}  # Format: {user_id: slot}
+        self.user_ids = array('q')  # Format: user_ids[slot] = user_id
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def get(self, user_id):
+        return self.slot_of.get(user_id)
+
+    def assign(self, user_id):
+        """The user's slot, allocating the next one on first sight"""
+        slot = self.slot_of.get(user_id)
+        if slot is None:
+            with _lock:
+                slot = self.slot_of.get(user_id)
+                if slot is None:
+                    slot = self.slot_of[user_id] = len(self.user_ids)
+                    self.user_ids.append(user_id)
+        return slot
+
+
+class BallotBox:
+    """One proposal's ballots from the members of a room"""
+
+    __slots__ = ('slots', 'voted', 'choices', 'counts')
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.voted = bytearray()  # Bit per slot
+        self.choices = bytearray()  # Two bits per slot, CHOICE_CODES
+        self.counts = array('I', (0, 0, 0))  # yes, no, abstain
+
+    def has_voted(self, user_id):
+        slot = self.slots.get(user_id)
+        if slot is None or slot >> 3 >= len(self.voted):
+            return False
+        return bool(self.voted[slot >> 3] >> (slot & 7) & 1)
+
+    def cast(self, user_id, choice):
+        """Record a ballot; returns False if the user already voted"""
+        code = CHOICE_CODES[choice]
+        slot = self.slots.assign(user_id)
+        byte, bit = slot >> 3, 1 << (slot & 7)
+        with _lock:
+            if byte >= len(self.voted):
+                self.voted.extend(bytes(byte + 1 - len(self.voted)))
+            elif self.voted[byte] & bit:
+                return False
+            if slot >> 2 >= len(self.choices):
+                self.choices.extend(bytes((slot >> 2) + 1 - len(self.choices)))
+            self.voted[byte] |= bit
+            self.choices[slot >> 2] |= code << ((slot & 3) * 2)
+            self.counts[code - 1] += 1
+        return True
+
+    def withdraw(self, user_id):
+        """Remove the user's ballot; returns False if they had not voted"""
+        slot = self.slots.get(user_id)
+        if slot is None:
+            return False
+        byte, bit = slot >> 3, 1 << (slot & 7)
+        with _lock:
+            if byte >= len(self.voted) or not self.voted[byte] & bit:
+                return False
+            shift = (slot & 3) * 2
+            code = self.choices[slot >> 2] >> shift & 3
+            self.voted[byte] &= ~bit
+            self.choices[slot >> 2] &= ~(3 << shift)
+            self.counts[code - 1] -= 1
+        return True
+
+    def choice_of(self, user_id):
+        """The user's choice, or None if they have not voted"""
+        slot = self.slots.get(user_id)
+        if slot is None or slot >> 2 >= len(self.choices):
+            return None
+        code = self.choices[slot >> 2] >> ((slot & 3) * 2) & 3
+        return CHOICES[code - 1] if code else None
+
+    def voter_count(self):
+        # Not int.bit_count(): that needs Python 3.10 and the README supports 3.8+
+        return bin(int.from_bytes(self.voted, 'little')).count('1')
+
+    def totals(self):
+        return dict(zip(CHOICES, self.counts))
+
+    def audit(self):
+        """(counters, totals rebuilt from the bitsets, voter count), read together between casts.
+
+        The recount is None if a slot is marked as voted without a choice.
+        """
+        with _lock:
+            counts = [0, 0, 0]
+            for slot in range(len(self.voted) * 8):
+                if self.voted[slot >> 3] >> (slot & 7) & 1:
+                    code = self.choices[slot >> 2] >> ((slot & 3) * 2) & 3 if slot >> 2 < len(self.choices) else 0
+                    if not code:
+                        counts = None
+                        break
+                    counts[code - 1] += 1
+            return self.totals(), counts and dict(zip(CHOICES, counts)), self.voter_count()
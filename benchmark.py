@@ -0,0 +1,438 @@
+"""
+Benchmarks for the in-process state of the voting app.
+
+Usage:
+    python benchmark.py              # run every benchmark
+    python benchmark.py snapshot     # run only the named benchmarks
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Benchmarks build their own state; never touch the real database, ledger or snapshot
+os.environ['SNAPSHOT_ENABLED'] = '0'
+os.environ['REPLICA_INTERVAL'] = '0'
+os.environ['LEDGER_PATH'] = ''
+os.environ['DATABASE'] = os.path.join(tempfile.mkdtemp(prefix='benchmark-'), 'bench.db')
+
+import numpy as np
+
+import analytics
+import app as voting_app
+import ledger
+from ballots import BallotBox, VoterSlots
+import snapshot
+import ranked_choice
+import read_replica
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__[len('bench_'):]] = fn
+    return fn
+
+
+def populate_state(n_users=10000, n_rooms=500, seed=1):
+    """Fill the app's live state with a mid-round session of n_users in n_rooms"""
+    rng = random.Random(seed)
+    voting_app.restore_state({})
+
+    user_ids = list(range(1, n_users + 1))
+    for index in range(n_rooms):
+        members = user_ids[index::n_rooms]
+        room_code = f'R{index:05d}'
+        voting_app.open_room(room_code, voting_app.new_room_state(f'Committee {index}', '', members[0]))
+        for user_id in members:
+            voting_app.logged_in_users.add(user_id)
+            voting_app.add_room_member(room_code, user_id, f'Delegate {user_id}')
+            if rng.random() < 0.8:
+                voting_app.ready_users.add(user_id)
+
+        # A quarter of each room proposes, everyone else votes on those proposals
+        proposers = members[:max(1, len(members) // 4)]
+        for proposer_id in proposers:
+            voting_app.store_proposal(proposer_id, f'Resolution {proposer_id}',
+                                      f'Calls upon member states to cooperate ({proposer_id}). ' * 8, f'Delegate {proposer_id}')
+            box = BallotBox(voting_app.voting_rooms[room_code]['slots'])
+            for voter_id in members:
+                if voter_id != proposer_id:
+                    box.cast(voter_id, rng.choice(('yes', 'no', 'abstain')))
+            voting_app.submission_votes[proposer_id] = box
+        for user_id in members[len(proposers):]:
+            voting_app.users_skipped_proposal.add(user_id)
+        for user_id in members[:len(members) // 2]:
+            voting_app.voting_rooms[room_code]['phase'].finished_voting.add(user_id)
+        for _ in range(len(proposers)):
+            voting_app.voting_rooms[room_code]['rotation'].pick()
+
+
+@benchmark
+def bench_snapshot(n_users=10000, n_rooms=500, repeat=5):
+    """Snapshot size, write time and warm-restart load time"""
+    populate_state(n_users, n_rooms)
+    path = os.path.join(tempfile.mkdtemp(), 'state.snapshot')
+
+    write_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = snapshot.write_snapshot(path, voting_app.live_state())
+        write_times.append(time.perf_counter() - start)
+
+    load_times = []
+    for _ in range(repeat):
+        for target in voting_app.live_state().values():
+            target.clear()
+        start = time.perf_counter()
+        voting_app.restore_state(snapshot.read_snapshot(path))
+        load_times.append(time.perf_counter() - start)
+
+    assert len(voting_app.voting_rooms) == n_rooms
+    assert len(voting_app.user_rooms) == n_users
+    print(f'snapshot: {n_users} users, {n_rooms} rooms')
+    print(f'  size        {size / 1024:.1f} KiB')
+    print(f'  write       best {min(write_times) * 1000:.1f} ms')
+    print(f'  load        best {min(load_times) * 1000:.1f} ms, worst {max(load_times) * 1000:.1f} ms')
+
+
+@benchmark
+def bench_ledger(n_entries=1000000):
+    """Ledger append rate, proof size and full verification of a large ledger"""
+    path = os.path.join(tempfile.mkdtemp(), 'votes.ledger')
+    vote_ledger = ledger.VoteLedger(path, sync_every=4096)
+    start = time.perf_counter()
+    for index in range(n_entries):
+        vote_ledger.append({
+            'kind': 'regular', 'room': 'R00001', 'proposal': index % 500,
+            'voter': index % 5000, 'vote': 'yes', 'ts': 1767225600.0 + index
+        })
+    vote_ledger.sync()
+    append_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    receipt = vote_ledger.receipt(n_entries // 3)
+    proof_time = time.perf_counter() - start
+    root = vote_ledger.tree.root()
+    vote_ledger.close()
+
+    start = time.perf_counter()
+    size, _head, verified_root, _tail = ledger.verify_file(path, root.hex())
+    verify_time = time.perf_counter() - start
+    assert size == n_entries and verified_root == root
+
+    print(f'ledger: {n_entries} entries, {os.path.getsize(path) / 1024 / 1024:.1f} MiB')
+    print(f'  append      {n_entries / append_time:,.0f} entries/s')
+    print(f'  proof       {len(receipt["proof"])} hashes in {proof_time * 1000:.2f} ms')
+    print(f'  verify      {verify_time:.2f} s ({n_entries / verify_time:,.0f} entries/s)')
+
+
+@benchmark
+def bench_analytics(n_voters=5000, n_proposals=500, n_positions=50, turnout=0.9, repeat=3):
+    """Room analytics with NumPy against the same numbers from a pure-Python loop"""
+    rng = random.Random(1)
+    voter_ids = list(range(1, n_voters + 1))
+    positions = [f'Delegation {rng.randrange(n_positions)}' for _ in voter_ids]
+    columns = [
+        {voter_id: rng.choice(analytics.CHOICES) for voter_id in voter_ids if rng.random() < turnout}
+        for _ in range(n_proposals)
+    ]
+    voters = np.array(voter_ids, dtype=np.int64)
+    boxes = ballot_boxes(voter_ids, columns)
+    slot_rows = np.array([boxes[0].slots.get(voter_id) for voter_id in voter_ids], dtype=np.int64)
+
+    build_times, dict_build_times, compute_times = [], [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matrix = analytics.ballot_box_matrix(boxes, slot_rows)
+        build_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        assert (analytics.choice_matrix(voters, columns) == matrix).all()
+        dict_build_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        result = analytics.room_analytics(matrix, positions, voters)
+        compute_times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    totals, agreement = analytics.room_analytics_python(voter_ids, positions, columns)
+    python_time = time.perf_counter() - start
+
+    for row, python_row in zip(result['position_agreement']['matrix'], agreement):
+        assert all(abs(a - b) < 1e-4 for a, b in zip(row, python_row) if a is not None)
+    for group in result['by_position']:
+        assert totals[group['position']] == {choice: group[choice] for choice in analytics.CHOICES}
+
+    vectorized = min(build_times) + min(compute_times)
+    print(f'analytics: {n_voters} voters x {n_proposals} proposals, {n_positions} positions')
+    print(f'  build matrix  {min(build_times) * 1000:.1f} ms from ballot boxes, {min(dict_build_times) * 1000:.1f} ms from dicts')
+    print(f'  numpy         {min(compute_times) * 1000:.1f} ms')
+    print(f'  pure python   {python_time * 1000:.1f} ms ({python_time / vectorized:.1f}x slower than build + numpy)')
+
+
+def ballot_boxes(voter_ids, columns):
+    """One room's BallotBoxes holding the ballots in columns"""
+    slots = VoterSlots()
+    for voter_id in voter_ids:
+        slots.assign(voter_id)
+    boxes = []
+    for ballots in columns:
+        box = BallotBox(slots)
+        for voter_id, choice in ballots.items():
+            box.cast(voter_id, choice)
+        boxes.append(box)
+    return boxes
+
+
+@benchmark
+def bench_ballots(n_voters=5000, n_proposals=500, turnout=0.9):
+    """Memory per proposal for voter sets, voter->choice dicts and ballot bitsets"""
+    rng = random.Random(1)
+    voter_ids = list(range(100000, 100000 + n_voters))  # Shared int objects, so only containers are measured
+    columns = [
+        {voter_id: rng.choice(analytics.CHOICES) for voter_id in voter_ids if rng.random() < turnout}
+        for _ in range(n_proposals)
+    ]
+
+    def as_sets():
+        return [
+            dict({choice: sum(1 for c in ballots.values() if c == choice) for choice in analytics.CHOICES}, voters=set(ballots))
+            for ballots in columns
+        ]
+
+    def as_dicts():
+        return [
+            dict({choice: sum(1 for c in ballots.values() if c == choice) for choice in analytics.CHOICES}, voters=dict(ballots))
+            for ballots in columns
+        ]
+
+    print(f'ballots: {n_voters} voters x {n_proposals} proposals, {turnout:.0%} turnout')
+    results = {}
+    for name, build in (('set of voters', as_sets), ('dict voter->choice', as_dicts), ('BallotBox bitsets', lambda: ballot_boxes(voter_ids, columns))):
+        tracemalloc.start()
+        built = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = (built, size)
+        print(f'  {name:<20} {size / 1024 / 1024:8.1f} MiB ({size / n_proposals / 1024:.1f} KiB per proposal)')
+
+    sets, boxes = results['set of voters'][0], results['BallotBox bitsets'][0]
+    for label, has_voted in (('set lookup', lambda i: voter_ids[i] in sets[i % n_proposals]['voters']),
+                             ('bit test', lambda i: boxes[i % n_proposals].has_voted(voter_ids[i]))):
+        start = time.perf_counter()
+        for i in range(n_voters):
+            has_voted(i)
+        print(f'  dedup check ({label:<10}) {(time.perf_counter() - start) / n_voters * 1e9:.0f} ns')
+
+
+@benchmark
+def bench_room_directory(n_rooms=20000, pages=2000):
+    """One page of a room-name prefix search: directory index vs scanning voting_rooms"""
+    populate_state(n_rooms * 2, n_rooms)
+    prefixes = [f'Committee {random.Random(i).randrange(n_rooms)}'[:12] for i in range(pages)]
+
+    start = time.perf_counter()
+    for prefix in prefixes:
+        voting_app.rooms_index.search(prefix, limit=20)
+    indexed = (time.perf_counter() - start) / pages
+
+    start = time.perf_counter()
+    for prefix in prefixes:
+        key = prefix.casefold()
+        sorted(code for code, room in voting_app.voting_rooms.items() if room['name'].casefold().startswith(key))[:20]
+    scanned = (time.perf_counter() - start) / pages
+
+    print(f'room directory: {n_rooms} rooms, first page of 20 for {pages} prefixes')
+    print(f'  sorted index  {indexed * 1e6:8.1f} us')
+    print(f'  full scan     {scanned * 1e6:8.1f} us ({scanned / indexed:.0f}x slower)')
+
+
+
+def ranked_ballots(n_ballots, n_candidates, seed=1):
+    """Random rankings with uneven candidate popularity and lengths, padded with -1"""
+    rng = np.random.default_rng(seed)
+    popularity = rng.dirichlet(np.full(n_candidates, 2.0))
+    # Sorting u ** (1 / weight) keys draws popularity-weighted permutations
+    keys = rng.random((n_ballots, n_candidates)) ** (1 / popularity)
+    rankings = np.argsort(-keys, axis=1).astype(np.int8)
+    lengths = rng.integers(1, n_candidates + 1, n_ballots)
+    rankings[np.arange(n_candidates) >= lengths[:, None]] = ranked_choice.EMPTY
+    return rankings
+
+
+@benchmark
+def bench_ranked_choice(n_ballots=100000, n_candidates=20, repeat=3):
+    """IRV and STV counts with NumPy against an IRV recount per round in pure Python"""
+    rankings = ranked_ballots(n_ballots, n_candidates)
+    print(f'ranked choice: {n_ballots} ballots x {n_candidates} candidates ({rankings.nbytes / 2**20:.1f} MiB)')
+    for seats in (1, 3):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = ranked_choice.count(rankings, n_candidates, seats)
+            times.append(time.perf_counter() - start)
+        flag = '' if min(times) < 1 else '  (over 1 s)'
+        print(f'  {result["method"]} {seats} seat(s)  {min(times) * 1000:8.1f} ms, {len(result["rounds"])} rounds{flag}')
+
+    irv = ranked_choice.count(rankings, n_candidates)
+    start = time.perf_counter()
+    reference = ranked_choice.count_python(rankings, n_candidates)
+    python_time = time.perf_counter() - start
+    assert [int(c) for c in irv['elected']] == reference['elected']
+    assert [int(c) for c in irv['eliminated']] == reference['eliminated']
+    print(f'  pure python   {python_time * 1000:8.1f} ms (irv, same result)')
+
+
+COLD_START_PAGES = ('/', '/login', '/room', '/lobby', '/voting', '/tiebreaker', '/results', '/update')
+
+# Runs in a fresh interpreter: import and set up the app, then time each page's first and second request
+COLD_START_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+app.create_app(start_services=False)
+setup = time.perf_counter() - start
+client = app.app.test_client()
+client.post('/register', json={'name': 'cold', 'password': 'cold1234', 'position': 'Chair'})
+first, repeat = {}, {}
+for path in sys.argv[1:]:
+    for timings in (first, repeat):
+        start = time.perf_counter()
+        assert client.get(path).status_code == 200, path
+        timings[path] = time.perf_counter() - start
+print(json.dumps({'setup': setup, 'first': first, 'repeat': repeat}))
+"""
+
+
+def cold_start(workdir, warmup, keep_bytecode):
+    """One fresh worker in workdir (new database, optionally an empty template cache)"""
+    stale = [os.path.join(workdir, 'un_voting.db')]
+    cache_dir = os.path.join(workdir, 'template_cache')
+    if not keep_bytecode and os.path.isdir(cache_dir):
+        stale += [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    for path in stale:
+        if os.path.exists(path):
+            os.remove(path)
+    env = dict(os.environ, APP_WARMUP='1' if warmup else '0', SNAPSHOT_ENABLED='0', LEDGER_PATH='', DATABASE=stale[0],
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', COLD_START_CHILD, *COLD_START_PAGES], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+RESULT_QUERIES = (
+    'SELECT vote, COUNT(*) as count FROM votes WHERE proposal_id = ? GROUP BY vote',
+    'SELECT COUNT(*) FROM users',
+    'SELECT COUNT(*) FROM votes WHERE proposal_id = ?',
+)
+
+
+def read_under_writes(connect, release, n_proposals, seconds, readers, voters):
+    """Run get_results' queries from reader threads while one thread commits a vote at a time (by ``voters``)"""
+    stop = threading.Event()
+    latencies = []
+    commits = [0]
+
+    def write():
+        db = voting_app.get_db()
+        while not stop.is_set():
+            voter = next(voters)
+            db.execute('INSERT INTO votes (proposal_id, user_id, vote) VALUES (?, ?, ?)', (voter % n_proposals + 1, voter, 'yes'))
+            db.commit()
+            commits[0] += 1
+        db.close()
+
+    def read(seed):
+        rng = random.Random(seed)
+        mine = []
+        while not stop.is_set():
+            db, lease = connect()
+            start = time.perf_counter()
+            proposal_id = rng.randint(1, n_proposals)
+            for sql in RESULT_QUERIES:
+                db.execute(sql, (proposal_id,) if '?' in sql else ()).fetchall()
+            mine.append(time.perf_counter() - start)
+            release(db, lease)
+        latencies.extend(mine)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return len(latencies) / seconds, latencies[int(len(latencies) * 0.95)] * 1000, commits[0] / seconds
+
+
+@benchmark
+def bench_read_replica(n_users=20000, n_proposals=2000, n_votes=400000, seconds=3, readers=4):
+    """Result reads against the live database and the read replica while votes are being written"""
+    workdir = tempfile.mkdtemp()
+    voting_app.DATABASE = os.path.join(workdir, 'bench.db')
+    voting_app.init_db()
+    db = voting_app.get_db()
+    rng = random.Random(1)
+    db.executemany('INSERT INTO users (name, password, position) VALUES (?, ?, ?)',
+                   ((f'user{i}', 'x', f'P{i % 50}') for i in range(n_users)))
+    db.executemany('INSERT INTO proposals (title, description, proposed_by) VALUES (?, ?, ?)',
+                   ((f'Resolution {i}', 'Calls upon member states to cooperate. ' * 4, 'x') for i in range(n_proposals)))
+    db.executemany('INSERT OR IGNORE INTO votes (proposal_id, user_id, vote) VALUES (?, ?, ?)',
+                   ((rng.randint(1, n_proposals), rng.randint(1, n_users), rng.choice(('yes', 'no', 'abstain'))) for _ in range(n_votes)))
+    db.commit()
+    db.close()
+
+    replica = read_replica.ReadReplica(lambda: sqlite3.connect(voting_app.DATABASE, timeout=10.0), os.path.join(workdir, 'replica'), 0)
+    generation = replica.publish()
+    print(f'read replica: {n_votes} votes, {generation.bytes / 1024 / 1024:.1f} MiB copied in {generation.publish_ms:.0f} ms, '
+          f'{readers} reader threads and one writer for {seconds} s each')
+
+    def live():
+        return voting_app.get_db(), None
+
+    def live_release(db, _):
+        db.close()
+
+    voters = itertools.count(n_users + 1)
+    for label, connect, release in (('live database', live, live_release), ('replica', replica.lease, replica.release)):
+        reads, p95, commits = read_under_writes(connect, release, n_proposals, seconds, readers, voters)
+        print(f'  {label:<14} {reads:8,.0f} reads/s   p95 {p95:6.2f} ms   writer {commits:6,.0f} commits/s')
+    replica.stop()
+
+
+@benchmark
+def bench_cold_start(runs=3):
+    """Import + setup time and first-request latency of a fresh worker, with and without warm-up"""
+    print(f'cold start: {len(COLD_START_PAGES)} pages, best of {runs} fresh interpreters')
+    with tempfile.TemporaryDirectory() as workdir:
+        variants = (('no warm-up', False, False), ('warm-up, empty bytecode cache', True, False), ('warm-up, bytecode cached', True, True))
+        for label, warmup, keep_bytecode in variants:
+            results = [cold_start(workdir, warmup, keep_bytecode) for _ in range(runs)]
+            setup = min(r['setup'] for r in results)
+            first = min(sum(r['first'].values()) for r in results)
+            repeat = min(sum(r['repeat'].values()) for r in results)
+            print(f'  {label:<30} setup {setup * 1000:7.1f} ms   first requests {first * 1000:6.1f} ms   repeated {repeat * 1000:5.1f} ms')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Gunicorn settings: gunicorn -c gunicorn.conf.py
+
+The app is loaded once in the master (preload_app) through create_app(),
+which checks the schema and compiles every template before forking, so
+workers start warm and share those pages copy-on-write. Each worker then
+opens its own ledger, restores the snapshot and starts its background
+threads after the fork.
+
+Live state is per process, so keep one worker per node (see the Multi-Node
+Deployment section of the README) and scale with threads. A second worker
+would find the ledger locked and fail to boot unless LEDGER_PATH has {pid}.
+"""
+
+import gc
+import os
+
+wsgi_app = 'app:create_app(start_services=False)'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+preload_app = True
+
+
+def when_ready(server):
+    # Objects built during preload never change; keep the collector from touching (and copying) their pages
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # After gunicorn has installed its signal handlers, so the snapshot-on-SIGTERM handler wraps them.
+    # create_app() also sets the app up if it was not preloaded through wsgi_app (e.g. app:app on the command line)
+    import app
+    app.create_app()
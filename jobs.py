@@ -0,0 +1,398 @@
+"""
+Background jobs for work too slow for a request: result exports, position
+statistics, archival, bulk user imports and ledger verification.
+
+Jobs run in a bounded ProcessPoolExecutor, so they neither hold a request
+thread nor compete with request handling for the GIL. The pool is created
+on the first submit, in the serving process (after gunicorn has forked), and
+its workers are started with 'spawn' so they never inherit the parent's
+threads, locks or open SQLite connections.
+
+Workers send progress over a multiprocessing queue that a listener thread in
+the parent folds into the job records. Cancelling a queued job removes it
+from the pool's queue; cancelling a running job raises a flag in shared
+memory that the job sees the next time it reports progress, so it stops
+between chunks and never half-way through one. Finished jobs (and their
+export files) are kept for JOB_RETENTION seconds.
+
+Job functions take (params, report) and must not import app.py.
+"""
+
+import csv
+import hashlib
+import multiprocessing
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.request import pathname2url
+
+import ledger
+import maintenance
+
+CHUNK = 1000  # Rows per transaction / progress report
+LISTEN_TIMEOUT = 1.0  # Seconds; expired jobs are purged at least this often
+MAX_LISTED = 200
+
+ACTIVE = ('queued', 'running')
+
+
+class JobError(ValueError):
+    pass
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# Worker side: set by _init_worker in each pool process
+_progress_queue = None
+_cancel_flags = None
+
+
+def _init_worker(progress_queue, cancel_flags):
+    global _progress_queue, _cancel_flags
+    _progress_queue = progress_queue
+    _cancel_flags = cancel_flags
+
+
+def _run_job(job_id, slot, job_type, params):
+    def report(done, total=None, message=None):
+        """Publish progress; raises JobCancelled once the job has been cancelled"""
+        if _cancel_flags[slot]:
+            raise JobCancelled('Cancelled')
+        _progress_queue.put(('progress', job_id, done, total, message))
+
+    if _cancel_flags[slot]:
+        raise JobCancelled('Cancelled before starting')
+    _progress_queue.put(('started', job_id, os.getpid()))
+    return JOB_TYPES[job_type](params, report)
+
+
+# Job types
+
+def _connect(path, read_only=False):
+    if not os.path.exists(path):
+        raise JobError(f'Database {path} not found')
+    if read_only:
+        # A read replica file (read_replica.py): it never changes, so skip locking
+        return sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}?mode=ro&immutable=1', uri=True)
+    return sqlite3.connect(path, timeout=maintenance.BUSY_TIMEOUT)
+
+
+def export_results(params, report):
+    """CSV of every saved proposal with its vote totals"""
+    db = _connect(params['database'], params.get('read_only', False))
+    path = os.path.join(params['export_dir'], f'{params["job_id"]}.csv')
+    os.makedirs(params['export_dir'], exist_ok=True)
+    try:
+        total = db.execute('SELECT COUNT(*) FROM proposals').fetchone()[0]
+        written = 0
+        last_id = 0
+        with open(path + '.partial', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'title', 'proposed_by', 'created_date', 'status', 'yes', 'no', 'abstain'])
+            while True:
+                rows = db.execute('''
+                    SELECT p.id, p.title, p.proposed_by, p.created_date, p.status,
+                           COALESCE(SUM(v.vote = 'yes'), 0), COALESCE(SUM(v.vote = 'no'), 0), COALESCE(SUM(v.vote = 'abstain'), 0)
+                    FROM proposals p LEFT JOIN votes v ON v.proposal_id = p.id
+                    WHERE p.id > ? GROUP BY p.id ORDER BY p.id LIMIT ?
+                ''', (last_id, CHUNK)).fetchall()
+                if not rows:
+                    break
+                writer.writerows(rows)
+                written += len(rows)
+                last_id = rows[-1][0]
+                report(written, total)
+        os.replace(path + '.partial', path)
+    except BaseException:
+        if os.path.exists(path + '.partial'):
+            os.remove(path + '.partial')
+        raise
+    finally:
+        db.close()
+    return {'rows': written, 'file': path, 'bytes': os.path.getsize(path)}
+
+
+def position_statistics(params, report):
+    """Ballots cast per position and choice across every saved vote"""
+    db = _connect(params['database'], params.get('read_only', False))
+    try:
+        low, high = db.execute('SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM votes').fetchone()
+        positions = {}
+        for start in range(low, high + 1, CHUNK * 10):
+            for position, vote, count in db.execute('''
+                SELECT u.position, v.vote, COUNT(*) FROM votes v JOIN users u ON u.id = v.user_id
+                WHERE v.id BETWEEN ? AND ? GROUP BY u.position, v.vote
+            ''', (start, start + CHUNK * 10 - 1)):
+                entry = positions.setdefault(position, {'yes': 0, 'no': 0, 'abstain': 0})
+                entry[vote] = entry.get(vote, 0) + count
+            report(min(start + CHUNK * 10, high + 1) - low, high + 1 - low)
+        delegates = dict(db.execute('SELECT position, COUNT(*) FROM users GROUP BY position'))
+    finally:
+        db.close()
+    for position, entry in positions.items():
+        cast = sum(entry.values())
+        decided = entry['yes'] + entry['no']
+        entry.update(
+            ballots=cast,
+            delegates=delegates.get(position, 0),
+            abstention=round(entry['abstain'] / cast, 4) if cast else None,
+            yes_share=round(entry['yes'] / decided, 4) if decided else None,
+        )
+    return {'positions': positions}
+
+
+def archive_old_rows(params, report):
+    """maintenance.archive, reporting rows moved so far"""
+    moved_before = {}
+
+    def progress(table, moved):
+        moved_before[table] = moved
+        report(sum(moved_before.values()), None, f'{table}: {moved}')
+
+    cutoff = maintenance.cutoff_days_ago(params['older_than_days'])
+    return {'cutoff': cutoff, 'moved': maintenance.archive(params['database'], params['archive_path'], cutoff, progress=progress)}
+
+
+def import_users(params, report):
+    """Create users from [{name, password, position}], skipping names that exist"""
+    users = params['users']
+    db = _connect(params['database'])
+    created = 0
+    try:
+        for start in range(0, len(users), CHUNK):
+            chunk = users[start:start + CHUNK]
+            before = db.total_changes
+            with db:
+                db.executemany(
+                    'INSERT OR IGNORE INTO users (name, password, position) VALUES (?, ?, ?)',
+                    # Same hashing as app.hash_password
+                    ((u['name'], hashlib.sha256(u['password'].encode()).hexdigest(), u['position']) for u in chunk)
+                )
+            created += db.total_changes - before
+            report(start + len(chunk), len(users))
+    finally:
+        db.close()
+    return {'created': created, 'skipped': len(users) - created}
+
+
+def verify_ledger(params, report):
+    """ledger.verify_file, reporting bytes checked"""
+    size, head, root, tail = ledger.verify_file(params['ledger_path'], params.get('root'), progress=report)
+    return {'entries': size, 'head': head.hex(), 'root': root.hex(), 'partial_tail_bytes': tail}
+
+
+JOB_TYPES = {
+    'export_results': export_results,
+    'position_statistics': position_statistics,
+    'archive': archive_old_rows,
+    'import_users': import_users,
+    'verify_ledger': verify_ledger,
+}
+
+
+# Parent side
+
+class JobRunner:
+    """Submit, track and cancel jobs on a process pool of ``max_workers``.
+
+    At most ``max_queued`` jobs wait behind the running ones; more raise
+    JobQueueFull. Finished jobs are dropped ``retention`` seconds later.
+    """
+
+    def __init__(self, max_workers, max_queued, retention):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.jobs = {}  # Format: {job_id: record}
+        self._futures = {}  # Format: {job_id: Future} while active
+        self._slots = {}  # Format: {job_id: cancel flag index} while active
+        self._free_slots = list(range(max_workers + max_queued))
+        self._pool = None
+        self._context = multiprocessing.get_context('spawn')
+        self._queue = None
+        self._flags = None
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _ensure_pool(self):
+        if self._pool is None:
+            if self._queue is None:
+                self._queue = self._context.Queue()
+                self._flags = self._context.Array('b', self.max_workers + self.max_queued, lock=False)
+                self._listener = threading.Thread(target=self._listen, name='jobs', daemon=True)
+                self._listener.start()
+            self._pool = ProcessPoolExecutor(
+                self.max_workers, mp_context=self._context,
+                initializer=_init_worker, initargs=(self._queue, self._flags)
+            )
+        return self._pool
+
+    def submit(self, job_type, params, on_done=None):
+        """Queue a job and return its record; on_done() runs once the job has finished either way"""
+        if job_type not in JOB_TYPES:
+            raise JobError(f'type must be one of {", ".join(JOB_TYPES)}')
+        job_id = secrets.token_hex(8)
+        record = {
+            'id': job_id,
+            'type': job_type,
+            'status': 'queued',
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'pid': None,
+            'progress': None,
+            'cancel_requested': False,
+            'result': None,
+            'error': None,
+            'expires_at': None,
+        }
+        with self._lock:
+            self._purge()
+            if not self._free_slots:
+                raise JobQueueFull(f'{self.max_workers} jobs running and {self.max_queued} queued')
+            slot = self._free_slots.pop()
+            pool = self._ensure_pool()
+            self._flags[slot] = 0
+            self.jobs[job_id] = record
+            self._slots[job_id] = slot
+            try:
+                future = pool.submit(_run_job, job_id, slot, job_type, dict(params, job_id=job_id))
+            except BrokenProcessPool:
+                self._pool = None
+                future = self._ensure_pool().submit(_run_job, job_id, slot, job_type, dict(params, job_id=job_id))
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        if on_done:
+            future.add_done_callback(lambda f: on_done())
+        return dict(record)
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge()
+            record = self.jobs.get(job_id)
+            return dict(record) if record else None
+
+    def list(self, status=None, limit=MAX_LISTED):
+        with self._lock:
+            self._purge()
+            records = [dict(r) for r in self.jobs.values() if status is None or r['status'] == status]
+        records.sort(key=lambda r: r['created'], reverse=True)
+        return records[:limit]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns its record, or None if unknown"""
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            if record['status'] not in ACTIVE:
+                raise JobError(f'Job already {record["status"]}')
+            record['cancel_requested'] = True
+            self._flags[self._slots[job_id]] = 1
+            future = self._futures[job_id]
+        # A job still in the pool's queue never starts; a running one stops at its next report()
+        future.cancel()
+        return self.get(job_id)
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for record in self.jobs.values():
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+            return counts
+
+    def shutdown(self):
+        """Cancel everything and stop the pool without waiting for running jobs"""
+        with self._lock:
+            for job_id in self._futures:
+                self._flags[self._slots[job_id]] = 1
+            futures = list(self._futures.values())
+            pool, self._pool = self._pool, None
+        for future in futures:
+            future.cancel()  # Runs _finish, which takes the lock
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            record = self.jobs.get(job_id)
+            self._futures.pop(job_id, None)
+            slot = self._slots.pop(job_id, None)
+            if slot is not None:
+                self._free_slots.append(slot)
+            if record is None:
+                return
+            now = time.time()
+            record['finished'] = now
+            record['expires_at'] = now + self.retention
+            if future.cancelled():
+                record['status'] = 'cancelled'
+                return
+            error = future.exception()
+            if error is None:
+                record['status'] = 'succeeded'
+                record['result'] = future.result()
+                progress = record['progress']
+                if progress and progress['total']:
+                    progress.update(done=progress['total'], percent=100.0)
+            elif isinstance(error, JobCancelled):
+                record['status'] = 'cancelled'
+            else:
+                record['status'] = 'failed'
+                record['error'] = f'{type(error).__name__}: {error}'
+                if isinstance(error, BrokenProcessPool) and self._pool is not None:
+                    # A worker died (killed, out of memory); the next submit gets a fresh pool
+                    broken, self._pool = self._pool, None
+                    broken.shutdown(wait=False)
+
+    def _purge(self):
+        now = time.time()
+        for job_id in [j for j, r in self.jobs.items() if r['expires_at'] is not None and r['expires_at'] <= now]:
+            record = self.jobs.pop(job_id)
+            path = (record['result'] or {}).get('file')
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _listen(self):
+        while True:
+            try:
+                message = self._queue.get(timeout=LISTEN_TIMEOUT)
+            except queue.Empty:
+                with self._lock:
+                    self._purge()
+                continue
+            except (EOFError, OSError):
+                return
+            kind, job_id = message[0], message[1]
+            with self._lock:
+                record = self.jobs.get(job_id)
+                if record is None:
+                    continue
+                if kind == 'started':
+                    record['pid'] = message[2]
+                    if record['status'] == 'queued':
+                        record.update(status='running', started=time.time())
+                # Progress can arrive after the done callback; finished records keep their final state
+                elif kind == 'progress' and record['status'] in ACTIVE:
+                    done, total, note = message[2:]
+                    record['status'] = 'running'
+                    record['progress'] = {
+                        'done': done,
+                        'total': total,
+                        'percent': round(100 * done / total, 1) if total else None,
+                        'message': note,
+                    }
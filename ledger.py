@@ -0,0 +1,457 @@
+"""
+Append-only, hash-chained ballot ledger with Merkle inclusion proofs.
+
+File layout: an 8-byte header, then one record per ballot:
+
+    payload length (uint32) | payload (compact JSON) | chain hash (32 bytes)
+
+where chain hash = sha256(previous chain hash + payload), starting from 32 zero
+bytes. Leaves and interior nodes of the Merkle tree follow RFC 6962
+(leaf = sha256(0x00 + payload), node = sha256(0x01 + left + right)), so a
+proof can be checked by any standard verifier.
+
+Usage:
+    python ledger.py verify votes.ledger [--root HEX]
+    python ledger.py prove votes.ledger --voter USER_ID
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, so nothing stops a second writer
+    fcntl = None
+
+HEADER = b'VWLEDG1\n'
+LENGTH = struct.Struct('>I')
+HASH_SIZE = 32
+ZERO_HASH = bytes(HASH_SIZE)
+VERIFY_PROGRESS_EVERY = 65536  # Entries between verify_file progress callbacks
+
+
+class LedgerError(Exception):
+    pass
+
+
+def leaf_hash(payload):
+    return hashlib.sha256(b'\x00' + payload).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _largest_power_of_two_below(n):
+    return 1 << ((n - 1).bit_length() - 1)
+
+
+def iter_records(buf, start=len(HEADER)):
+    """Yield (offset, payload, chain hash) for each complete record in buf"""
+    pos = start
+    end = len(buf)
+    while pos + LENGTH.size <= end:
+        (length,) = LENGTH.unpack_from(buf, pos)
+        record_end = pos + LENGTH.size + length + HASH_SIZE
+        if record_end > end:
+            return
+        payload = bytes(buf[pos + LENGTH.size:pos + LENGTH.size + length])
+        yield pos, payload, bytes(buf[record_end - HASH_SIZE:record_end])
+        pos = record_end
+
+
+class MerkleFrontier:
+    """Streaming Merkle root in O(log n) memory, for one pass over the leaves"""
+
+    def __init__(self):
+        self.size = 0
+        self._peaks = []  # _peaks[k] is the hash of a complete 2^k subtree, or None
+
+    def add(self, leaf):
+        self.size += 1
+        node, level = leaf, 0
+        while level < len(self._peaks) and self._peaks[level] is not None:
+            node = node_hash(self._peaks[level], node)
+            self._peaks[level] = None
+            level += 1
+        if level == len(self._peaks):
+            self._peaks.append(node)
+        else:
+            self._peaks[level] = node
+
+    def root(self):
+        root = None
+        for peak in self._peaks:
+            if peak is not None:
+                root = peak if root is None else node_hash(peak, root)
+        return root if root is not None else hashlib.sha256(b'').digest()
+
+
+class MerkleTree:
+    """Incremental Merkle tree that keeps every complete subtree hash.
+
+    levels[k] holds the hashes of the aligned 2^k-leaf subtrees built so far,
+    packed into one bytearray per level, so appends are O(log n) and any
+    subtree hash needed for a proof is a lookup.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.levels = [bytearray()]
+
+    def node(self, level, index):
+        start = index * HASH_SIZE
+        return bytes(self.levels[level][start:start + HASH_SIZE])
+
+    def add(self, leaf):
+        self.levels[0] += leaf
+        self.size += 1
+        level, count = 0, self.size
+        while count % 2 == 0:
+            right = self.node(level, count - 1)
+            left = self.node(level, count - 2)
+            if level + 1 == len(self.levels):
+                self.levels.append(bytearray())
+            self.levels[level + 1] += node_hash(left, right)
+            level += 1
+            count //= 2
+
+    def subtree(self, start, size):
+        """Hash of the subtree covering leaves [start, start + size)"""
+        if size & (size - 1) == 0 and start % size == 0:
+            return self.node(size.bit_length() - 1, start // size)
+        split = _largest_power_of_two_below(size)
+        return node_hash(self.subtree(start, split), self.subtree(start + split, size - split))
+
+    def root(self, size=None):
+        size = self.size if size is None else size
+        if size == 0:
+            return hashlib.sha256(b'').digest()
+        return self.subtree(0, size)
+
+    def proof(self, index, size=None):
+        """Audit path for leaf ``index`` in the tree of the first ``size`` leaves"""
+        size = self.size if size is None else size
+        if not 0 <= index < size <= self.size:
+            raise IndexError('Leaf index out of range')
+        path = []
+        start = 0
+        while size > 1:
+            split = _largest_power_of_two_below(size)
+            if index < split:
+                path.append(self.subtree(start + split, size - split))
+                size = split
+            else:
+                path.append(self.subtree(start, split))
+                start += split
+                index -= split
+                size -= split
+        return path[::-1]
+
+
+def verify_inclusion(leaf, index, size, proof, root):
+    """Check an audit path (RFC 9162 section 2.1.3.2)"""
+    if index >= size:
+        return False
+    fn, sn, node = index, size - 1, leaf
+    for sibling in proof:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            node = node_hash(sibling, node)
+            if not fn & 1:
+                while fn and not fn & 1:
+                    fn >>= 1
+                    sn >>= 1
+        else:
+            node = node_hash(node, sibling)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and node == root
+
+
+class VoteLedger:
+    """The ledger file plus its in-memory Merkle tree and voter index.
+
+    Appends are written immediately but fsynced in batches: after
+    ``sync_every`` entries, or ``sync_interval`` seconds after the first
+    unsynced entry, whichever comes first.
+
+    The head and tree live in this process, so only one process may append:
+    the file is flock()ed while open, and opening a ledger another process
+    holds raises LedgerError after waiting ``lock_timeout`` seconds for it.
+    """
+
+    def __init__(self, path, sync_every=64, sync_interval=0.2, lock_timeout=0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.tree = MerkleTree()
+        self.head = ZERO_HASH
+        self.offsets = array('Q')  # Byte offset of each record
+        self.by_voter = {}  # Format: {voter_id: [entry index, ...]}
+        self.synced = 0  # Entries known to be on disk
+        self._first_unsynced = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = open(path, 'ab')
+        try:
+            self._lock_file(lock_timeout)
+            self._load()
+            self._file.seek(0, os.SEEK_END)  # _load may have truncated a partial record; tell() must see that
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _lock_file(self, timeout):
+        if fcntl is None:
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise LedgerError(f'{self.path} is open in another process; give each process its own ledger') from None
+                time.sleep(0.1)
+
+    def _load(self):
+        if os.path.getsize(self.path) == 0:
+            self._file.write(HEADER)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            return
+
+        with open(self.path, 'r+b') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf[:len(HEADER)] != HEADER:
+                    raise LedgerError(f'{self.path} is not a vote ledger')
+                end = len(HEADER)
+                for offset, payload, chain in iter_records(buf):
+                    self.head = hashlib.sha256(self.head + payload).digest()
+                    if chain != self.head:
+                        raise LedgerError(f'Hash chain broken at entry {len(self.offsets)}')
+                    self._index(offset, payload)
+                    end = offset + LENGTH.size + len(payload) + HASH_SIZE
+                file_size = len(buf)
+            if end < file_size:
+                # Drop a record that was only partly written before a crash
+                f.truncate(end)
+        self.synced = len(self.offsets)
+
+    def _index(self, offset, payload):
+        index = len(self.offsets)
+        self.offsets.append(offset)
+        self.tree.add(leaf_hash(payload))
+        voter = json.loads(payload).get('voter')
+        if voter is not None:
+            self.by_voter.setdefault(voter, []).append(index)
+        return index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, entry):
+        """Append one ballot; returns (entry index, leaf hash)"""
+        payload = json.dumps(entry, separators=(',', ':'), sort_keys=True).encode()
+        with self._lock:
+            self.head = hashlib.sha256(self.head + payload).digest()
+            offset = self._file.tell()
+            self._file.write(LENGTH.pack(len(payload)) + payload + self.head)
+            index = self._index(offset, payload)
+            pending = len(self.offsets) - self.synced
+            if pending >= self.sync_every:
+                self._sync_locked()
+            elif pending == 1:
+                self._first_unsynced = time.monotonic()
+        return index, self.tree.node(0, index)
+
+    def _sync_locked(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.synced = len(self.offsets)
+
+    def sync(self):
+        with self._lock:
+            if self.synced < len(self.offsets):
+                self._sync_locked()
+
+    def start(self):
+        """Start the background thread that fsyncs slow trickles of entries"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ledger-sync', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            with self._lock:
+                if self.synced < len(self.offsets) and \
+                        time.monotonic() - self._first_unsynced >= self.sync_interval:
+                    self._sync_locked()
+
+    def close(self):
+        self._stop.set()
+        self.sync()
+        self._file.close()
+
+    def entry(self, index):
+        """Read back the payload of one entry"""
+        with self._lock:
+            self._file.flush()
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[index])
+            (length,) = LENGTH.unpack(f.read(LENGTH.size))
+            return json.loads(f.read(length))
+
+    def receipt(self, index):
+        """Everything a voter needs to check one entry against the root"""
+        with self._lock:
+            size = len(self.offsets)
+            proof = self.tree.proof(index, size)
+            root = self.tree.root(size)
+            leaf = self.tree.node(0, index)
+        return {
+            'index': index,
+            'tree_size': size,
+            'leaf': leaf.hex(),
+            'root': root.hex(),
+            'proof': [node.hex() for node in proof],
+        }
+
+
+def verify_file(path, expected_root=None, progress=None):
+    """Verify the hash chain and Merkle root of a ledger with one sequential mmap pass.
+
+    Returns (entries, chain head, root, partial tail bytes). A record the
+    server is still writing at the end of a live ledger is left out and
+    counted in the tail, the way VoteLedger would truncate it on load.
+    ``progress(bytes_done, bytes_total)`` is called every VERIFY_PROGRESS_EVERY entries.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(HEADER):
+            raise LedgerError(f'{path} is not a vote ledger')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            try:
+                buf.madvise(mmap.MADV_SEQUENTIAL)
+            except (AttributeError, OSError):
+                pass
+            if buf[:len(HEADER)] != HEADER:
+                raise LedgerError(f'{path} is not a vote ledger')
+            head = ZERO_HASH
+            frontier = MerkleFrontier()
+            view = memoryview(buf)
+            sha256 = hashlib.sha256
+            unpack_length = LENGTH.unpack_from
+            pos, end = len(HEADER), len(buf)
+            payload = None
+            try:
+                # Hash straight out of the mapping; no per-record copies
+                while pos + LENGTH.size <= end:
+                    (length,) = unpack_length(view, pos)
+                    body = pos + LENGTH.size
+                    record_end = body + length + HASH_SIZE
+                    if record_end > end:
+                        break
+                    payload = view[body:body + length]
+                    chain = sha256(head)
+                    chain.update(payload)
+                    head = chain.digest()
+                    if view[record_end - HASH_SIZE:record_end] != head:
+                        raise LedgerError(f'Hash chain broken at entry {frontier.size}')
+                    leaf = sha256(b'\x00')
+                    leaf.update(payload)
+                    frontier.add(leaf.digest())
+                    pos = record_end
+                    if progress and frontier.size % VERIFY_PROGRESS_EVERY == 0:
+                        progress(pos, end)
+            finally:
+                payload = None  # Drop the last slice so the mapping can close
+                view.release()
+    if not frontier.size:
+        raise LedgerError(f'{path} has no complete entries')
+    root = frontier.root()
+    if expected_root is not None and root.hex() != expected_root.lower():
+        raise LedgerError(f'Merkle root {root.hex()} does not match {expected_root}')
+    return frontier.size, head, root, end - pos
+
+
+def voter_receipts(path, voter):
+    """Receipts, with their entries, for one voter's ballots, from a read-only mmap pass.
+
+    The file is never opened for writing, so this is safe against the live
+    ledger: a record the server is still writing is left out, not truncated.
+    """
+    tree = MerkleTree()
+    head = ZERO_HASH
+    found = []  # (entry index, entry)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(HEADER):
+            raise LedgerError(f'{path} is not a vote ledger')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[:len(HEADER)] != HEADER:
+                raise LedgerError(f'{path} is not a vote ledger')
+            for _offset, payload, chain in iter_records(buf):
+                head = hashlib.sha256(head + payload).digest()
+                if chain != head:
+                    raise LedgerError(f'Hash chain broken at entry {tree.size}')
+                entry = json.loads(payload)
+                if entry.get('voter') == voter:
+                    found.append((tree.size, entry))
+                tree.add(leaf_hash(payload))
+    root = tree.root()
+    return [{
+        'index': index,
+        'tree_size': tree.size,
+        'leaf': tree.node(0, index).hex(),
+        'root': root.hex(),
+        'proof': [node.hex() for node in tree.proof(index)],
+        'entry': entry,
+    } for index, entry in found]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify a vote ledger or print inclusion proofs')
+    sub = parser.add_subparsers(dest='command', required=True)
+    verify = sub.add_parser('verify', help='check the hash chain and Merkle root')
+    verify.add_argument('path')
+    verify.add_argument('--root', help='expected Merkle root (hex)')
+    prove = sub.add_parser('prove', help="print and check a voter's inclusion proofs")
+    prove.add_argument('path')
+    prove.add_argument('--voter', type=int, required=True)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'verify':
+            start = time.perf_counter()
+            size, head, root, tail = verify_file(args.path, args.root)
+            elapsed = time.perf_counter() - start
+            print(f'✓ {size} entries verified in {elapsed:.2f}s')
+            if tail:
+                print(f'  {tail} bytes of a partly written entry at the end were skipped')
+            print(f'  chain head:  {head.hex()}')
+            print(f'  merkle root: {root.hex()}')
+        else:
+            for receipt in voter_receipts(args.path, args.voter):
+                ok = verify_inclusion(
+                    bytes.fromhex(receipt['leaf']), receipt['index'], receipt['tree_size'],
+                    [bytes.fromhex(node) for node in receipt['proof']], bytes.fromhex(receipt['root'])
+                )
+                print(json.dumps({**receipt, 'valid': ok}))
+    except (LedgerError, OSError) as e:
+        print(f'✗ {e}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
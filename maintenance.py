@@ -0,0 +1,271 @@
+"""
+Database maintenance that is safe to run while the app is serving.
+
+- backup: a consistent copy of the live database. The sqlite3 backup API
+  copies a few hundred pages per step and pauses in between, so writers only
+  ever wait for one step; ``--vacuum-into`` writes a compacted copy in a
+  single read transaction instead.
+- archive: moves proposals (with all of their votes) and proposer history
+  older than a cutoff into an archive database, one small transaction per
+  chunk. Each chunk is copied and deleted atomically (the archive is
+  ATTACHed to the same connection), so a crash never loses or duplicates
+  rows, and a proposal that stays keeps all of its votes.
+- vacuum: hands free pages back to the filesystem with PRAGMA
+  incremental_vacuum, a few hundred pages per transaction. Databases created
+  before auto_vacuum was enabled need one full VACUUM first (``--convert``).
+
+Usage:
+    python maintenance.py backup un_voting.db backups/un_voting-20260101.db
+    python maintenance.py archive un_voting.db --archive archive.db --older-than 90
+    python maintenance.py vacuum un_voting.db [--convert]
+    python maintenance.py run un_voting.db --backup-dir backups --archive archive.db --older-than 90
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+
+BACKUP_PAGES = 256  # Pages copied per backup step
+BACKUP_PAUSE = 0.05  # Seconds between backup steps
+ARCHIVE_CHUNK = 500  # Rows moved per transaction
+ARCHIVE_PAUSE = 0.02  # Seconds between archive chunks
+VACUUM_PAGES = 256  # Pages freed per incremental_vacuum transaction
+BUSY_TIMEOUT = 10.0
+
+# Archived tables with the timestamp that ages them out, in the order they are moved, and the
+# (table, column) of rows that belong to them. Votes never age out on their own: they move in the
+# same transaction as their proposal, so a live proposal keeps every ballot (and its UNIQUE check)
+ARCHIVED_TABLES = (
+    ('proposals', 'created_date', ('votes', 'proposal_id')),
+    ('proposer_history', 'picked_date', None),
+)
+
+
+class MaintenanceError(Exception):
+    pass
+
+
+def connect(path):
+    if not os.path.exists(path):
+        raise MaintenanceError(f'Database {path} not found')
+    return sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+
+
+def cutoff_days_ago(days, now=None):
+    """Timestamp in the format CURRENT_TIMESTAMP stores (UTC)"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def backup(source_path, dest_path, vacuum_into=False, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Consistent copy of a live database; returns {'path', 'bytes', 'seconds'}"""
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    partial = dest_path + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    source = connect(source_path)
+    try:
+        if vacuum_into:
+            source.execute('VACUUM INTO ?', (partial,))
+        else:
+            dest = sqlite3.connect(partial)
+            try:
+                # The backup restarts if another connection writes mid-copy; pausing keeps each step short
+                source.backup(dest, pages=pages, sleep=pause)
+            finally:
+                dest.close()
+    finally:
+        source.close()
+    os.replace(partial, dest_path)
+    return {'path': dest_path, 'bytes': os.path.getsize(dest_path), 'seconds': round(time.perf_counter() - start, 3)}
+
+
+def _columns(db, schema, table):
+    return [row[1] for row in db.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _prepare_archive_table(db, table):
+    """Create archive.<table> with the live table's columns, adding any it is missing"""
+    columns = _columns(db, 'main', table)
+    if not columns:
+        return None
+    archived = _columns(db, 'archive', table)
+    if not archived:
+        db.execute(f'CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0')
+        db.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS archive.{table}_id ON {table}(id)')
+    else:
+        for column in columns:
+            if column not in archived:
+                db.execute(f'ALTER TABLE archive.{table} ADD COLUMN {column}')
+    return ', '.join(columns)
+
+
+def _take_chunk(db, ids, children, chunk):
+    """The leading ids whose own and child rows fit in ``chunk`` (always at least one)"""
+    child_table, parent_column = children
+    marks = ','.join('?' * len(ids))
+    counts = dict(db.execute(
+        f'SELECT {parent_column}, COUNT(*) FROM main.{child_table} WHERE {parent_column} IN ({marks}) GROUP BY {parent_column}', ids
+    ))
+    rows = 0
+    for taken, row_id in enumerate(ids):
+        rows += 1 + counts.get(row_id, 0)
+        if taken and rows > chunk:
+            return ids[:taken]
+    return ids
+
+
+def _move_rows(db, table, columns, column, values):
+    """Copy rows whose ``column`` is in ``values`` to the archive and delete them; returns the count"""
+    marks = ','.join('?' * len(values))
+    db.execute(
+        f'INSERT OR REPLACE INTO archive.{table} ({columns}) '
+        f'SELECT {columns} FROM main.{table} WHERE {column} IN ({marks})', values
+    )
+    return db.execute(f'DELETE FROM main.{table} WHERE {column} IN ({marks})', values).rowcount
+
+
+def archive(db_path, archive_path, cutoff, chunk=ARCHIVE_CHUNK, pause=ARCHIVE_PAUSE, progress=None):
+    """Move rows older than ``cutoff`` into the archive database; returns rows moved per table"""
+    db = connect(db_path)
+    moved = {}
+    try:
+        db.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+        for table, date_column, children in ARCHIVED_TABLES:
+            columns = _prepare_archive_table(db, table)
+            moved[table] = 0
+            if columns is None:
+                continue
+            child_columns = None
+            if children:
+                child_columns = _prepare_archive_table(db, children[0])
+                moved[children[0]] = 0
+            while True:
+                db.execute('BEGIN IMMEDIATE')
+                try:
+                    ids = [row[0] for row in db.execute(
+                        f'SELECT id FROM main.{table} WHERE {date_column} < ? ORDER BY id LIMIT ?', (cutoff, chunk)
+                    )]
+                    done = len(ids) < chunk
+                    if ids and child_columns:
+                        taken = _take_chunk(db, ids, children, chunk)
+                        done = done and len(taken) == len(ids)
+                        ids = taken
+                        child_moved = _move_rows(db, children[0], child_columns, children[1], ids)
+                    if ids:
+                        _move_rows(db, table, columns, 'id', ids)
+                    db.execute('COMMIT')
+                except BaseException:
+                    db.execute('ROLLBACK')
+                    raise
+                if ids and child_columns:
+                    moved[children[0]] += child_moved
+                    if progress:
+                        progress(children[0], moved[children[0]])
+                moved[table] += len(ids)
+                if progress:
+                    progress(table, moved[table])
+                if done:
+                    break
+                time.sleep(pause)  # Let waiting writers in between chunks
+        db.execute('DETACH DATABASE archive')
+    finally:
+        db.close()
+    return moved
+
+
+def incremental_vacuum(db_path, convert=False, pages=VACUUM_PAGES, pause=ARCHIVE_PAUSE):
+    """Release free pages in small steps; returns {'freed_pages', 'auto_vacuum', ...}"""
+    db = connect(db_path)
+    try:
+        mode = db.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode != 2:
+            if not convert:
+                free = db.execute('PRAGMA freelist_count').fetchone()[0]
+                return {'auto_vacuum': mode, 'freed_pages': 0, 'free_pages': free,
+                        'note': 'auto_vacuum is not INCREMENTAL; run once with --convert (full VACUUM)'}
+            # Switching modes only takes effect after a full VACUUM, which locks the database while it runs
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('VACUUM')
+            mode = db.execute('PRAGMA auto_vacuum').fetchone()[0]
+        freed = 0
+        free = db.execute('PRAGMA freelist_count').fetchone()[0]
+        while free:
+            # executescript steps the pragma to completion; execute() would free a single page
+            db.executescript(f'PRAGMA incremental_vacuum({pages})')
+            remaining = db.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                break  # Writers are reusing the free pages faster than we release them
+            freed += free - remaining
+            free = remaining
+            time.sleep(pause)
+        page_size = db.execute('PRAGMA page_size').fetchone()[0]
+        return {'auto_vacuum': mode, 'freed_pages': freed, 'freed_bytes': freed * page_size, 'free_pages': free}
+    finally:
+        db.close()
+
+
+def run_all(db_path, backup_dir=None, archive_path=None, older_than=None, vacuum_into=False, convert=False, progress=None):
+    """Backup, then archive, then vacuum; skips the steps that were not asked for"""
+    report = {}
+    if backup_dir:
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d-%H%M%S')
+        name = f'{os.path.splitext(os.path.basename(db_path))[0]}-{stamp}.db'
+        report['backup'] = backup(db_path, os.path.join(backup_dir, name), vacuum_into)
+    if archive_path and older_than is not None:
+        cutoff = cutoff_days_ago(older_than)
+        report['archive'] = {'cutoff': cutoff, 'moved': archive(db_path, archive_path, cutoff, progress=progress)}
+    report['vacuum'] = incremental_vacuum(db_path, convert)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Back up, archive and vacuum the voting database while it is in use')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('backup', help='consistent online copy')
+    p.add_argument('db')
+    p.add_argument('dest')
+    p.add_argument('--vacuum-into', action='store_true', help='write a compacted copy with VACUUM INTO')
+    p = sub.add_parser('archive', help='move old rows into an archive database')
+    p.add_argument('db')
+    p.add_argument('--archive', required=True)
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--older-than', type=float, metavar='DAYS')
+    group.add_argument('--before', metavar='TIMESTAMP', help="e.g. '2026-01-01 00:00:00' (UTC)")
+    p.add_argument('--chunk', type=int, default=ARCHIVE_CHUNK)
+    p = sub.add_parser('vacuum', help='release free pages with incremental vacuum')
+    p.add_argument('db')
+    p.add_argument('--convert', action='store_true', help='switch to auto_vacuum=INCREMENTAL with one full VACUUM')
+    p = sub.add_parser('run', help='backup, archive and vacuum in one go')
+    p.add_argument('db')
+    p.add_argument('--backup-dir')
+    p.add_argument('--archive')
+    p.add_argument('--older-than', type=float, metavar='DAYS')
+    p.add_argument('--vacuum-into', action='store_true')
+    p.add_argument('--convert', action='store_true')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'backup':
+            result = backup(args.db, args.dest, args.vacuum_into)
+        elif args.command == 'archive':
+            cutoff = args.before or cutoff_days_ago(args.older_than)
+            result = {'cutoff': cutoff, 'moved': archive(args.db, args.archive, cutoff, args.chunk)}
+        elif args.command == 'vacuum':
+            result = incremental_vacuum(args.db, args.convert)
+        else:
+            result = run_all(args.db, args.backup_dir, args.archive, args.older_than, args.vacuum_into, args.convert)
+    except (MaintenanceError, sqlite3.Error, OSError) as e:
+        print(f'✗ {e}')
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
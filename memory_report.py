@@ -0,0 +1,174 @@
+"""
+Memory accounting for the in-process live state.
+
+deep_size() walks containers, instance __dict__s and __slots__ and adds up
+sys.getsizeof() for every object reached, counting shared objects once. The
+numbers are approximate (allocator overhead and interned strings are not
+visible from Python) but they are consistent, so they show which room or
+structure is growing.
+
+TracemallocTracker wraps tracemalloc: start it, mark a baseline, and diff
+the current allocations against that baseline later to see which lines keep
+allocating.
+"""
+
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import deque
+
+WALK_RETRIES = 5  # Request threads mutate the state while it is walked
+TOP_ROOMS = 20
+
+# Shared by everything, never owned by one structure
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_size(obj, seen=None):
+    """Approximate bytes held by obj and everything it references"""
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, SKIPPED_TYPES):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+        if isinstance(current, dict):
+            for key, value in list(current.items()):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(list(current))
+        elif isinstance(current, (str, bytes, bytearray, int, float, bool)) or current is None:
+            continue
+        else:
+            attributes = getattr(current, '__dict__', None)
+            if attributes is not None:
+                stack.append(attributes)
+            for cls in type(current).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    if name not in ('__dict__', '__weakref__') and hasattr(current, name):
+                        stack.append(getattr(current, name))
+    return total
+
+
+def _retry(walk):
+    for attempt in range(WALK_RETRIES):
+        try:
+            return walk()
+        except RuntimeError:  # Changed size during iteration
+            if attempt == WALK_RETRIES - 1:
+                raise
+
+
+def process_memory():
+    """Resident set size now and at its peak, in bytes"""
+    usage = {'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open('/proc/self/statm') as f:
+            usage['rss_bytes'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        usage['rss_bytes'] = None
+    return usage
+
+
+def structure_sizes(structures):
+    """Deep size of each named structure on its own (shared objects count in each)"""
+    return {name: _retry(lambda: deep_size(value)) for name, value in structures.items()}
+
+
+def room_sizes(voting_rooms, user_rooms, proposal_submissions, submission_votes, limit=TOP_ROOMS):
+    """Per-room bytes, split into the room's own parts and the member entries it owns elsewhere"""
+    def walk():
+        rooms = []
+        for code, room in list(voting_rooms.items()):
+            seen = set()
+            phase = room.get('phase')
+            parts = {
+                'slots': deep_size(room.get('slots'), seen),
+                'rotation': deep_size(room.get('rotation'), seen),
+                'tiebreak': deep_size(phase, seen) if phase is not None else 0,
+                'election': deep_size(room.get('election'), seen),
+            }
+            parts['room'] = deep_size(room, seen)
+            members = list(room.get('users', ()))
+            parts['submission_votes'] = sum(deep_size(submission_votes.get(uid), seen) for uid in members if uid in submission_votes)
+            parts['proposal_submissions'] = sum(deep_size(proposal_submissions.get(uid), seen) for uid in members if uid in proposal_submissions)
+            parts['user_rooms'] = sum(deep_size(uid, seen) for uid in members if user_rooms.get(uid) == code)
+            rooms.append({'room_code': code, 'members': len(members), 'bytes': sum(parts.values()), 'parts': parts})
+        return rooms
+
+    rooms = _retry(walk)
+    rooms.sort(key=lambda r: r['bytes'], reverse=True)
+    return {
+        'count': len(rooms),
+        'total_bytes': sum(r['bytes'] for r in rooms),
+        'largest': rooms[:limit],
+    }
+
+
+class TracemallocTracker:
+    """Start tracemalloc, mark a baseline and diff against it"""
+
+    def __init__(self):
+        self.baseline = None
+        self.baseline_at = None
+        self._lock = threading.Lock()
+
+    def status(self):
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            'tracing': tracing,
+            'frames': tracemalloc.get_traceback_limit() if tracing else None,
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'baseline_at': self.baseline_at,
+        }
+
+    def start(self, frames=1):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.baseline = tracemalloc.take_snapshot()
+            self.baseline_at = time.time()
+
+    def mark(self):
+        """Make the current allocations the baseline for the next diff"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return False
+            self.baseline = tracemalloc.take_snapshot()
+            self.baseline_at = time.time()
+            return True
+
+    def diff(self, limit=25, group_by='lineno'):
+        """Top allocation changes since the baseline, or None when not tracing"""
+        with self._lock:
+            if not tracemalloc.is_tracing() or self.baseline is None:
+                return None
+            current = tracemalloc.take_snapshot()
+            ignored = (tracemalloc.Filter(False, tracemalloc.__file__),)
+            stats = current.filter_traces(ignored).compare_to(self.baseline.filter_traces(ignored), group_by)
+        return [
+            {
+                'where': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback],
+                'size_diff_bytes': stat.size_diff,
+                'size_bytes': stat.size,
+                'count_diff': stat.count_diff,
+                'count': stat.count,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self.baseline = None
+            self.baseline_at = None
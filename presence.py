@@ -0,0 +1,119 @@
+"""
+Heartbeat presence tracking on a hashed timing wheel.
+
+Every authenticated request (and the pages' /api/heartbeat pings) pushes the
+user's expiry deadline out by PRESENCE_TIMEOUT. Deadlines live in a wheel of
+WHEEL_SIZE buckets, one per tick: rescheduling moves a user between two
+buckets, and each tick only looks at the bucket whose time has come, so the
+work per tick does not grow with the number of users online.
+"""
+
+import math
+import threading
+import time
+
+TICK_SECONDS = 1.0
+WHEEL_SIZE = 128  # Deadlines further out than this many ticks wait extra laps in their bucket
+
+
+class TimingWheel:
+    """Hashed timing wheel of keys with deadlines, in whole ticks"""
+
+    def __init__(self, size=WHEEL_SIZE, tick=TICK_SECONDS, now=None):
+        self.size = size
+        self.tick = tick
+        self.current = int((time.time() if now is None else now) // tick)
+        self.buckets = [set() for _ in range(size)]
+        self.deadline = {}  # Format: {key: tick}
+
+    def __len__(self):
+        return len(self.deadline)
+
+    def __contains__(self, key):
+        return key in self.deadline
+
+    def schedule(self, key, delay):
+        """(Re)schedule key to expire ``delay`` seconds after the current tick"""
+        due = self.current + max(1, math.ceil(delay / self.tick))
+        old = self.deadline.get(key)
+        if old is not None:
+            self.buckets[old % self.size].discard(key)
+        self.deadline[key] = due
+        self.buckets[due % self.size].add(key)
+
+    def cancel(self, key):
+        old = self.deadline.pop(key, None)
+        if old is not None:
+            self.buckets[old % self.size].discard(key)
+
+    def advance(self, now):
+        """Move to the tick containing ``now``; returns the keys that expired"""
+        target = int(now // self.tick)
+        expired = []
+        # A gap longer than one lap visits every bucket once
+        for step in range(self.current + 1, self.current + 1 + min(target - self.current, self.size)):
+            bucket = self.buckets[step % self.size]
+            due = [key for key in bucket if self.deadline[key] <= target]
+            for key in due:
+                bucket.discard(key)
+                del self.deadline[key]
+            expired.extend(due)
+        self.current = max(self.current, target)
+        return expired
+
+
+class PresenceTracker:
+    """Users seen within the last ``timeout`` seconds; calls on_expire for the rest"""
+
+    def __init__(self, timeout, on_expire=None, tick=TICK_SECONDS):
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self.wheel = TimingWheel(tick=tick)
+        self.expired_total = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.wheel)
+
+    def touch(self, user_id):
+        """Record a sign of life; returns True if the user was not being tracked"""
+        with self._lock:
+            returning = user_id not in self.wheel
+            self.wheel.schedule(user_id, self.timeout)
+        return returning
+
+    def touch_all(self, user_ids):
+        with self._lock:
+            for user_id in list(user_ids):
+                self.wheel.schedule(user_id, self.timeout)
+
+    def forget(self, user_id):
+        with self._lock:
+            self.wheel.cancel(user_id)
+
+    def expire(self, now=None):
+        """Drop users whose deadline has passed and hand them to on_expire"""
+        with self._lock:
+            expired = self.wheel.advance(time.time() if now is None else now)
+        if expired:
+            self.expired_total += len(expired)
+            if self.on_expire:
+                self.on_expire(expired)
+        return expired
+
+    def start(self):
+        if self._thread is None and self.timeout > 0:
+            self._thread = threading.Thread(target=self._run, name='presence', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.wheel.tick):
+            try:
+                self.expire()
+            except Exception as e:
+                print(f'Presence sweep failed: {e}')
@@ -0,0 +1,258 @@
+"""
+Opt-in request profiling.
+
+A sampled request runs under cProfile and every SQL statement it sends
+through get_db() or get_read_db() is recorded with its timing and row count. Each endpoint's
+profiles are merged into PROFILE_DIR/<endpoint>.pstats (open them with
+``python -m pstats``), and the slowest requests are kept in memory with
+their top functions and SQL breakdown for the admin endpoint.
+
+Only one request is under cProfile at a time; other sampled requests that
+overlap it still get their SQL traced.
+"""
+
+import cProfile
+import heapq
+import io
+import itertools
+import os
+import pstats
+import random
+import re
+import sqlite3
+import threading
+import time
+
+SLOWEST_KEPT = 50
+TOP_FUNCTIONS = 15
+MAX_STATEMENTS = 500  # Per request; a runaway loop should not eat memory
+
+_local = threading.local()
+
+
+def active():
+    """The RequestProfile for the current thread, or None"""
+    return getattr(_local, 'profile', None)
+
+
+class RequestProfile:
+    def __init__(self, endpoint, method, path):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.elapsed = None
+        self.status = None
+        self.statements = []  # Format: [{'sql': str, 'ms': float, 'rows': int}]
+        self.dropped_statements = 0
+        self.profiler = None
+        self.functions = []
+
+    def add_statement(self, sql, ms=None, rows=None):
+        if len(self.statements) >= MAX_STATEMENTS:
+            self.dropped_statements += 1
+            return None
+        entry = {'sql': ' '.join(sql.split()), 'ms': round(ms, 3) if ms is not None else None, 'rows': rows}
+        self.statements.append(entry)
+        return entry
+
+    def summary(self):
+        sql_ms = sum(s['ms'] or 0 for s in self.statements)
+        return {
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'started': self.started,
+            'elapsed_ms': round(self.elapsed * 1000, 3),
+            'sql_ms': round(sql_ms, 3),
+            'sql_count': len(self.statements) + self.dropped_statements,
+            'sql': self.statements,
+            'functions': self.functions,
+        }
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that times each statement and counts the rows it returns.
+
+    SQLite produces a SELECT's rows one step at a time as they are read, so
+    the time spent fetching or iterating is added to the statement's entry
+    along with the rows, until the cursor runs out or is reused.
+    """
+
+    _entry = None
+    _ms = 0.0
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def _timed(self, method, sql, parameters):
+        connection = self.connection
+        connection.in_execute = True
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            self._ms = (time.perf_counter() - start) * 1000
+            connection.in_execute = False
+            profile = active()
+            self._entry = profile.add_statement(sql, self._ms, max(self.rowcount, 0)) if profile else None
+
+    def _fetched(self, start, rows):
+        """Charge a fetch's time and rows to the statement being read"""
+        entry = self._entry
+        if entry is not None:
+            self._ms += (time.perf_counter() - start) * 1000
+            entry['ms'] = round(self._ms, 3)
+            entry['rows'] += rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0)
+            self._entry = None
+            raise
+        self._fetched(start, 1)
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose statements are recorded on the active RequestProfile.
+
+    Statements issued through execute() are timed by TracedCursor. The trace
+    callback catches the ones sqlite runs on its own behalf (the implicit
+    BEGIN before a write, COMMIT, executescript), which have no timing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_execute = False
+        self.set_trace_callback(self._on_statement)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        self.in_execute = True
+        try:
+            super().commit()
+        finally:
+            self.in_execute = False
+            profile = active()
+            if profile:
+                profile.add_statement('COMMIT', (time.perf_counter() - start) * 1000, 0)
+
+    def _on_statement(self, sql):
+        profile = active()
+        if profile and not self.in_execute:
+            profile.add_statement(sql)
+
+
+class Profiler:
+    def __init__(self, sample_rate=0.0, directory='profiles'):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.slowest = []  # Min-heap of (elapsed, sequence, summary)
+        self._sequence = itertools.count()
+        self._stats = {}  # Format: {endpoint: pstats.Stats}
+        self._cprofile_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def wants(self, forced=False):
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def begin(self, endpoint, method, path):
+        profile = RequestProfile(endpoint or 'unknown', method, path)
+        if self._cprofile_lock.acquire(blocking=False):
+            profile.profiler = cProfile.Profile()
+            profile.profiler.enable()
+        _local.profile = profile
+        return profile
+
+    def finish(self, profile, elapsed, status=None):
+        _local.profile = None
+        profile.elapsed = elapsed
+        profile.status = status
+        if profile.profiler is not None:
+            profile.profiler.disable()
+            self._cprofile_lock.release()
+            profile.functions = top_functions(profile.profiler)
+            self._merge_stats(profile.endpoint, profile.profiler)
+            profile.profiler = None
+
+        with self._lock:
+            item = (elapsed, next(self._sequence), profile.summary())
+            if len(self.slowest) < SLOWEST_KEPT:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def _merge_stats(self, endpoint, profiler):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = pstats.Stats(profiler)
+            else:
+                stats.add(profiler)
+            stats.dump_stats(os.path.join(self.directory, f'{safe_name(endpoint)}.pstats'))
+
+    def slowest_requests(self, limit=20):
+        with self._lock:
+            return [summary for _elapsed, _seq, summary in heapq.nlargest(limit, self.slowest)]
+
+
+def safe_name(endpoint):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', endpoint)
+
+
+def short_path(filename):
+    """Last two path components, enough to tell flask/app.py from app.py"""
+    return '/'.join(filename.replace(os.sep, '/').split('/')[-2:])
+
+
+def top_functions(profiler, limit=TOP_FUNCTIONS):
+    """The functions with the most cumulative time in one profile"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, name), (_cc, calls, tottime, cumtime, _callers) in stats.stats.items():
+        rows.append({
+            'function': f'{short_path(filename)}:{line}({name})',
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumtime_ms'], reverse=True)
+    return rows[:limit]
@@ -0,0 +1,289 @@
+"""
+Ranked-choice elections: instant-runoff (one seat) and single transferable
+vote (several seats).
+
+A RankedElection keeps one int8 row per voter slot (the room's VoterSlots),
+holding candidate numbers in preference order padded with -1, so 100,000
+ballots over 20 candidates take 2 MB.
+
+count() runs the rounds with NumPy. Every ballot points at its current
+preference, and the ballots sitting with each candidate are kept as a pile
+of index arrays. Eliminating or electing a candidate only touches that
+candidate's pile: those ballots advance to their next continuing preference
+together, and the receiving tallies grow by a bincount of where they landed.
+Nothing else is recounted.
+
+Multi-seat counts use the Droop quota and move each winner's surplus at a
+fractional value (Gregory method). Single-seat counts are plain IRV: a
+candidate wins with more than half of the ballots still in play.
+
+count_python() at the bottom recounts IRV from scratch every round, one
+ballot at a time; benchmark.py compares the two.
+"""
+
+import threading
+
+import numpy as np
+
+MAX_CANDIDATES = 100
+EMPTY = -1
+
+_cast_lock = threading.Lock()  # cast() swaps in grown arrays, so two concurrent casts could drop a ballot
+
+# RankedElection.cast() results
+CAST = 'cast'
+ALREADY_VOTED = 'already_voted'
+CLOSED = 'closed'
+
+
+class RankedError(ValueError):
+    pass
+
+
+def parse_ranking(ranking, candidates):
+    """Candidate numbers for a ranking given as names or numbers"""
+    if not isinstance(ranking, list) or not ranking:
+        raise RankedError('ranking must be a non-empty list of candidates')
+    numbers = []
+    for choice in ranking:
+        if isinstance(choice, bool):
+            raise RankedError(f'Unknown candidate {choice!r}')
+        if isinstance(choice, int) and 0 <= choice < len(candidates):
+            numbers.append(choice)
+        elif isinstance(choice, str) and choice in candidates:
+            numbers.append(candidates.index(choice))
+        else:
+            raise RankedError(f'Unknown candidate {choice!r}')
+    if len(set(numbers)) != len(numbers):
+        raise RankedError('Each candidate can only be ranked once')
+    return numbers
+
+
+class RankedElection:
+    """A ranked ballot over ``candidates`` for the members of one room.
+
+    ``closed`` is only set under the cast lock (see close()), so no ballot
+    can land after the final count has been taken.
+    """
+
+    _casts = 0  # Ballots accepted so far; tells result() whether its count is still current
+
+    def __init__(self, title, candidates, seats, slots):
+        if not 2 <= len(candidates) <= MAX_CANDIDATES or len(set(candidates)) != len(candidates):
+            raise RankedError(f'An election needs 2-{MAX_CANDIDATES} distinct candidates')
+        if not 1 <= seats < len(candidates):
+            raise RankedError('seats must be at least 1 and fewer than the candidates')
+        self.title = title
+        self.candidates = list(candidates)
+        self.seats = seats
+        self.slots = slots
+        self.rankings = np.full((0, len(candidates)), EMPTY, dtype=np.int8)
+        self.voted = np.zeros(0, dtype=bool)
+        self.closed = False
+        self._result = None  # Cached count, dropped on every new ballot
+
+    @property
+    def ballot_count(self):
+        return int(self.voted.sum())
+
+    def has_voted(self, user_id):
+        slot = self.slots.get(user_id)
+        return slot is not None and slot < len(self.voted) and bool(self.voted[slot])
+
+    def cast(self, user_id, ranking):
+        """Record a ranking (candidate numbers); returns CAST, ALREADY_VOTED or CLOSED"""
+        slot = self.slots.assign(user_id)
+        with _cast_lock:
+            if self.closed:
+                return CLOSED
+            if slot >= len(self.voted):
+                grow = max(slot + 1, 2 * len(self.voted), 16) - len(self.voted)
+                self.rankings = np.vstack([self.rankings, np.full((grow, len(self.candidates)), EMPTY, dtype=np.int8)])
+                self.voted = np.concatenate([self.voted, np.zeros(grow, dtype=bool)])
+            if self.voted[slot]:
+                return ALREADY_VOTED
+            self.rankings[slot, :len(ranking)] = ranking
+            self.voted[slot] = True
+            self._casts += 1
+            self._result = None
+        return CAST
+
+    def close(self):
+        """Stop accepting ballots and return the final count"""
+        with _cast_lock:
+            self.closed = True
+        return self.result()
+
+    def ranking_of(self, user_id):
+        if not self.has_voted(user_id):
+            return None
+        row = self.rankings[self.slots.get(user_id)]
+        return [self.candidates[c] for c in row[row >= 0]]
+
+    def result(self):
+        with _cast_lock:
+            if self._result is not None:
+                return self._result
+            ballots = self.rankings[self.voted]  # A copy, taken while no cast is swapping the arrays
+            casts = self._casts
+        # Count outside the lock so casts in other rooms do not wait for it
+        result = count(ballots, len(self.candidates), self.seats, self.candidates)
+        with _cast_lock:
+            if self._casts == casts:
+                self._result = result
+        return result
+
+
+def count(rankings, n_candidates, seats=1, names=None):
+    """Round-by-round IRV (seats=1) or STV count of a ballots x ranks array of candidate numbers"""
+    rankings = np.asarray(rankings)
+    n_ballots = len(rankings)
+    names = names or [str(c) for c in range(n_candidates)]
+    exhausted = n_candidates  # Pseudo-candidate every finished ballot ends up with
+    ranks = np.full((n_ballots, rankings.shape[1] + 1 if rankings.ndim == 2 else 1), exhausted, dtype=np.int16)
+    if n_ballots:
+        ranks[:, :-1] = np.where(rankings >= 0, rankings, exhausted)
+    pointer = np.zeros(n_ballots, dtype=np.int16)
+    weight = np.ones(n_ballots)
+    accepts = np.ones(n_candidates + 1, dtype=bool)  # Continuing candidates, plus exhausted
+
+    def advance(ballots):
+        """Move ballots on to their first preference that is still accepting"""
+        moving = ballots
+        while moving.size:
+            stuck = ~accepts[ranks[moving, pointer[moving]]]
+            moving = moving[stuck]
+            pointer[moving] += 1
+        return ranks[ballots, pointer[ballots]]
+
+    current = advance(np.arange(n_ballots))
+    tallies = np.bincount(current, weights=weight, minlength=n_candidates + 1)
+    order = np.argsort(current, kind='stable')
+    bounds = np.searchsorted(current[order], np.arange(n_candidates + 2))
+    piles = [[order[bounds[c]:bounds[c + 1]]] for c in range(n_candidates + 1)]
+
+    def transfer(candidate, value=1.0):
+        """Hand the candidate's ballots on at ``value`` of their weight; returns the amounts received"""
+        ballots = np.concatenate(piles[candidate])
+        piles[candidate] = []
+        accepts[candidate] = False
+        tallies[candidate] = 0.0
+        if value != 1.0:
+            weight[ballots] *= value
+        landed = advance(ballots)
+        received = np.bincount(landed, weights=weight[ballots], minlength=n_candidates + 1)
+        tallies[:] += received
+        order = np.argsort(landed, kind='stable')
+        bounds = np.searchsorted(landed[order], np.arange(n_candidates + 2))
+        for target in np.flatnonzero(np.diff(bounds)):
+            piles[target].append(ballots[order[bounds[target]:bounds[target + 1]]])
+        return received
+
+    quota = np.floor(n_ballots / (seats + 1)) + 1 if seats > 1 else None
+    elected = []
+    eliminated = []
+    history = []  # Tallies of every round, for breaking ties
+    rounds = []
+    while len(elected) < seats:
+        continuing = np.flatnonzero(accepts[:n_candidates])
+        history.append(tallies[:n_candidates].copy())
+        round_info = {
+            'round': len(rounds) + 1,
+            'tallies': {names[c]: _amount(tallies[c]) for c in continuing},
+            'exhausted': _amount(tallies[exhausted]),
+        }
+        rounds.append(round_info)
+        if not continuing.size:
+            break
+        if len(continuing) <= seats - len(elected):
+            # Everyone left fills the remaining seats
+            for c in sorted(continuing, key=lambda c: -tallies[c]):
+                elected.append(int(c))
+            round_info['elected'] = [names[c] for c in elected[-len(continuing):]]
+            break
+
+        live = tallies[continuing]
+        if not live.any():
+            break  # Every ballot is exhausted; the remaining seats stay empty
+        leader = continuing[_pick(live, history, continuing, highest=True)]
+        if quota is None:
+            wins = tallies[leader] * 2 > live.sum()
+        else:
+            wins = tallies[leader] >= quota
+        if wins:
+            elected.append(int(leader))
+            round_info['elected'] = [names[leader]]
+            if len(elected) == seats:
+                break
+            surplus = tallies[leader] - quota
+            received = transfer(leader, surplus / tallies[leader] if tallies[leader] else 0.0)
+        else:
+            loser = continuing[_pick(live, history, continuing, highest=False)]
+            eliminated.append(int(loser))
+            round_info['eliminated'] = names[loser]
+            received = transfer(loser)
+        round_info['transfers'] = {
+            (names[c] if c < n_candidates else 'exhausted'): _amount(received[c])
+            for c in np.flatnonzero(received)
+        }
+
+    return {
+        'method': 'irv' if seats == 1 else 'stv',
+        'seats': seats,
+        'ballots': n_ballots,
+        'quota': _amount(quota) if quota is not None else None,
+        'elected': [names[c] for c in elected],
+        'eliminated': [names[c] for c in eliminated],
+        'rounds': rounds,
+    }
+
+
+def _pick(live, history, continuing, highest):
+    """Index into ``continuing`` of the highest or lowest tally.
+
+    Ties go to the candidate that was ahead (or behind) in the latest earlier
+    round where they differed, then to the lower (or higher) candidate number.
+    """
+    target = live.max() if highest else live.min()
+    tied = np.flatnonzero(np.isclose(live, target))
+    for past in reversed(history[:-1]):
+        if len(tied) == 1:
+            break
+        values = past[continuing[tied]]
+        best = values.max() if highest else values.min()
+        tied = tied[np.isclose(values, best)]
+    return int(tied[0] if highest else tied[-1])
+
+
+def _amount(value):
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 4)
+
+
+def count_python(rankings, n_candidates):
+    """IRV winner and elimination order, recounting every ballot each round (reference for benchmarks)"""
+    ballots = [[c for c in row if c >= 0] for row in np.asarray(rankings).tolist()]
+    continuing = set(range(n_candidates))
+    eliminated = []
+    history = []
+    while continuing:
+        tallies = dict.fromkeys(continuing, 0)
+        for ballot in ballots:
+            for c in ballot:
+                if c in continuing:
+                    tallies[c] += 1
+                    break
+        history.append(tallies)
+        live = sum(tallies.values())
+        leader = max(sorted(continuing), key=lambda c: _rank_key(c, history, True))
+        if tallies[leader] * 2 > live or len(continuing) == 1:
+            return {'elected': [leader], 'eliminated': eliminated}
+        loser = max(sorted(continuing), key=lambda c: _rank_key(c, history, False))
+        continuing.discard(loser)
+        eliminated.append(loser)
+    return {'elected': [], 'eliminated': eliminated}
+
+
+def _rank_key(c, history, highest):
+    sign = 1 if highest else -1
+    return tuple(sign * round_tallies.get(c, 0) for round_tallies in reversed(history)) + ((-c if highest else c),)
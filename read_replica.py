@@ -0,0 +1,256 @@
+"""
+Read-only replica of the SQLite database for result and history reads.
+
+A background thread copies the live database with the sqlite3 backup API
+every REPLICA_INTERVAL seconds into a new file and swaps it in as the
+current generation. A published file never changes, so readers open it
+with ``mode=ro&immutable=1``: SQLite takes no file locks and never checks
+for changes, and with a large ``mmap_size`` pages are read straight from
+the OS page cache. Reads on the replica neither wait for vote writes on the
+live file nor hold them up.
+
+The copy itself is one read transaction on the live file. The app keeps
+that file in WAL mode (see init_db), where a reader never blocks a commit,
+so votes keep committing while it runs; in rollback-journal mode the copy
+would hold a SHARED lock that every commit has to wait out. A tick where
+``PRAGMA data_version`` shows no commit since the last copy skips the copy
+and only marks the current generation as still up to date.
+
+Connections are pooled per generation. A request leases one from the
+current generation and gives it back at the end; once a newer generation is
+published the old one takes no new leases, and its file is deleted when the
+last lease comes back. Job processes pin a generation's file the same way.
+
+Each generation records the time its data is known to be current as of
+(``as_of``): when its copy started, moved forward by every tick that finds
+nothing new. Callers use it to say how stale a response is.
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+POOL_SIZE = 8  # Idle connections kept per generation
+MMAP_SIZE = 256 << 20
+
+
+class Generation:
+    """One published copy of the database"""
+
+    __slots__ = ('number', 'path', 'as_of', 'bytes', 'publish_ms', 'pool', 'leases', 'retired')
+
+    def __init__(self, number, path, as_of, publish_ms):
+        self.number = number
+        self.path = path
+        self.as_of = as_of
+        self.bytes = os.path.getsize(path)
+        self.publish_ms = publish_ms
+        self.pool = []  # Idle connections
+        self.leases = 0
+        self.retired = False
+
+    def age(self, now=None):
+        return max((now or time.time()) - self.as_of, 0.0)
+
+
+class ReadReplica:
+    """Periodic read-only copies of the database returned by ``open_source()``"""
+
+    def __init__(self, open_source, directory, interval, pool_size=POOL_SIZE, mmap_size=MMAP_SIZE):
+        self.open_source = open_source
+        self.directory = directory
+        self.interval = interval
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        self.current = None
+        self.published = 0
+        self.skipped = 0  # Ticks with nothing new to copy
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Publish the first generation, then keep publishing in the background (no-op when interval is 0)"""
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._remove_stale_files()
+        self._publish_logged()
+        self._thread = threading.Thread(target=self._run, name='read-replica', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop publishing and delete this process's files"""
+        self._stop.set()
+        with self._lock:
+            generation, self.current = self.current, None
+        if generation:
+            self._retire(generation)
+
+    def publish(self):
+        """Copy the live database into a new generation and make it current; returns it"""
+        with self._publish_lock:
+            start = time.perf_counter()
+            as_of = time.time()
+            number = self.published + 1
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'replica-{os.getpid()}-{number}.db')
+            partial = path + '.partial'
+            source = self.open_source()
+            try:
+                dest = sqlite3.connect(partial)
+                try:
+                    # One step: a stepped copy starts over whenever a vote commits mid-way
+                    source.backup(dest)
+                    # The copy inherits WAL mode; readers open it immutable, without a -wal file
+                    dest.execute('PRAGMA journal_mode = DELETE')
+                finally:
+                    dest.close()
+            finally:
+                source.close()
+            os.replace(partial, path)
+            generation = Generation(number, path, as_of, round((time.perf_counter() - start) * 1000, 1))
+            with self._lock:
+                previous, self.current = self.current, generation
+                self.published = number
+            if previous:
+                self._retire(previous)
+            return generation
+
+    def lease(self, factory=sqlite3.Connection):
+        """(connection, generation) on the current generation, or (None, None) before the first publish.
+
+        Only plain connections are pooled; another ``factory`` (e.g. a traced
+        connection for a profiled request) gets a fresh one, closed on release.
+        """
+        with self._lock:
+            generation = self.current
+            if generation is None:
+                return None, None
+            generation.leases += 1
+            db = generation.pool.pop() if generation.pool and factory is sqlite3.Connection else None
+        if db is None:
+            try:
+                db = self._open(generation.path, factory)
+            except sqlite3.Error:
+                self.release(None, generation)
+                raise
+        return db, generation
+
+    def release(self, db, generation):
+        """Give a leased connection (or a pin, with db=None) back"""
+        with self._lock:
+            generation.leases -= 1
+            if db is not None and type(db) is sqlite3.Connection and not generation.retired and len(generation.pool) < self.pool_size:
+                generation.pool.append(db)
+                db = None
+            drop = generation.retired and generation.leases == 0
+        if db is not None:
+            db.close()
+        if drop:
+            _remove(generation.path)
+
+    def pin(self):
+        """The current generation for another process to read, or None; release(None, generation) when done"""
+        with self._lock:
+            generation = self.current
+            if generation is not None:
+                generation.leases += 1
+            return generation
+
+    def stats(self):
+        with self._lock:
+            generation = self.current
+            if generation is None:
+                return {'enabled': self.interval > 0, 'generation': None, 'last_error': self.last_error}
+            return {
+                'enabled': True,
+                'generation': generation.number,
+                'as_of': generation.as_of,
+                'age_seconds': round(generation.age(), 1),
+                'bytes': generation.bytes,
+                'publish_ms': generation.publish_ms,
+                'leases': generation.leases,
+                'pooled': len(generation.pool),
+                'skipped': self.skipped,
+                'last_error': self.last_error,
+            }
+
+    def _open(self, path, factory=sqlite3.Connection):
+        db = sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}?mode=ro&immutable=1', uri=True,
+                             check_same_thread=False, factory=factory)
+        db.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _retire(self, generation):
+        """Stop lending a generation's connections; its file goes once the last lease is back"""
+        with self._lock:
+            generation.retired = True
+            idle, generation.pool = generation.pool, []
+            drop = generation.leases == 0
+        for db in idle:
+            db.close()
+        if drop:
+            _remove(generation.path)
+
+    def _publish_logged(self):
+        try:
+            self.publish()
+            self.last_error = None
+            return True
+        except (sqlite3.Error, OSError) as e:
+            # Keep serving the previous generation
+            self.last_error = f'{type(e).__name__}: {e}'
+            return False
+
+    def _mark_fresh(self, checked_at):
+        """Nothing was committed since the current generation was copied: it is up to date as of checked_at"""
+        with self._lock:
+            if self.current is None:
+                return False
+            self.current.as_of = checked_at
+            self.skipped += 1
+            return True
+
+    def _run(self):
+        watch = None  # data_version only tells commits apart on one connection, so keep it open
+        copied = None  # data_version the current generation was copied at; the first tick always copies
+        while not self._stop.wait(self.interval):
+            try:
+                if watch is None:
+                    watch = self.open_source()
+                checked_at = time.time()  # Any commit before this has changed the version read next
+                version = watch.execute('PRAGMA data_version').fetchone()[0]
+            except sqlite3.Error as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                watch = version = None  # Reconnect next tick
+            if version is not None and version == copied and self._mark_fresh(checked_at):
+                continue
+            if self._publish_logged():
+                copied = version  # Read before the copy, so a commit during it triggers the next one
+
+    def _remove_stale_files(self):
+        """Delete copies left behind by processes that are no longer running"""
+        for path in glob.glob(os.path.join(self.directory, 'replica-*-*.db*')):
+            try:
+                pid = int(os.path.basename(path).split('-')[1])
+                if pid != os.getpid():  # Ours can only be from an earlier process that had the same pid
+                    os.kill(pid, 0)
+                    continue
+            except ProcessLookupError:
+                pass
+            except (ValueError, PermissionError):
+                continue
+            _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,123 @@
+"""
+Searchable directory of live rooms.
+
+Two sorted indexes (case-folded room name, and room code) are kept in step
+with voting_rooms as rooms open and close. A prefix search bisects to the
+first match and walks forward only as far as the page needs, so browsing
+costs O(log n + page size) however many rooms are open.
+
+Pages are resumed with an opaque cursor holding the last (key, code) seen,
+which stays valid when rooms before it open or close.
+"""
+
+import base64
+import bisect
+import threading
+
+MAX_PAGE = 100
+
+
+class DirectoryError(ValueError):
+    pass
+
+
+class SortedIndex:
+    """Sorted (key, room_code) pairs"""
+
+    def __init__(self):
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, room_code):
+        bisect.insort(self.entries, (key, room_code))
+
+    def remove(self, key, room_code):
+        i = bisect.bisect_left(self.entries, (key, room_code))
+        if i < len(self.entries) and self.entries[i] == (key, room_code):
+            del self.entries[i]
+
+    def page(self, prefix, after=None, limit=20):
+        """Up to ``limit`` codes whose key starts with prefix, after the (key, code) cursor"""
+        start = bisect.bisect_left(self.entries, (prefix, ''))
+        if after is not None:
+            start = max(start, bisect.bisect_right(self.entries, after))
+        matches = []
+        for key, room_code in self.entries[start:start + limit + 1]:
+            if not key.startswith(prefix):
+                break
+            matches.append((key, room_code))
+        return matches[:limit], len(matches) > limit
+
+
+def name_key(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+def encode_cursor(entry):
+    return base64.urlsafe_b64encode('\n'.join(entry).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        key, room_code = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('\n')
+    except (ValueError, UnicodeDecodeError):
+        raise DirectoryError('Invalid cursor')
+    return key, room_code
+
+
+class RoomDirectory:
+    def __init__(self):
+        self.by_name = SortedIndex()
+        self.by_code = SortedIndex()
+        self.names = {}  # Format: {room_code: name key}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, room_code, name):
+        with self._lock:
+            self._remove(room_code)
+            key = name_key(name)
+            self.names[room_code] = key
+            self.by_name.add(key, room_code)
+            self.by_code.add(room_code, room_code)
+
+    def remove(self, room_code):
+        with self._lock:
+            self._remove(room_code)
+
+    def _remove(self, room_code):
+        key = self.names.pop(room_code, None)
+        if key is not None:
+            self.by_name.remove(key, room_code)
+            self.by_code.remove(room_code, room_code)
+
+    def rebuild(self, rooms):
+        """Re-index every room, after live state was replaced wholesale"""
+        with self._lock:
+            self.by_name = SortedIndex()
+            self.by_code = SortedIndex()
+            self.names = {}
+            for room_code, room in list(rooms.items()):
+                key = name_key(room['name'])
+                self.names[room_code] = key
+                self.by_name.entries.append((key, room_code))
+                self.by_code.entries.append((room_code, room_code))
+            self.by_name.entries.sort()
+            self.by_code.entries.sort()
+
+    def search(self, prefix='', by='name', cursor=None, limit=20):
+        """(room codes, next cursor or None) for one page of a prefix search"""
+        if not 1 <= limit <= MAX_PAGE:
+            raise DirectoryError(f'limit must be 1-{MAX_PAGE}')
+        index = {'name': self.by_name, 'code': self.by_code}.get(by)
+        if index is None:
+            raise DirectoryError('by must be name or code')
+        prefix = name_key(prefix) if by == 'name' else prefix.strip().upper()
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            matches, more = index.page(prefix, after, limit)
+        return [room_code for _key, room_code in matches], (encode_cursor(matches[-1]) if more else None)
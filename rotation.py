@@ -0,0 +1,122 @@
+"""
+Per-room proposer rotation.
+
+Picks the next proposer from the room's member list without touching the
+database. Every pick, join and leave is O(1): members live in one array that
+is split into a "pending" part (not yet picked in this cycle) and a "done"
+part, so starting a new cycle is just moving the split point.
+"""
+
+import random
+import time
+from collections import deque
+
+HISTORY_LIMIT = 500  # Picks kept in memory per room
+MIN_WEIGHT = 0.1
+MAX_WEIGHT = 10.0
+MAX_REJECTIONS = 64  # Cap on weighted re-draws so a pick always terminates
+
+
+class ProposerRotation:
+    """Fair proposer rotation for one room.
+
+    Nobody is picked twice until every current member has been picked once
+    in the cycle. Optional weights make heavier members more likely to be
+    picked early in a cycle, without letting them skip the queue twice.
+    """
+
+    def __init__(self):
+        self.names = {}  # Format: {user_id: display name}
+        self.weights = {}  # Format: {user_id: weight}, only for weights != 1
+        self.cycle = 1
+        self.history = deque(maxlen=HISTORY_LIMIT)  # Recent picks, newest last
+        self.unsaved = []  # Picks not yet written to proposer_history
+        self._order = []  # Members; [0, _pending) not picked yet this cycle
+        self._pos = {}  # Format: {user_id: index in _order}
+        self._pending = 0
+        self._max_weight = 1.0
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, user_id):
+        return user_id in self._pos
+
+    def _swap(self, i, j):
+        order = self._order
+        order[i], order[j] = order[j], order[i]
+        self._pos[order[i]] = i
+        self._pos[order[j]] = j
+
+    def add(self, user_id, name):
+        """Add a member; newcomers can still be picked in the current cycle"""
+        self.names[user_id] = name
+        if user_id in self._pos:
+            return
+        self._order.append(user_id)
+        self._pos[user_id] = len(self._order) - 1
+        self._swap(self._pending, len(self._order) - 1)
+        self._pending += 1
+
+    def remove(self, user_id):
+        """Remove a member, wherever they are in the cycle"""
+        index = self._pos.get(user_id)
+        if index is None:
+            return
+        if index < self._pending:
+            self._swap(index, self._pending - 1)
+            index = self._pending - 1
+            self._pending -= 1
+        self._swap(index, len(self._order) - 1)
+        self._order.pop()
+        del self._pos[user_id]
+        self.names.pop(user_id, None)
+        self.weights.pop(user_id, None)
+
+    def set_weights(self, weights):
+        """Replace member weights; missing members fall back to weight 1"""
+        self.weights = {
+            uid: min(max(float(w), MIN_WEIGHT), MAX_WEIGHT)
+            for uid, w in weights.items()
+            if uid in self._pos and float(w) != 1.0
+        }
+        self._max_weight = max([1.0, *self.weights.values()])
+
+    def pick(self):
+        """Pick the next proposer, or None if the room is empty"""
+        if not self._order:
+            return None
+        if self._pending == 0:
+            # Everyone has proposed: start the next cycle
+            self._pending = len(self._order)
+            self.cycle += 1
+
+        index = random.randrange(self._pending)
+        if self.weights:
+            # Rejection sampling keeps weighted picks O(1) on average
+            for _ in range(MAX_REJECTIONS):
+                weight = self.weights.get(self._order[index], 1.0)
+                if random.random() * self._max_weight < weight:
+                    break
+                index = random.randrange(self._pending)
+
+        user_id = self._order[index]
+        self._swap(index, self._pending - 1)
+        self._pending -= 1
+
+        entry = (user_id, self.names.get(user_id), self.cycle, time.time())
+        self.history.append(entry)
+        self.unsaved.append(entry)
+        return user_id
+
+    def remaining(self):
+        """Members not yet picked in the current cycle"""
+        return self._pending
+
+    def take_unsaved(self, room_code):
+        """proposer_history rows for picks not yet saved; the caller writes them"""
+        unsaved, self.unsaved = self.unsaved, []  # A pick racing this lands in one list or the other
+        return [
+            (room_code, user_id, cycle, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(picked_at)))
+            for user_id, _name, cycle, picked_at in unsaved
+        ]
@@ -0,0 +1,227 @@
+"""
+Router for a room-sharded, multi-node deployment.
+
+Every request is forwarded to one app node. Room traffic goes to the node
+that owns the room's shard on the consistent-hash ring (see sharding.py);
+the room is taken from the URL, the join request body, or the vw_room
+cookie the router sets once a user creates or joins a room. Anything else
+goes to a node picked from the session cookie.
+
+Run three nodes and a router locally:
+
+    ADMIN_TOKEN=secret NODE_URL=http://127.0.0.1:5001 CLUSTER_NODES=http://127.0.0.1:5001,http://127.0.0.1:5002 \\
+        SNAPSHOT_PATH=node1.snapshot LEDGER_PATH=node1.ledger PORT=5001 python app.py
+    (same for 5002)
+    ADMIN_TOKEN=secret python router.py serve --nodes http://127.0.0.1:5001,http://127.0.0.1:5002 --port 5000
+
+Add a node later (its rooms are moved over from the current owners):
+
+    ADMIN_TOKEN=secret python router.py add-node http://127.0.0.1:5003 --router http://127.0.0.1:5000
+"""
+
+import argparse
+import hmac
+import http.client
+import json
+import os
+import re
+import sys
+import threading
+from urllib.parse import urlsplit
+
+from werkzeug.serving import run_simple
+from werkzeug.wrappers import Request, Response
+
+import sharding
+
+ROOM_COOKIE = 'vw_room'
+ROOM_PATH = re.compile(r'^/api/room/(?:info/([A-Za-z0-9]{6})$|([A-Z0-9]{6})(?:/|$))')
+HOP_BY_HOP = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'content-length', 'host',
+}
+TIMEOUT = 30
+
+
+class RouterError(Exception):
+    pass
+
+
+def call_node(node, method, path, body=None, headers=None, timeout=TIMEOUT):
+    """Send one request to a node; returns (status, headers, body bytes)"""
+    url = urlsplit(node)
+    conn_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+    conn = conn_class(url.hostname, url.port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.getheaders(), response.read()
+    finally:
+        conn.close()
+
+
+class Router:
+    """WSGI app that forwards requests to the node owning the room"""
+
+    def __init__(self, nodes, admin_token=''):
+        self.ring = sharding.HashRing(nodes)
+        self.admin_token = admin_token
+        self._rebalance_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        if request.path.startswith('/_router/'):
+            response = self.handle_admin(request)
+        else:
+            response = self.forward(request)
+        return response(environ, start_response)
+
+    def room_code_for(self, request):
+        match = ROOM_PATH.match(request.path)
+        if match:
+            return (match.group(1) or match.group(2)).upper()
+        if request.path == '/api/room/join' and request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            return str(data.get('room_code', '')).upper() or None
+        return request.cookies.get(ROOM_COOKIE)
+
+    def pick_node(self, request):
+        room_code = self.room_code_for(request)
+        node = self.ring.owner_of_room(room_code) if room_code else None
+        if node is None:
+            node = self.ring.node_for(request.cookies.get('session') or request.remote_addr or '')
+        return node
+
+    def forward(self, request):
+        node = self.pick_node(request)
+        if node is None:
+            return Response('No nodes configured', status=503)
+
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP}
+        headers['X-Forwarded-For'] = request.remote_addr or ''
+        path = request.full_path if request.query_string else request.path
+        try:
+            status, node_headers, body = call_node(node, request.method, path, request.get_data(), headers)
+        except OSError as e:
+            return Response(json.dumps({'error': f'Node unavailable: {e}'}), status=502, mimetype='application/json')
+
+        response = Response(body, status=status)
+        for key, value in node_headers:
+            if key.lower() not in HOP_BY_HOP:
+                response.headers.add(key, value)
+        self.track_room(request, response, body)
+        return response
+
+    def track_room(self, request, response, body):
+        """Remember the user's room in a cookie so session-scoped calls reach its node"""
+        if request.path in ('/api/room/create', '/api/room/join') and response.status_code in (200, 201):
+            try:
+                room_code = json.loads(body).get('room_code')
+            except (ValueError, AttributeError):
+                room_code = None
+            if room_code:
+                response.set_cookie(ROOM_COOKIE, room_code, path='/', httponly=True, samesite='Lax')
+        elif request.path in ('/api/room/leave', '/logout'):
+            response.delete_cookie(ROOM_COOKIE, path='/')
+
+    def handle_admin(self, request):
+        if not self.admin_token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), self.admin_token):
+            return Response(json.dumps({'error': 'Forbidden'}), status=403, mimetype='application/json')
+        if request.path != '/_router/nodes':
+            return Response(json.dumps({'error': 'Not found'}), status=404, mimetype='application/json')
+
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            nodes = list(self.ring.nodes)
+            if data.get('add') and data['add'] not in nodes:
+                nodes.append(data['add'])
+            if data.get('remove') in nodes:
+                nodes.remove(data['remove'])
+            try:
+                moved = self.rebalance(nodes)
+            except RouterError as e:
+                return Response(json.dumps({'error': str(e)}), status=502, mimetype='application/json')
+        else:
+            moved = {}
+
+        return Response(json.dumps({
+            'nodes': {node: len(self.ring.shards_of(node)) for node in self.ring.nodes},
+            'moved_rooms': moved,
+        }), mimetype='application/json')
+
+    def _admin_call(self, node, path, payload, raw=False):
+        """POST to a node's internal API; raw=True sends payload (already JSON bytes) as is"""
+        headers = {'X-Admin-Token': self.admin_token, 'Content-Type': 'application/json'}
+        body = payload if raw else json.dumps(payload)
+        status, _headers, data = call_node(node, 'POST', path, body, headers)
+        if status != 200:
+            raise RouterError(f'{node}{path} returned {status}: {data[:200]!r}')
+        return data
+
+    def rebalance(self, nodes):
+        """Switch to a new node list, moving rooms whose shard changes owner.
+
+        Rooms are copied to their new owner before the ring is swapped and
+        only dropped from the old owner afterwards, so every request finds
+        its room somewhere. Writes that reach the old owner between the copy
+        and the swap are lost, so rebalance between rounds when possible.
+        """
+        with self._rebalance_lock:
+            old_ring, new_ring = self.ring, sharding.HashRing(nodes)
+            moves = sharding.moved_shards(old_ring, new_ring)
+
+            # New rooms must already be created in the right shards
+            for node in set(old_ring.nodes) | set(new_ring.nodes):
+                self._admin_call(node, '/api/internal/cluster', {'nodes': new_ring.nodes, 'node_url': node})
+
+            moved = {}
+            for (source, target), shards in moves.items():
+                if source is None or target is None:
+                    continue
+                data = self._admin_call(source, '/api/internal/shards/export', {'shards': shards})
+                result = json.loads(self._admin_call(target, '/api/internal/shards/import', data, raw=True))
+                moved[f'{source} -> {target}'] = result.get('rooms', 0)
+
+            self.ring = new_ring
+            for (source, target), shards in moves.items():
+                if source is not None and target is not None:
+                    self._admin_call(source, '/api/internal/shards/drop', {'shards': shards})
+            return moved
+
+
+def create_router():
+    """WSGI entry point for gunicorn: gunicorn 'router:create_router()'"""
+    nodes = [n for n in os.environ.get('ROUTER_NODES', '').split(',') if n]
+    return Router(nodes, os.environ.get('ADMIN_TOKEN', ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Route room traffic to the node that owns the room')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='run the router')
+    serve.add_argument('--nodes', required=True, help='comma-separated node URLs')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=5000)
+    for name in ('add-node', 'remove-node'):
+        change = sub.add_parser(name, help=f'{name.split("-")[0]} a node and rebalance rooms')
+        change.add_argument('node')
+        change.add_argument('--router', default='http://127.0.0.1:5000')
+    args = parser.parse_args(argv)
+
+    admin_token = os.environ.get('ADMIN_TOKEN', '')
+    if args.command == 'serve':
+        router = Router([n for n in args.nodes.split(',') if n], admin_token)
+        run_simple(args.host, args.port, router, threaded=True)
+        return 0
+
+    key = 'add' if args.command == 'add-node' else 'remove'
+    status, _headers, body = call_node(
+        args.router, 'POST', '/_router/nodes', json.dumps({key: args.node}),
+        {'X-Admin-Token': admin_token, 'Content-Type': 'application/json'}, timeout=300
+    )
+    print(body.decode())
+    return 0 if status == 200 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+JSON format for moving rooms between nodes.
+
+Shard moves cross the network, so unlike the local snapshot file they are
+never unpickled: every live-state type has an explicit converter here, and
+decoding only ever builds those types. Ballot bitsets and ranked-ballot
+arrays travel as base64.
+
+A room's VoterSlots is shared by its ballot boxes, tiebreak boxes and
+ranked election. It is written once per room, and each box names the room
+whose slots it uses, so the decoded boxes share one VoterSlots again.
+"""
+
+import base64
+import binascii
+import json
+from array import array
+from collections import deque
+
+import numpy as np
+
+import ranked_choice
+import tiebreak
+from ballots import BallotBox, VoterSlots
+from rotation import HISTORY_LIMIT, ProposerRotation
+
+FORMAT_VERSION = 1
+USER_SETS = ('ready_users', 'logged_in_users', 'users_skipped_proposal')
+
+
+class TransferError(Exception):
+    pass
+
+
+def _b64(data):
+    return base64.b64encode(bytes(data)).decode('ascii')
+
+
+def _unb64(text):
+    return base64.b64decode(text.encode('ascii'), validate=True)
+
+
+def _user_keys(mapping):
+    """JSON object keys are strings; user ids are ints"""
+    return {int(key): value for key, value in mapping.items()}
+
+
+# Encoding
+def _encode_slots(slots):
+    return list(slots.user_ids)
+
+
+def _encode_box(box, slot_rooms):
+    encoded = {'voted': _b64(box.voted), 'choices': _b64(box.choices), 'counts': list(box.counts)}
+    room_code = slot_rooms.get(id(box.slots))
+    if room_code is None:
+        encoded['slots'] = _encode_slots(box.slots)
+    else:
+        encoded['room'] = room_code
+    return encoded
+
+
+def _encode_rotation(rotation):
+    return {
+        'names': rotation.names,
+        'weights': rotation.weights,
+        'cycle': rotation.cycle,
+        'history': [list(entry) for entry in rotation.history],
+        'unsaved': [list(entry) for entry in rotation.unsaved],
+        'order': rotation._order,
+        'pending': rotation._pending,
+    }
+
+
+def _encode_phase(phase, slot_rooms):
+    return {
+        'phase': phase.phase,
+        'changed_at': phase.changed_at,
+        'finished_voting': list(phase.finished_voting),
+        'tied': list(phase.tied),
+        'agreed': list(phase.agreed),
+        'rejected': phase.rejected,
+        'arrived': list(phase.arrived),
+        'tiebreaker_votes': {uid: _encode_box(box, slot_rooms) for uid, box in phase.tiebreaker_votes.items()},
+        'finished_tiebreak': list(phase.finished_tiebreak),
+    }
+
+
+def _encode_election(election):
+    if election is None:
+        return None
+    return {
+        'title': election.title,
+        'candidates': election.candidates,
+        'seats': election.seats,
+        'closed': election.closed,
+        'rows': len(election.voted),
+        'rankings': _b64(election.rankings.astype(np.int8).tobytes()),
+        'voted': _b64(election.voted.astype(np.uint8).tobytes()),
+    }
+
+
+def encode(state):
+    """JSON bytes for a capture_rooms() state"""
+    rooms = state.get('voting_rooms', {})
+    slot_rooms = {id(room['slots']): code for code, room in rooms.items()}
+    data = {
+        'format': FORMAT_VERSION,
+        'voting_rooms': {
+            code: {
+                'name': room['name'],
+                'passcode': room['passcode'],
+                'created_by': room['created_by'],
+                'users': list(room['users']),
+                'created_date': room['created_date'],
+                'slots': _encode_slots(room['slots']),
+                'rotation': _encode_rotation(room['rotation']),
+                'phase': _encode_phase(room['phase'], slot_rooms),
+                'election': _encode_election(room.get('election')),
+            }
+            for code, room in rooms.items()
+        },
+        'user_rooms': state.get('user_rooms', {}),
+        'proposal_submissions': state.get('proposal_submissions', {}),
+        'proposal_bodies': state.get('proposal_bodies', {}),
+        'submission_votes': {uid: _encode_box(box, slot_rooms) for uid, box in state.get('submission_votes', {}).items()},
+    }
+    for name in USER_SETS:
+        data[name] = list(state.get(name, ()))
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+# Decoding
+def _decode_slots(user_ids):
+    slots = VoterSlots()
+    for user_id in user_ids:
+        slots.assign(int(user_id))
+    return slots
+
+
+def _decode_box(data, room_slots):
+    if 'room' in data:
+        slots = room_slots[data['room']]
+    else:
+        slots = _decode_slots(data['slots'])
+    box = BallotBox(slots)
+    box.voted = bytearray(_unb64(data['voted']))
+    box.choices = bytearray(_unb64(data['choices']))
+    counts = [int(c) for c in data['counts']]
+    if len(counts) != 3:
+        raise ValueError('A ballot box has three counters')
+    box.counts = array('I', counts)
+    return box
+
+
+def _decode_rotation(data):
+    rotation = ProposerRotation()
+    rotation.names = _user_keys(data['names'])
+    rotation.weights = {uid: float(w) for uid, w in _user_keys(data['weights']).items()}
+    rotation.cycle = int(data['cycle'])
+    rotation.history = deque(
+        ((int(uid), name, int(cycle), float(at)) for uid, name, cycle, at in data['history']), maxlen=HISTORY_LIMIT
+    )
+    rotation.unsaved = [(int(uid), name, int(cycle), float(at)) for uid, name, cycle, at in data['unsaved']]
+    rotation._order = [int(uid) for uid in data['order']]
+    rotation._pos = {uid: i for i, uid in enumerate(rotation._order)}
+    rotation._pending = int(data['pending'])
+    if not 0 <= rotation._pending <= len(rotation._order):
+        raise ValueError('Rotation cycle position is out of range')
+    rotation._max_weight = max([1.0, *rotation.weights.values()])
+    return rotation
+
+
+def _decode_phase(data, slots, room_slots):
+    phase = tiebreak.RoomPhase(slots)
+    if data['phase'] not in tiebreak.PHASES:
+        raise ValueError(f'Unknown phase {data["phase"]!r}')
+    phase.phase = data['phase']
+    phase.changed_at = float(data['changed_at'])
+    phase.finished_voting = {int(uid) for uid in data['finished_voting']}
+    phase.tied = [int(uid) for uid in data['tied']]
+    phase.agreed = {int(uid) for uid in data['agreed']}
+    phase.rejected = bool(data['rejected'])
+    phase.arrived = {int(uid) for uid in data['arrived']}
+    phase.tiebreaker_votes = {uid: _decode_box(box, room_slots) for uid, box in _user_keys(data['tiebreaker_votes']).items()}
+    phase.finished_tiebreak = {int(uid) for uid in data['finished_tiebreak']}
+    return phase
+
+
+def _decode_election(data, slots):
+    if data is None:
+        return None
+    election = ranked_choice.RankedElection(data['title'], data['candidates'], int(data['seats']), slots)
+    rows = int(data['rows'])
+    election.rankings = np.frombuffer(_unb64(data['rankings']), dtype=np.int8).reshape(rows, len(election.candidates)).copy()
+    election.voted = np.frombuffer(_unb64(data['voted']), dtype=np.uint8).astype(bool)
+    if len(election.voted) != rows:
+        raise ValueError('Ranked ballot arrays disagree in length')
+    if election.rankings.size and not (ranked_choice.EMPTY <= election.rankings.min() and election.rankings.max() < len(election.candidates)):
+        raise ValueError('A ranking names a candidate that does not exist')
+    election.closed = bool(data['closed'])
+    return election
+
+
+def decode(raw):
+    """Live-state structures from encode() output; raises TransferError on anything malformed"""
+    try:
+        data = json.loads(raw)
+        if not isinstance(data, dict) or data.get('format') != FORMAT_VERSION:
+            raise TransferError(f'Shard transfer format must be {FORMAT_VERSION}')
+        room_slots = {code: _decode_slots(room['slots']) for code, room in data['voting_rooms'].items()}
+        rooms = {}
+        for code, room in data['voting_rooms'].items():
+            slots = room_slots[code]
+            rooms[code] = {
+                'name': str(room['name']),
+                'passcode': room['passcode'],
+                'created_by': int(room['created_by']),
+                'users': {int(uid) for uid in room['users']},
+                'created_date': str(room['created_date']),
+                'slots': slots,
+                'rotation': _decode_rotation(room['rotation']),
+                'phase': _decode_phase(room['phase'], slots, room_slots),
+                'election': _decode_election(room['election'], slots),
+            }
+        state = {
+            'voting_rooms': rooms,
+            'user_rooms': {uid: str(code) for uid, code in _user_keys(data['user_rooms']).items()},
+            'proposal_submissions': {
+                uid: {'title': str(p['title']), 'body_hash': str(p['body_hash']), 'user_name': p['user_name'], 'user_id': int(p['user_id'])}
+                for uid, p in _user_keys(data['proposal_submissions']).items()
+            },
+            'proposal_bodies': {str(key): str(text) for key, text in data['proposal_bodies'].items()},
+            'submission_votes': {uid: _decode_box(box, room_slots) for uid, box in _user_keys(data['submission_votes']).items()},
+        }
+        for name in USER_SETS:
+            state[name] = {int(uid) for uid in data[name]}
+        return state
+    except TransferError:
+        raise
+    except (ValueError, KeyError, TypeError, AttributeError, OverflowError, binascii.Error) as e:
+        raise TransferError(f'Malformed shard transfer: {e}') from e
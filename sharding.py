@@ -0,0 +1,95 @@
+"""
+Room sharding for multi-node deployments.
+
+The first two characters of a room code name its shard (36 * 36 = 1296
+shards). A consistent-hash ring maps shards to nodes, so adding a node only
+moves the shards the ring hands to it. Nodes only create rooms in shards they
+own, and the router (router.py) sends room traffic to the owner of the room's
+shard.
+"""
+
+import bisect
+import hashlib
+import random
+import string
+
+ALPHABET = string.ascii_uppercase + string.digits
+SHARD_PREFIX = 2
+SHARD_COUNT = len(ALPHABET) ** SHARD_PREFIX
+ROOM_CODE_LENGTH = 6
+VIRTUAL_NODES = 128  # Points per node on the ring; more points = more even spread
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def shard_of(room_code):
+    """Shard number encoded in a room code, or None if the code is malformed"""
+    if not room_code or len(room_code) < SHARD_PREFIX:
+        return None
+    shard = 0
+    for char in room_code[:SHARD_PREFIX].upper():
+        index = ALPHABET.find(char)
+        if index < 0:
+            return None
+        shard = shard * len(ALPHABET) + index
+    return shard
+
+
+def shard_prefix(shard):
+    chars = []
+    for _ in range(SHARD_PREFIX):
+        shard, index = divmod(shard, len(ALPHABET))
+        chars.append(ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+def make_room_code(shards, rng=random):
+    """Random room code that falls in one of the given shards"""
+    prefix = shard_prefix(rng.choice(shards))
+    return prefix + ''.join(rng.choices(ALPHABET, k=ROOM_CODE_LENGTH - SHARD_PREFIX))
+
+
+class HashRing:
+    """Consistent-hash ring of node URLs"""
+
+    def __init__(self, nodes, vnodes=VIRTUAL_NODES):
+        self.nodes = list(dict.fromkeys(nodes))
+        points = sorted(
+            (_hash(f'{node}#{i}'), node)
+            for node in self.nodes
+            for i in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+        self._shard_owner = [self._lookup(f'shard-{shard}') for shard in range(SHARD_COUNT)]
+
+    def _lookup(self, key):
+        if not self._owners:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._owners)
+        return self._owners[index]
+
+    def owner_of_shard(self, shard):
+        return self._shard_owner[shard] if shard is not None else None
+
+    def owner_of_room(self, room_code):
+        return self.owner_of_shard(shard_of(room_code))
+
+    def node_for(self, key):
+        """Node for anything that is not a room (e.g. a logged-out visitor)"""
+        return self._lookup(key)
+
+    def shards_of(self, node):
+        return [shard for shard, owner in enumerate(self._shard_owner) if owner == node]
+
+
+def moved_shards(old_ring, new_ring):
+    """Format: {(old_node, new_node): [shard, ...]} for shards that change owner"""
+    moves = {}
+    for shard in range(SHARD_COUNT):
+        old, new = old_ring.owner_of_shard(shard), new_ring.owner_of_shard(shard)
+        if old != new:
+            moves.setdefault((old, new), []).append(shard)
+    return moves
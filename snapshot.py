@@ -0,0 +1,132 @@
+"""
+Snapshots of the live in-memory state.
+
+A snapshot file is a small fixed header followed by a zlib-compressed pickle:
+
+    magic (6 bytes) | format version (uint16) | crc32 of payload (uint32) | payload
+
+Files are written to a temporary name, fsynced and renamed over the old
+snapshot, so a crash mid-write never leaves a half-written file behind.
+Bump FORMAT_VERSION whenever the shape of the saved state changes; files with
+another version are ignored instead of being loaded into the wrong layout.
+"""
+
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'VWSNAP'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('>6sHI')
+CAPTURE_RETRIES = 5
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def encode(state):
+    payload = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, zlib.crc32(payload)) + payload
+
+
+def decode(data):
+    if len(data) < HEADER.size:
+        raise SnapshotError('Snapshot is truncated')
+    magic, version, crc = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError('Not a snapshot file')
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f'Snapshot format {version} is not supported (expected {FORMAT_VERSION})')
+    payload = memoryview(data)[HEADER.size:]
+    if zlib.crc32(payload) != crc:
+        raise SnapshotError('Snapshot checksum mismatch')
+    try:
+        return pickle.loads(zlib.decompress(payload))
+    except (zlib.error, pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, TypeError, ValueError) as e:
+        raise SnapshotError(f'Snapshot could not be decoded: {e}') from e
+
+
+def write_snapshot(path, state):
+    """Atomically replace the snapshot at path; returns the size in bytes"""
+    return _write_atomic(path, encode(state))
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass  # Directory fsync is not available on every platform
+    return len(data)
+
+
+def read_snapshot(path):
+    """Load a snapshot, or return None if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return decode(data)
+
+
+class SnapshotWriter:
+    """Writes a snapshot every ``interval`` seconds from a daemon thread.
+
+    ``capture`` returns the state to save. It runs while request threads keep
+    mutating that state, so a capture that trips over a dict or set changing
+    size is simply retried.
+    """
+
+    def __init__(self, path, capture, interval):
+        self.path = path
+        self.capture = capture
+        self.interval = interval
+        self.last_saved = None
+        self.last_size = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def save_now(self):
+        with self._lock:
+            for attempt in range(CAPTURE_RETRIES):
+                try:
+                    state = self.capture()
+                    data = encode(state)
+                    break
+                except RuntimeError:
+                    if attempt == CAPTURE_RETRIES - 1:
+                        raise
+                    time.sleep(0.01)
+            self.last_size = _write_atomic(self.path, data)
+            self.last_saved = time.time()
+            return self.last_size
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.save_now()
+            except Exception as e:
+                print(f'Snapshot failed: {e}')
@@ -0,0 +1,276 @@
+"""
+SQL micro-benchmarks for the statements app.py runs, with query-plan checks.
+
+Each scale fills a fresh database (schema from app.init_db) with that many
+users, proposals and votes, then times every statement below and checks its
+EXPLAIN QUERY PLAN against the plan it is expected to use. A statement that
+falls back to a full table scan, or starts sorting in a temp b-tree, fails
+the run.
+
+Usage:
+    python sql_benchmark.py                            # 10k rows per table
+    python sql_benchmark.py --scale 10k 100k 1m --output sql-bench.json
+    python sql_benchmark.py --scale 100k --compare sql-bench.json
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+VOTES_PER_PROPOSAL = 20
+MIN_RUNS = 5
+MAX_RUNS = 500
+TIME_BUDGET = 0.25  # Seconds per statement per scale
+CHUNK = 500  # Same IN-list size as the analytics endpoint
+
+# name: (where in app.py, SQL, parameters(ctx), expected plan lines as regexes)
+# Plan lines are matched after dropping SQLite's older "TABLE " wording.
+QUERIES = {
+    'login_by_name': (
+        'login', 'SELECT * FROM users WHERE name = ?',
+        lambda ctx: (ctx.user_name(),),
+        [r'SEARCH users USING INDEX sqlite_autoindex_users_1 \(name=\?\)'],
+    ),
+    'password_by_id': (
+        'vote, vote_on_submission, tiebreaker_vote', 'SELECT password FROM users WHERE id = ?',
+        lambda ctx: (ctx.user_id(),),
+        [r'SEARCH users USING INTEGER PRIMARY KEY \(rowid=\?\)'],
+    ),
+    'room_members_by_join_order': (
+        'get_users', 'SELECT id, name, position FROM users ORDER BY created_date',
+        lambda ctx: (),
+        [r'SCAN users USING INDEX idx_users_created_date'],
+    ),
+    'proposals_newest_first': (
+        'get_proposals', 'SELECT * FROM proposals ORDER BY created_date DESC',
+        lambda ctx: (),
+        [r'SCAN proposals USING INDEX idx_proposals_created_date'],
+    ),
+    'results_by_vote': (
+        'get_results', 'SELECT vote, COUNT(*) as count FROM votes WHERE proposal_id = ? GROUP BY vote',
+        lambda ctx: (ctx.proposal_id(),),
+        [r'SEARCH votes USING COVERING INDEX idx_votes_proposal_vote \(proposal_id=\?\)'],
+    ),
+    'count_users': (
+        'get_results', 'SELECT COUNT(*) FROM users',
+        lambda ctx: (),
+        [r'SCAN users USING COVERING INDEX \w+'],  # Counting every row is a scan by definition
+    ),
+    'count_votes_for_proposal': (
+        'get_results', 'SELECT COUNT(*) FROM votes WHERE proposal_id = ?',
+        lambda ctx: (ctx.proposal_id(),),
+        [r'SEARCH votes USING COVERING INDEX (idx_votes_proposal_vote|sqlite_autoindex_votes_1) \(proposal_id=\?\)'],
+    ),
+    'positions_for_room': (
+        'room_analytics', f'SELECT id, position FROM users WHERE id IN ({",".join("?" * CHUNK)})',
+        lambda ctx: ctx.user_ids(CHUNK),
+        [r'SEARCH users USING INTEGER PRIMARY KEY \(rowid=\?\)'],
+    ),
+    'ballots_for_room': (
+        'room_analytics',
+        'SELECT v.proposal_id, v.user_id, v.vote, p.title FROM votes v JOIN proposals p ON p.id = v.proposal_id '
+        f'WHERE v.user_id IN ({",".join("?" * CHUNK)})',
+        lambda ctx: ctx.user_ids(CHUNK),
+        [r'SEARCH v USING INDEX idx_votes_user \(user_id=\?\)', r'SEARCH p USING INTEGER PRIMARY KEY \(rowid=\?\)'],
+    ),
+}
+
+# Writes are timed one statement per transaction, like the handlers do
+WRITES = {
+    'register': (
+        'register', 'INSERT INTO users (name, password, position) VALUES (?, ?, ?)',
+        lambda ctx: (f'bench-{ctx.next()}', 'x' * 64, 'Delegate'),
+    ),
+    'create_proposal': (
+        'create_proposal', 'INSERT INTO proposals (title, description, proposed_by) VALUES (?, ?, ?)',
+        lambda ctx: ('Bench', 'Calls upon member states to cooperate.', 'bench'),
+    ),
+    'cast_vote': (
+        'vote', 'INSERT INTO votes (proposal_id, user_id, vote) VALUES (?, ?, ?)',
+        lambda ctx: (ctx.rows + ctx.next(), ctx.user_id(), 'yes'),
+    ),
+}
+
+
+class Context:
+    """Random parameters for one populated database"""
+
+    def __init__(self, rows, seed=1):
+        self.rows = rows
+        self.rng = random.Random(seed)
+        self.counter = 0
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+    def user_id(self):
+        return self.rng.randint(1, self.rows)
+
+    def user_name(self):
+        return f'delegate-{self.user_id()}'
+
+    def proposal_id(self):
+        return self.rng.randint(1, self.rows // VOTES_PER_PROPOSAL)
+
+    def user_ids(self, n):
+        return tuple(self.rng.sample(range(1, self.rows + 1), n))
+
+
+def create_schema(path):
+    """A database with exactly the tables and indexes app.init_db creates"""
+    os.environ['DATABASE'] = path
+    import app
+    app.DATABASE = path
+    app.init_db()
+
+
+def populate(path, rows, seed=1):
+    """``rows`` users, proposals and votes, with timestamps spread over a year"""
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA synchronous = OFF')
+    base = time.time() - 365 * 86400
+
+    def stamp():
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(base + rng.random() * 365 * 86400))
+
+    db.executemany(
+        'INSERT INTO users (id, name, password, position, created_date) VALUES (?, ?, ?, ?, ?)',
+        ((i, f'delegate-{i}', f'{i:064x}', f'Position {i % 193}', stamp()) for i in range(1, rows + 1))
+    )
+    db.executemany(
+        'INSERT INTO proposals (id, title, description, proposed_by, created_date) VALUES (?, ?, ?, ?, ?)',
+        ((i, f'Resolution {i}', 'Calls upon member states to cooperate. ' * 3, f'delegate-{i}', stamp())
+         for i in range(1, rows + 1))
+    )
+    # VOTES_PER_PROPOSAL distinct voters on each of the first rows / VOTES_PER_PROPOSAL proposals
+    db.executemany(
+        'INSERT INTO votes (proposal_id, user_id, vote, voted_date) VALUES (?, ?, ?, ?)',
+        ((i // VOTES_PER_PROPOSAL + 1, (i * 7919) % rows + 1, rng.choice(('yes', 'no', 'abstain')), stamp())
+         for i in range(rows))
+    )
+    db.commit()
+    db.execute('ANALYZE')
+    db.close()
+
+
+def query_plan(db, sql, params):
+    return [re.sub(r'\bTABLE ', '', row[3]) for row in db.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_plan(plan, expected):
+    """Problems with a plan: expected lines that are missing, and any bare scan or temp b-tree"""
+    problems = [f'expected {pattern!r}' for pattern in expected if not any(re.fullmatch(pattern, line) for line in plan)]
+    for line in plan:
+        if any(re.fullmatch(pattern, line) for pattern in expected):
+            continue
+        if re.fullmatch(r'SCAN \w+', line) or line.startswith('USE TEMP B-TREE'):
+            problems.append(f'unexpected {line!r}')
+    return problems
+
+
+def time_statement(db, sql, make_params, ctx, write=False):
+    timings = []
+    rows = 0
+    deadline = time.perf_counter() + TIME_BUDGET
+    while len(timings) < MIN_RUNS or (len(timings) < MAX_RUNS and time.perf_counter() < deadline):
+        params = make_params(ctx)
+        start = time.perf_counter()
+        cursor = db.execute(sql, params)
+        if write:
+            db.commit()
+        else:
+            rows = len(cursor.fetchall())
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'runs': len(timings),
+        'rows': rows,
+        'median_ms': round(statistics.median(timings) * 1000, 4),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1] * 1000, 4),
+        'min_ms': round(timings[0] * 1000, 4),
+    }
+
+
+def run_scale(label, rows, directory):
+    path = os.path.join(directory, f'bench-{label}.db')
+    start = time.perf_counter()
+    create_schema(path)
+    populate(path, rows)
+    print(f'{label}: {rows} users / proposals / votes, populated in {time.perf_counter() - start:.1f}s')
+
+    db = sqlite3.connect(path)
+    ctx = Context(rows)
+    results = {}
+    failures = []
+    for name, (where, sql, make_params, expected) in QUERIES.items():
+        plan = query_plan(db, sql, make_params(ctx))
+        problems = check_plan(plan, expected)
+        result = time_statement(db, sql, make_params, ctx)
+        result.update(where=where, plan=plan, plan_ok=not problems, plan_problems=problems)
+        results[name] = result
+        if problems:
+            failures.append((name, problems))
+        flag = 'ok' if not problems else 'PLAN'
+        print(f'  {name:<28} {result["median_ms"]:>10.3f} ms  p95 {result["p95_ms"]:>10.3f} ms  {result["rows"]:>8} rows  {flag}')
+    for name, (where, sql, make_params) in WRITES.items():
+        result = time_statement(db, sql, make_params, ctx, write=True)
+        result.update(where=where)
+        results[name] = result
+        print(f'  {name:<28} {result["median_ms"]:>10.3f} ms  p95 {result["p95_ms"]:>10.3f} ms  (commit)')
+    db.close()
+    os.remove(path)
+    return results, failures
+
+
+def compare(current, baseline):
+    """Print the median change for every statement both runs measured"""
+    print('compared with baseline (median):')
+    for scale, statements in current['scales'].items():
+        old = baseline.get('scales', {}).get(scale)
+        if not old:
+            continue
+        for name, result in statements.items():
+            if name in old and old[name]['median_ms']:
+                ratio = result['median_ms'] / old[name]['median_ms']
+                note = '  slower' if ratio > 1.5 else ''
+                print(f'  {scale:>5} {name:<28} {old[name]["median_ms"]:>10.3f} -> {result["median_ms"]:>10.3f} ms ({ratio:.2f}x){note}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the SQL app.py runs and check its query plans')
+    parser.add_argument('--scale', nargs='+', choices=SCALES, default=['10k'])
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='JSON from an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    report = {'sqlite_version': sqlite3.sqlite_version, 'started': time.time(), 'scales': {}}
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for label in args.scale:
+            results, scale_failures = run_scale(label, SCALES[label], directory)
+            report['scales'][label] = results
+            failures += [(label, name, problems) for name, problems in scale_failures]
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    for label, name, problems in failures:
+        print(f'✗ {label} {name}: {"; ".join(problems)}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
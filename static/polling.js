@@ -0,0 +1,75 @@
+// Polling helpers that follow the server's next_poll_ms hint.
+// The server slows polls down under load and answers 429 with Retry-After
+// when it is shedding them, so every poll schedules the next one itself
+// instead of firing on a fixed interval.
+
+function nextPollDelay(response, data, baseMs) {
+    if (response.status === 429) {
+        const retryAfter = parseFloat(response.headers.get('Retry-After'));
+        return isNaN(retryAfter) ? baseMs * 2 : retryAfter * 1000;
+    }
+    const hinted = parseInt(response.headers.get('X-Next-Poll-Ms'), 10);
+    if (!isNaN(hinted)) return hinted;
+    if (!response.ok) return baseMs * 2;  // Back off while the server is refusing or failing
+    if (data && typeof data.next_poll_ms === 'number') return data.next_poll_ms;
+    return baseMs;
+}
+
+// URL that fetches several GET endpoints in one request. The response is
+// {responses: {path: {status, body}}}, with the soonest poll hint of the batch.
+function batchUrl(paths) {
+    return '/api/batch?' + paths.map(path => 'path=' + encodeURIComponent(path)).join('&');
+}
+
+// Body of one batched response, or null if that part failed
+function batchBody(data, path) {
+    const part = data && data.responses && data.responses[path];
+    return part && part.status === 200 ? part.body : null;
+}
+
+// Poll url, calling onData with every successful (2xx) response body; errors only back off.
+// Returns a handle; call handle.stop() to end polling.
+function pollEvery(url, onData, baseMs) {
+    const handle = { stopped: false, timer: null };
+    handle.stop = () => {
+        handle.stopped = true;
+        clearTimeout(handle.timer);
+    };
+
+    async function tick() {
+        let delay = baseMs;
+        try {
+            const response = await fetch(url);
+            let data = null;
+            if (response.ok) {
+                data = await response.json();
+                if (!handle.stopped) onData(data, response);
+            } else if (response.status !== 429) {
+                console.error(`Error polling ${url}: HTTP ${response.status}`);
+            }
+            delay = nextPollDelay(response, data, baseMs);
+        } catch (error) {
+            console.error(`Error polling ${url}:`, error);
+            delay = baseMs * 2;
+        }
+        if (!handle.stopped) {
+            // Jitter keeps a room's clients from polling in lockstep
+            handle.timer = setTimeout(tick, delay * (0.8 + Math.random() * 0.4));
+        }
+    }
+
+    tick();
+    return handle;
+}
+
+// Poll url until isDone(data), then call onDone(data) once
+function pollUntil(url, onData, isDone, onDone, baseMs) {
+    const handle = pollEvery(url, data => {
+        onData(data);
+        if (isDone(data)) {
+            handle.stop();
+            onDone(data);
+        }
+    }, baseMs);
+    return handle;
+}
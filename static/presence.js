@@ -0,0 +1,31 @@
+// Heartbeats that keep this delegate counted in their room's totals.
+// The server stops counting a member who has sent nothing for a while, so a
+// closed laptop no longer holds the room up; any other request also counts.
+
+function startHeartbeat(intervalMs) {
+    let delay = intervalMs || 15000;
+    let timer = null;
+
+    async function beat() {
+        clearTimeout(timer);
+        try {
+            const response = await fetch('/api/heartbeat', { method: 'POST' });
+            if (response.ok) {
+                const data = await response.json();
+                if (typeof data.next_heartbeat_ms === 'number') delay = data.next_heartbeat_ms;
+            }
+        } catch (error) {
+            console.error('Heartbeat failed:', error);
+        }
+        timer = setTimeout(beat, delay);
+    }
+
+    // Background tabs throttle timers; report back as soon as the page is visible again
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'visible') beat();
+    });
+
+    beat();
+}
+
+startHeartbeat();
@@ -0,0 +1,44 @@
+// Proposal descriptions are content-addressed: list endpoints send a
+// body_hash and the text comes from /api/proposal-body/<hash>, which the
+// browser may cache forever. Each description is fetched at most once per page.
+
+const proposalBodies = new Map();  // hash -> Promise of the description
+
+function proposalBody(hash) {
+    if (!proposalBodies.has(hash)) {
+        const body = fetch(`/api/proposal-body/${hash}`)
+            .then(response => response.ok ? response.json() : Promise.reject(response.status))
+            .then(data => data.description);
+        body.catch(() => proposalBodies.delete(hash));  // Try again next time
+        proposalBodies.set(hash, body);
+    }
+    return proposalBodies.get(hash);
+}
+
+// Fill element with a proposal's description, unless it has moved on to
+// another proposal by the time the text arrives
+function showProposalBody(element, hash) {
+    element.dataset.bodyHash = hash;
+    element.textContent = 'Loading...';
+    proposalBody(hash)
+        .then(text => { if (element.dataset.bodyHash === hash) element.textContent = text; })
+        .catch(() => { if (element.dataset.bodyHash === hash) element.textContent = 'Description unavailable'; });
+}
+
+// Collapsed description for a results list; the text is fetched the first time it is opened
+function proposalBodyDetails(hash) {
+    return `<details class="proposal-body" data-body-hash="${hash}" style="font-size: 0.9em; color: #555; margin-bottom: 15px;">
+                <summary style="cursor: pointer;">Show description</summary>
+                <div class="proposal-body-text" style="margin-top: 8px;"></div>
+            </details>`;
+}
+
+// toggle does not bubble, so listen while capturing
+document.addEventListener('toggle', event => {
+    const details = event.target;
+    if (!details.open || !details.classList || !details.classList.contains('proposal-body')) return;
+    const text = details.querySelector('.proposal-body-text');
+    if (text.dataset.bodyHash !== details.dataset.bodyHash) {
+        showProposalBody(text, details.dataset.bodyHash);
+    }
+}, true);
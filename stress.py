@@ -0,0 +1,431 @@
+"""
+Concurrency stress test for the room and voting endpoints.
+
+Usage:
+    python stress.py                                   # Flask test client, thread pool
+    python stress.py --gunicorn [--processes]          # starts gunicorn on a throwaway database
+    python stress.py --url http://host:8000 --admin-token TOKEN [--processes]
+
+Every concurrency level runs the same workload: fresh rooms go through join,
+ready, proposal, voting, tiebreak and logout rounds. Each round's requests
+are shuffled together with room hopping (join/leave/logout of extra users),
+repeated ballots and status polls, then sent through a thread or process pool
+with that many workers. After every round the harness checks that:
+
+- each proposal's tally equals the distinct voters whose ballot was accepted,
+  and nobody's ballot was accepted twice
+- every status poll reported done <= total <= room size
+- GET /api/admin/invariants finds nothing: nobody is in two rooms, barrier
+  counts stay within the room, ballot counters match their bitsets
+
+It prints throughput and latency per level and exits with 1 on any violation.
+--processes only works against a server: the test client's state lives in
+this process.
+"""
+
+import argparse
+import functools
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'stress-pass'
+
+# Status polls and the (done, total) fields each one reports
+POLLS = {
+    '/api/ready-status': 'ready',
+    '/api/all-proposals-submitted': 'submitted',
+    '/api/check-all-voted': 'finished',
+    '/api/check-tiebreak-agreement': 'agreed',
+    '/api/check-arrived': 'arrived',
+    '/api/check-all-tiebreaker-complete': 'finished',
+}
+
+_app = None  # The Flask app when testing in-process
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None  # /logout answers with a redirect; its status is all we need
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def session_cookie(set_cookies):
+    """The session=... pair from Set-Cookie headers (None if absent or cleared)"""
+    for header in set_cookies:
+        pair = header.split(';', 1)[0].strip()
+        if pair.startswith('session='):
+            return pair if pair != 'session=' else None
+    return None
+
+
+def send(target, call):
+    """Make one (method, path, headers, body) call; returns (status, json, session cookie, seconds).
+
+    ``target`` is a base URL, or None for the in-process app. Connection
+    failures come back as status 0.
+    """
+    method, path, headers, body = call
+    started = time.perf_counter()
+    try:
+        if target is None:
+            response = _app.test_client(use_cookies=False).open(path, method=method, headers=headers, json=body)
+            status, data = response.status_code, response.get_json(silent=True)
+            cookie = session_cookie(response.headers.getlist('Set-Cookie'))
+        else:
+            headers = dict(headers)
+            data = None
+            if body is not None:
+                data = json.dumps(body).encode()
+                headers['Content-Type'] = 'application/json'
+            request = urllib.request.Request(target + path, data=data, headers=headers, method=method)
+            try:
+                response = _opener.open(request, timeout=30)
+            except urllib.error.HTTPError as e:
+                response = e
+            with response:
+                status, raw = response.status, response.read()
+                cookie = session_cookie(response.headers.get_all('Set-Cookie') or ())
+            try:
+                data = json.loads(raw) if raw else None
+            except ValueError:
+                data = None
+    except (OSError, urllib.error.URLError):
+        status, data, cookie = 0, None, None
+    return status, data, cookie, time.perf_counter() - started
+
+
+class Level:
+    """Requests, timings and violations for one concurrency level"""
+
+    def __init__(self, workers, pool, target, admin_token, max_room_size):
+        self.workers = workers
+        self.pool = pool
+        self.target = target
+        self.admin_token = admin_token
+        self.max_room_size = max_room_size
+        self.latencies = []
+        self.seconds = 0.0
+        self.errors = 0  # 5xx and failed connections
+        self.shed = 0  # 429s from admission control
+        self.violations = []
+
+    def run(self, tagged_calls, rng):
+        """Send (tag, call) pairs in random order; returns [(tag, status, json, cookie)]"""
+        tagged_calls = list(tagged_calls)
+        rng.shuffle(tagged_calls)
+        started = time.perf_counter()
+        results = list(self.pool.map(functools.partial(send, self.target), [call for _, call in tagged_calls]))
+        self.seconds += time.perf_counter() - started
+        out = []
+        for (tag, call), (status, data, cookie, seconds) in zip(tagged_calls, results):
+            self.latencies.append(seconds)
+            if status == 0 or status >= 500:
+                self.errors += 1
+                self.violate(f'{call[0]} {call[1]} failed with status {status}')
+            elif status == 429:
+                self.shed += 1
+            elif call[1] in POLLS and status == 200:
+                self.check_poll(call[1], data)
+            out.append((tag, status, data, cookie))
+        return out
+
+    def check_poll(self, path, data):
+        done, total = data.get(POLLS[path]), data.get('total')
+        if not 0 <= done <= total <= self.max_room_size:
+            self.violate(f'{path} reported {done}/{total} in rooms of at most {self.max_room_size}')
+
+    def check_server(self, after):
+        """Ask the server to check its own invariants"""
+        if not self.admin_token:
+            return
+        status, data, _, _ = send(self.target, ('GET', '/api/admin/invariants', {'X-Admin-Token': self.admin_token}, None))
+        if status != 200:
+            self.violate(f'invariant check after {after} returned {status}')
+        else:
+            for violation in data['violations']:
+                self.violate(f'after {after}: {violation}')
+
+    def violate(self, message):
+        self.violations.append(message)
+
+    def percentile(self, q):
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000 if ordered else 0.0
+
+
+def headers(user):
+    return {'Cookie': user['cookie']} if user.get('cookie') else {}
+
+
+def call(user, method, path, body=None):
+    return method, path, headers(user), body
+
+
+def poll_calls(users, rng, count):
+    """Status polls from random users, tagged 'poll'"""
+    return [('poll', call(rng.choice(users), 'GET', rng.choice(list(POLLS)))) for _ in range(count)]
+
+
+def check_tallies(level, label, accepted, tallies):
+    """Compare server tallies with the ballots the server accepted.
+
+    ``accepted`` maps (voter, proposal) to the choices accepted for it and
+    ``tallies`` maps proposal to the server's {'yes','no','abstain'} counts.
+    """
+    expected = {proposal: Counter() for proposal in tallies}
+    for (voter, proposal), choices in accepted.items():
+        if len(choices) > 1:
+            level.violate(f'{label}: user {voter} had {len(choices)} ballots accepted on {proposal}')
+        expected.setdefault(proposal, Counter())[choices[0]] += 1
+    for proposal, counts in expected.items():
+        got = tallies.get(proposal, {})
+        if any(got.get(choice, 0) != counts[choice] for choice in ('yes', 'no', 'abstain')):
+            level.violate(f'{label}: proposal {proposal} tallied {got} but accepted {dict(counts)}')
+
+
+def vote_calls(voters, proposal, choice_for, path, rng):
+    """One ballot per voter on ``proposal``, a third of them sent twice"""
+    calls = []
+    for voter in voters:
+        body = {'vote': choice_for(voter), 'password': PASSWORD}
+        for _ in range(2 if rng.random() < 0.33 else 1):
+            calls.append((('vote', voter['id'], proposal, body['vote']), call(voter, 'POST', f'{path}/{proposal}', body)))
+    return calls
+
+
+def collect_accepted(results):
+    accepted = {}
+    for tag, status, data, _ in results:
+        if tag[0] == 'vote' and status == 201:
+            accepted.setdefault((tag[1], tag[2]), []).append(tag[3])
+    return accepted
+
+
+def run_level(level, n_rooms, room_size, n_hoppers, rng, prefix):
+    """Take fresh rooms through a whole voting round at this level's concurrency"""
+    n_users = n_rooms * room_size + n_hoppers
+    users = [{'name': f'{prefix}-{i}'} for i in range(n_users)]
+    for tag, status, data, cookie in level.run(
+            [(u, ('POST', '/register', {}, {'name': u['name'], 'password': PASSWORD, 'position': 'Delegate'})) for u in users], rng):
+        if status != 201:
+            level.violate(f'register {tag["name"]} returned {status}')
+            return
+        tag['id'], tag['cookie'] = data['user_id'], cookie
+    rooms = [users[r * room_size:(r + 1) * room_size] for r in range(n_rooms)]
+    hoppers = users[n_rooms * room_size:]
+
+    # Rooms, then members joining while hoppers join, leave and log out of random rooms
+    codes = {}
+    for r, status, data, _ in level.run(
+            [(r, call(members[0], 'POST', '/api/room/create', {'room_name': f'{prefix} room {r}', 'passcode': 'pw'}))
+             for r, members in enumerate(rooms)], rng):
+        if status != 201:
+            level.violate(f'creating room {r} returned {status}')
+            return
+        codes[r] = data['room_code']
+    churn = [('join', call(u, 'POST', '/api/room/join', {'room_code': codes[r], 'passcode': 'pw'}))
+             for r, members in enumerate(rooms) for u in members[1:]]
+    for hopper in hoppers:
+        for _ in range(4):
+            action = rng.choice(('join', 'join', 'leave', 'logout'))
+            if action == 'join':
+                churn.append(('hop', call(hopper, 'POST', '/api/room/join', {'room_code': codes[rng.randrange(n_rooms)], 'passcode': 'pw'})))
+            elif action == 'leave':
+                churn.append(('hop', call(hopper, 'POST', '/api/room/leave')))
+            else:
+                churn.append(('hop', call(hopper, 'GET', '/logout')))
+    churn += [('ready', call(u, 'POST', f'/api/users/{u["id"]}/ready')) for members in rooms for u in members]
+    for tag, status, data, _ in level.run(churn + poll_calls(users, rng, len(churn) // 2), rng):
+        if tag == 'join' and status != 200:
+            level.violate(f'joining a room returned {status}')
+    level.check_server('joins')
+    level.run([('logout', call(h, 'GET', '/logout')) for h in hoppers], rng)
+    for r, status, data, _ in level.run([(r, call(u, 'GET', '/api/room/current')) for r, members in enumerate(rooms) for u in members], rng):
+        if status != 200 or data.get('room_code') != codes[r]:
+            level.violate(f'a member of room {codes[r]} is in {data and data.get("room_code")} ({status})')
+    level.check_server('hoppers left')
+
+    # Proposals, then every member votes on every other member's proposal.
+    # The first member's proposal gets alternating yes/no ballots, so with an
+    # odd room size every room ends voting with a tie.
+    members = [u for m in rooms for u in m]
+    level.run([('proposal', call(u, 'POST', '/api/proposal-submission', {'title': f'Proposal {u["id"]}', 'description': 'stress'}))
+               for u in members] + poll_calls(members, rng, len(members)), rng)
+    votes = []
+    for m in rooms:
+        for p, proposer in enumerate(m):
+            voters = [u for u in m if u is not proposer]
+            if p == 0:
+                choice_for = lambda voter, voters=voters: ('yes', 'no')[voters.index(voter) % 2]
+            else:
+                choice_for = lambda voter: rng.choice(('yes', 'no', 'abstain'))
+            votes += vote_calls(voters, proposer['id'], choice_for, '/api/vote-on-submission', rng)
+    accepted = collect_accepted(level.run(votes + poll_calls(members, rng, len(votes) // 4), rng))
+    tallies = {tag: data for tag, status, data, _ in level.run(
+        [(u['id'], call(u, 'GET', f'/api/submission-results/{u["id"]}')) for u in members], rng)}
+    check_tallies(level, 'voting', accepted, tallies)
+    level.check_server('voting')
+
+    # Everyone finishes, agrees and arrives: every room should reach tiebreak voting
+    for path in ('/api/mark-voting-complete', '/api/agree-to-tiebreak', '/api/arrived-tiebreaker'):
+        level.run([('step', call(u, 'POST', path)) for u in members] + poll_calls(members, rng, len(members)), rng)
+        level.check_server(path)
+    tied = {}
+    for r, status, data, _ in level.run([(r, call(m[0], 'GET', '/api/check-arrived')) for r, m in enumerate(rooms)], rng):
+        if status == 200 and data['phase'] != 'tiebreak_voting':
+            level.violate(f'room {codes[r]} is in phase {data["phase"]} instead of tiebreak_voting')
+    for r, status, data, _ in level.run([(r, call(m[0], 'GET', '/api/get-tied-proposals')) for r, m in enumerate(rooms)], rng):
+        tied[r] = [p['user_id'] for p in data['tied_proposals']] if status == 200 else []
+        if rooms[r][0]['id'] not in tied[r]:
+            level.violate(f'room {codes[r]} lost its tie on proposal {rooms[r][0]["id"]}')
+
+    # Tiebreak ballots race one member per room logging out
+    leaving = {r: rng.choice(m[1:]) for r, m in enumerate(rooms)}
+    votes = [('logout', call(leaving[r], 'GET', '/logout')) for r in range(n_rooms)]
+    for r, m in enumerate(rooms):
+        for proposal in tied[r]:
+            votes += vote_calls(m, proposal, lambda voter: rng.choice(('yes', 'no', 'abstain')), '/api/tiebreaker-vote', rng)
+    accepted = collect_accepted(level.run(votes + poll_calls(members, rng, len(votes) // 4), rng))
+    staying = [[u for u in m if u is not leaving[r]] for r, m in enumerate(rooms)]
+    leaving_ids = {u['id'] for u in leaving.values()}
+    tallies = {}
+    for r, status, data, _ in level.run([(r, call(m[0], 'GET', '/api/final-voting-results')) for r, m in enumerate(staying)], rng):
+        for result in data if status == 200 else ():
+            if result['user_id'] in tied[r]:
+                tallies[result['user_id']] = result
+    # Final results only list proposals of members still in the room
+    accepted = {key: choices for key, choices in accepted.items() if key[1] not in leaving_ids}
+    check_tallies(level, 'tiebreak', accepted, tallies)
+    level.check_server('tiebreak')
+
+    # The rest finish and log out while others are still polling
+    remaining = [u for m in staying for u in m]
+    level.run([('step', call(u, 'POST', '/api/mark-tiebreaker-complete')) for u in remaining], rng)
+    for r, status, data, _ in level.run([(r, call(m[0], 'GET', '/api/check-all-tiebreaker-complete')) for r, m in enumerate(staying)], rng):
+        if status == 200 and data['phase'] != 'final':
+            level.violate(f'room {codes[r]} ended in phase {data["phase"]} instead of final')
+    level.run([('logout', call(u, 'GET', '/logout')) for u in remaining] + poll_calls(remaining, rng, len(remaining)), rng)
+    level.check_server('logout')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def scratch_env(workdir, admin_token):
+    """Settings that keep the app under test away from the real database, ledger and snapshot"""
+    return {
+        'DATABASE': os.path.join(workdir, 'stress.db'),
+        'LEDGER_PATH': os.path.join(workdir, 'votes.ledger'),
+        'SNAPSHOT_ENABLED': '0',
+        'TEMPLATE_CACHE_DIR': os.path.join(workdir, 'template_cache'),
+        'JOB_EXPORT_DIR': os.path.join(workdir, 'exports'),
+        'REPLICA_DIR': os.path.join(workdir, 'replica'),
+        'ADMIN_TOKEN': admin_token,
+    }
+
+
+def start_in_process(admin_token):
+    global _app
+    os.environ.update(scratch_env(tempfile.mkdtemp(prefix='stress-'), admin_token))
+    sys.path.insert(0, HERE)
+    import app as voting_app
+    _app = voting_app.create_app()
+
+
+def start_gunicorn(admin_token, threads):
+    """gunicorn with gunicorn.conf.py on a free port; returns (process, base URL)"""
+    workdir = tempfile.mkdtemp(prefix='stress-')
+    port = free_port()
+    env = dict(os.environ, **scratch_env(workdir, admin_token), GUNICORN_THREADS=str(threads))
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'wb')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}'],
+        cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while send(url, ('GET', '/login', {}, None))[0] != 200:
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            sys.exit(f'gunicorn did not start; see {log.name}')
+        time.sleep(0.2)
+    return process, url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='base URL of a running server (default: the Flask test client)')
+    target.add_argument('--gunicorn', action='store_true', help='start gunicorn on a throwaway database')
+    parser.add_argument('--admin-token', default='', help='ADMIN_TOKEN of the --url server, for /api/admin/invariants')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 4, 16, 64], help='pool sizes to run')
+    parser.add_argument('--processes', action='store_true', help='use a process pool instead of threads')
+    parser.add_argument('--rooms', type=int, default=8)
+    parser.add_argument('--room-size', type=int, default=5, help='odd, so the forced tie holds')
+    parser.add_argument('--hoppers', type=int, default=8, help='extra users joining and leaving random rooms')
+    parser.add_argument('--threads', type=int, default=16, help='gunicorn threads with --gunicorn')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    if args.room_size < 3 or args.room_size % 2 == 0:
+        parser.error('--room-size must be odd and at least 3')
+    if args.processes and not (args.url or args.gunicorn):
+        parser.error('--processes needs --url or --gunicorn')
+
+    server = None
+    admin_token = args.admin_token
+    if args.url:
+        url = args.url.rstrip('/')
+    elif args.gunicorn:
+        admin_token = secrets.token_hex(16)
+        server, url = start_gunicorn(admin_token, args.threads)
+    else:
+        admin_token = secrets.token_hex(16)
+        start_in_process(admin_token)
+        url = None
+    if not admin_token:
+        print('No --admin-token: skipping the server-side invariant checks', file=sys.stderr)
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    run_id = secrets.token_hex(3)
+    print(f"target: {url or 'Flask test client'}, {'processes' if args.processes else 'threads'}, seed {seed}")
+    print(f"{'workers':>8} {'requests':>9} {'seconds':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'5xx':>5} {'429':>5} {'violations':>10}")
+    failed = False
+    try:
+        for workers in args.levels:
+            rng = random.Random(seed + workers)
+            pool = ProcessPoolExecutor(workers) if args.processes else ThreadPoolExecutor(workers)
+            with pool:
+                level = Level(workers, pool, url, admin_token, args.room_size + args.hoppers)
+                run_level(level, args.rooms, args.room_size, args.hoppers, rng, f'stress-{run_id}-{workers}')
+            requests = len(level.latencies)
+            print(f'{workers:>8} {requests:>9} {level.seconds:>8.2f} {requests / level.seconds if level.seconds else 0:>8.0f} '
+                  f'{level.percentile(0.5):>8.1f} {level.percentile(0.95):>8.1f} {level.percentile(0.99):>8.1f} '
+                  f'{level.errors:>5} {level.shed:>5} {len(level.violations):>10}')
+            for violation in level.violations[:20]:
+                print(f'    {violation}')
+            failed = failed or bool(level.violations)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
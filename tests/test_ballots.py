@@ -0,0 +1,90 @@
+import threading
+
+from ballots import BallotBox, VoterSlots
+
+
+def test_slots_are_dense_and_stable():
+    slots = VoterSlots()
+    assert [slots.assign(uid) for uid in (40, 7, 40, 13)] == [0, 1, 0, 2]
+    assert len(slots) == 3
+    assert slots.get(7) == 1
+    assert slots.get(99) is None
+    assert list(slots.user_ids) == [40, 7, 13]
+
+
+def test_cast_records_one_ballot_per_voter():
+    box = BallotBox(VoterSlots())
+    assert box.cast(1, 'yes')
+    assert box.cast(2, 'no')
+    assert box.cast(3, 'abstain')
+    assert not box.cast(1, 'no')
+    assert box.totals() == {'yes': 1, 'no': 1, 'abstain': 1}
+    assert box.choice_of(1) == 'yes'
+    assert box.choice_of(4) is None
+    assert box.has_voted(2) and not box.has_voted(4)
+    assert box.voter_count() == 3
+
+
+def test_boxes_share_the_room_slots():
+    slots = VoterSlots()
+    first, second = BallotBox(slots), BallotBox(slots)
+    first.cast(5, 'yes')
+    second.cast(6, 'no')
+    second.cast(5, 'no')
+    assert slots.get(5) == 0 and slots.get(6) == 1
+    assert first.choice_of(5) == 'yes' and second.choice_of(5) == 'no'
+
+
+def test_withdraw_clears_the_ballot():
+    box = BallotBox(VoterSlots())
+    box.cast(1, 'yes')
+    box.cast(2, 'no')
+    assert box.withdraw(1)
+    assert not box.withdraw(1)
+    assert not box.withdraw(3)
+    assert box.totals() == {'yes': 0, 'no': 1, 'abstain': 0}
+    assert not box.has_voted(1)
+    assert box.choice_of(1) is None
+    assert box.cast(1, 'abstain')
+    assert box.audit() == ({'yes': 0, 'no': 1, 'abstain': 1}, {'yes': 0, 'no': 1, 'abstain': 1}, 2)
+
+
+def test_audit_recounts_the_bitsets():
+    box = BallotBox(VoterSlots())
+    for uid in range(20):
+        box.cast(uid, ('yes', 'no', 'abstain')[uid % 3])
+    counters, recount, voters = box.audit()
+    assert counters == recount == {'yes': 7, 'no': 7, 'abstain': 6}
+    assert voters == 20
+
+
+def test_audit_flags_a_vote_without_a_choice():
+    box = BallotBox(VoterSlots())
+    box.cast(1, 'yes')
+    box.cast(2, 'no')
+    box.choices[0] &= ~(3 << 2)  # Slot 1 keeps its voted bit but loses its choice
+    _counters, recount, voters = box.audit()
+    assert recount is None
+    assert voters == 2
+
+
+def test_concurrent_casts_count_once():
+    slots = VoterSlots()
+    box = BallotBox(slots)
+    accepted = []
+
+    def vote(uid):
+        for _ in range(3):
+            if box.cast(uid, 'yes'):
+                accepted.append(uid)
+
+    threads = [threading.Thread(target=vote, args=(uid,)) for uid in range(64)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(accepted) == list(range(64))
+    assert box.totals()['yes'] == 64
+    assert len(slots) == 64
+    counters, recount, voters = box.audit()
+    assert counters == recount and voters == 64
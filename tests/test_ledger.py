@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+import ledger
+
+
+def fill(path, entries):
+    vote_ledger = ledger.VoteLedger(path)
+    for i in range(entries):
+        vote_ledger.append({'kind': 'regular', 'proposal': i % 4, 'voter': i % 5, 'vote': 'yes'})
+    root = vote_ledger.tree.root()
+    vote_ledger.close()
+    return root
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'votes.ledger')
+
+
+def test_verify_matches_the_live_tree(path):
+    root = fill(path, 37)
+    size, head, verified_root, tail = ledger.verify_file(path, root.hex())
+    assert (size, verified_root, tail) == (37, root, 0)
+    reopened = ledger.VoteLedger(path)
+    assert len(reopened) == 37
+    assert reopened.head == head
+    assert reopened.tree.root() == root
+    reopened.close()
+
+
+def test_verify_rejects_another_root(path):
+    fill(path, 3)
+    with pytest.raises(ledger.LedgerError, match='does not match'):
+        ledger.verify_file(path, '00' * 32)
+
+
+def test_partial_tail_is_skipped_then_truncated(path):
+    root = fill(path, 10)
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(ledger.LENGTH.pack(40) + b'{"voter"')
+    assert ledger.verify_file(path)[2:] == (root, 12)
+
+    vote_ledger = ledger.VoteLedger(path)
+    assert os.path.getsize(path) == size
+    index, _leaf = vote_ledger.append({'voter': 9})
+    vote_ledger.close()
+    assert index == 10
+    assert ledger.verify_file(path)[0::3] == (11, 0)
+
+
+def test_a_changed_payload_breaks_the_chain(path):
+    fill(path, 5)
+    with open(path, 'r+b') as f:
+        f.seek(len(ledger.HEADER) + ledger.LENGTH.size + 2)
+        f.write(b'X')
+    with pytest.raises(ledger.LedgerError, match='chain broken at entry 0'):
+        ledger.verify_file(path)
+    with pytest.raises(ledger.LedgerError):
+        ledger.VoteLedger(path)
+
+
+def test_empty_and_header_only_files(path):
+    open(path, 'wb').close()
+    with pytest.raises(ledger.LedgerError, match='not a vote ledger'):
+        ledger.verify_file(path)
+    with open(path, 'wb') as f:
+        f.write(ledger.HEADER)
+    with pytest.raises(ledger.LedgerError, match='no complete entries'):
+        ledger.verify_file(path)
+    assert ledger.main(['verify', path]) == 1
+
+
+@pytest.mark.skipif(ledger.fcntl is None, reason='no advisory locks on this platform')
+def test_one_writer_per_file(path):
+    first = ledger.VoteLedger(path)
+    with pytest.raises(ledger.LedgerError, match='another process'):
+        ledger.VoteLedger(path)
+    first.close()
+    ledger.VoteLedger(path).close()
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8, 13, 16, 17])
+def test_every_inclusion_proof_checks_out(size):
+    tree = ledger.MerkleTree()
+    frontier = ledger.MerkleFrontier()
+    leaves = [ledger.leaf_hash(b'ballot %d' % i) for i in range(size)]
+    for leaf in leaves:
+        tree.add(leaf)
+        frontier.add(leaf)
+    root = tree.root()
+    assert frontier.root() == root
+    for index, leaf in enumerate(leaves):
+        proof = tree.proof(index)
+        assert ledger.verify_inclusion(leaf, index, size, proof, root)
+        assert not ledger.verify_inclusion(ledger.leaf_hash(b'forged'), index, size, proof, root)
+        if size > 1:
+            assert not ledger.verify_inclusion(leaf, (index + 1) % size, size, proof, root)
+
+
+def test_proofs_against_an_earlier_tree_size():
+    tree = ledger.MerkleTree()
+    leaves = [ledger.leaf_hash(b'%d' % i) for i in range(9)]
+    for leaf in leaves:
+        tree.add(leaf)
+    root = tree.root(6)
+    assert ledger.verify_inclusion(leaves[4], 4, 6, tree.proof(4, 6), root)
+    with pytest.raises(IndexError):
+        tree.proof(6, 6)
+
+
+def test_receipts_match_the_live_ledger(path):
+    vote_ledger = ledger.VoteLedger(path)
+    for i in range(12):
+        vote_ledger.append({'voter': i % 3, 'vote': 'no'})
+    vote_ledger.sync()
+    live = [vote_ledger.receipt(index) for index in vote_ledger.by_voter[2]]
+    vote_ledger.close()
+
+    receipts = ledger.voter_receipts(path, 2)
+    assert [r['index'] for r in receipts] == [2, 5, 8, 11]
+    for receipt, expected in zip(receipts, live):
+        assert {k: receipt[k] for k in expected} == expected
+        assert receipt['entry'] == {'voter': 2, 'vote': 'no'}
@@ -0,0 +1,69 @@
+from presence import PresenceTracker, TimingWheel
+
+NOW = 1_000_000.0
+
+
+def test_keys_expire_on_their_tick():
+    wheel = TimingWheel(size=8, now=NOW)
+    wheel.schedule('a', 3)
+    wheel.schedule('b', 5)
+    assert wheel.advance(NOW + 2) == []
+    assert wheel.advance(NOW + 3) == ['a']
+    assert wheel.advance(NOW + 5) == ['b']
+    assert len(wheel) == 0
+
+
+def test_rescheduling_pushes_the_deadline_back():
+    wheel = TimingWheel(size=8, now=NOW)
+    wheel.schedule('a', 3)
+    wheel.advance(NOW + 2)
+    wheel.schedule('a', 3)
+    assert wheel.advance(NOW + 3) == []
+    assert wheel.advance(NOW + 5) == ['a']
+
+
+def test_cancel():
+    wheel = TimingWheel(size=8, now=NOW)
+    wheel.schedule('a', 1)
+    wheel.cancel('a')
+    wheel.cancel('missing')
+    assert 'a' not in wheel
+    assert wheel.advance(NOW + 4) == []
+
+
+def test_deadlines_beyond_one_lap_wait_their_turn():
+    wheel = TimingWheel(size=8, now=NOW)
+    wheel.schedule('far', 20)
+    assert wheel.advance(NOW + 12) == []
+    assert wheel.advance(NOW + 19) == []
+    assert wheel.advance(NOW + 20) == ['far']
+
+
+def test_a_long_gap_expires_everything_due():
+    wheel = TimingWheel(size=8, now=NOW)
+    for i in range(1, 8):
+        wheel.schedule(i, i)
+    wheel.schedule('later', 40)
+    assert sorted(wheel.advance(NOW + 30)) == list(range(1, 8))
+    assert 'later' in wheel
+
+
+def test_tracker_hands_silent_users_to_on_expire():
+    expired = []
+    tracker = PresenceTracker(10, expired.extend)
+    assert tracker.touch(1)
+    assert not tracker.touch(1)
+    tracker.touch_all([2, 3])
+    tracker.forget(3)
+    assert tracker.expire(tracker.wheel.current + 5) == []
+    assert sorted(tracker.expire(tracker.wheel.current + 11)) == [1, 2]
+    assert sorted(expired) == [1, 2]
+    assert tracker.expired_total == 2
+    assert len(tracker) == 0
+    assert tracker.touch(1)  # Back again after expiring
+
+
+def test_zero_timeout_never_starts_the_sweep():
+    tracker = PresenceTracker(0)
+    tracker.start()
+    assert tracker._thread is None
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import ranked_choice
+from ballots import VoterSlots
+
+
+def ballots(*groups):
+    """Rankings array from (count, [candidate, ...]) groups"""
+    width = max(len(ranking) for _count, ranking in groups)
+    rows = []
+    for count, ranking in groups:
+        rows += [ranking + [ranked_choice.EMPTY] * (width - len(ranking))] * count
+    return np.array(rows, dtype=np.int8)
+
+
+def test_irv_majority_in_the_first_round():
+    result = ranked_choice.count(ballots((6, [0, 1]), (4, [1, 0])), 2, names=['A', 'B'])
+    assert result['method'] == 'irv'
+    assert result['elected'] == ['A']
+    assert len(result['rounds']) == 1
+
+
+def test_irv_transfers_the_loser():
+    # C is eliminated and its ballots go to B, which then beats A
+    rankings = ballots((8, [0]), (5, [1]), (4, [2, 1]))
+    result = ranked_choice.count(rankings, 3, names=['A', 'B', 'C'])
+    assert result['eliminated'] == ['C']
+    assert result['elected'] == ['B']
+    assert result['rounds'][1]['tallies'] == {'A': 8, 'B': 9}
+    assert result['rounds'][0]['transfers'] == {'B': 4}
+
+
+def test_exhausted_ballots_leave_the_count():
+    rankings = ballots((4, [0]), (3, [1]), (2, [2]))
+    result = ranked_choice.count(rankings, 3, names=['A', 'B', 'C'])
+    assert result['rounds'][1]['exhausted'] == 2
+    assert result['elected'] == ['A']  # 4 of the 7 ballots still in play
+
+
+def test_irv_agrees_with_the_reference_count():
+    rng = np.random.default_rng(7)
+    for n_candidates in (3, 5, 8):
+        rankings = np.full((400, n_candidates), ranked_choice.EMPTY, dtype=np.int8)
+        for row in rankings:
+            depth = rng.integers(1, n_candidates + 1)
+            row[:depth] = rng.permutation(n_candidates)[:depth]
+        result = ranked_choice.count(rankings, n_candidates)
+        reference = ranked_choice.count_python(rankings, n_candidates)
+        assert [int(c) for c in result['elected']] == reference['elected']
+        assert [int(c) for c in result['eliminated']] == reference['eliminated']
+
+
+def test_stv_elects_on_the_droop_quota_and_moves_the_surplus():
+    # 20 ballots, 2 seats: quota 7. A's surplus of 5 splits between B and C
+    rankings = ballots((12, [0, 1]), (4, [2]), (4, [3]))
+    result = ranked_choice.count(rankings, 4, seats=2, names=['A', 'B', 'C', 'D'])
+    assert result['method'] == 'stv'
+    assert result['quota'] == 7
+    assert result['elected'][0] == 'A'
+    assert result['rounds'][0]['transfers'] == {'B': 5}
+    assert result['elected'] == ['A', 'B']
+
+
+def test_election_casts_once_per_voter_until_closed():
+    election = ranked_choice.RankedElection('Chair', ['A', 'B', 'C'], 1, VoterSlots())
+    assert election.cast(1, [0, 1]) == ranked_choice.CAST
+    assert election.cast(1, [2]) == ranked_choice.ALREADY_VOTED
+    assert election.cast(2, [1]) == ranked_choice.CAST
+    assert election.ranking_of(1) == ['A', 'B']
+    assert election.ballot_count == 2
+    final = election.close()
+    assert election.cast(3, [0]) == ranked_choice.CLOSED
+    assert final['ballots'] == 2
+    assert election.result() is final
+
+
+def test_parse_ranking_rejects_bad_input():
+    candidates = ['A', 'B', 'C']
+    assert ranked_choice.parse_ranking(['C', 0], candidates) == [2, 0]
+    for ranking in ([], 'A', ['D'], [3], [True], ['A', 0]):
+        with pytest.raises(ranked_choice.RankedError):
+            ranked_choice.parse_ranking(ranking, candidates)
+
+
+def test_election_needs_sensible_candidates_and_seats():
+    with pytest.raises(ranked_choice.RankedError):
+        ranked_choice.RankedElection('x', ['A'], 1, VoterSlots())
+    with pytest.raises(ranked_choice.RankedError):
+        ranked_choice.RankedElection('x', ['A', 'A'], 1, VoterSlots())
+    with pytest.raises(ranked_choice.RankedError):
+        ranked_choice.RankedElection('x', ['A', 'B'], 2, VoterSlots())
@@ -0,0 +1,57 @@
+import random
+
+from rotation import ProposerRotation
+
+
+def members(n):
+    rotation = ProposerRotation()
+    for uid in range(1, n + 1):
+        rotation.add(uid, f'User {uid}')
+    return rotation
+
+
+def test_everyone_proposes_once_per_cycle():
+    random.seed(3)
+    rotation = members(5)
+    first = [rotation.pick() for _ in range(5)]
+    assert sorted(first) == [1, 2, 3, 4, 5]
+    assert rotation.remaining() == 0
+    second = [rotation.pick() for _ in range(5)]
+    assert sorted(second) == [1, 2, 3, 4, 5]
+    assert rotation.cycle == 2
+
+
+def test_joins_and_leaves_mid_cycle():
+    random.seed(5)
+    rotation = members(4)
+    picked = {rotation.pick(), rotation.pick()}
+    rotation.remove(next(iter(picked)))
+    rotation.remove(next(uid for uid in range(1, 5) if uid not in picked))
+    rotation.add(9, 'Late')
+    rest = {rotation.pick() for _ in range(rotation.remaining())}
+    assert 9 in rest
+    assert not rest & picked
+    assert len(rotation) == 3
+
+
+def test_weights_stay_fair_within_a_cycle():
+    random.seed(11)
+    rotation = members(4)
+    rotation.set_weights({1: 10, 2: 0.01, 99: 5})
+    assert rotation.weights == {1: 10.0, 2: 0.1}
+    for _ in range(3):
+        assert sorted(rotation.pick() for _ in range(4)) == [1, 2, 3, 4]
+
+
+def test_take_unsaved_hands_over_each_pick_once():
+    rotation = members(2)
+    rotation.pick()
+    rotation.pick()
+    rows = rotation.take_unsaved('AB1234')
+    assert [(room, cycle) for room, _uid, cycle, _at in rows] == [('AB1234', 1), ('AB1234', 1)]
+    assert rotation.take_unsaved('AB1234') == []
+    assert len(rotation.history) == 2
+
+
+def test_empty_room_picks_nobody():
+    assert ProposerRotation().pick() is None
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import snapshot
+import tiebreak
+from ballots import BallotBox, VoterSlots
+from rotation import ProposerRotation
+
+
+def room_state():
+    slots = VoterSlots()
+    box = BallotBox(slots)
+    box.cast(1, 'yes')
+    box.cast(2, 'no')
+    rotation = ProposerRotation()
+    rotation.add(1, 'Ann')
+    rotation.add(2, 'Ben')
+    phase = tiebreak.RoomPhase(slots)
+    phase.finished_voting.add(1)
+    return {
+        'voting_rooms': {'AB1234': {'name': 'Room', 'users': {1, 2}, 'slots': slots, 'rotation': rotation, 'phase': phase}},
+        'submission_votes': {1: box},
+        'logged_in_users': {1, 2},
+    }
+
+
+def test_round_trip_keeps_shared_slots(tmp_path):
+    path = str(tmp_path / 'state.snapshot')
+    size = snapshot.write_snapshot(path, room_state())
+    assert size == os.path.getsize(path)
+    assert not os.path.exists(path + '.tmp')
+
+    state = snapshot.read_snapshot(path)
+    room = state['voting_rooms']['AB1234']
+    box = state['submission_votes'][1]
+    assert box.totals() == {'yes': 1, 'no': 1, 'abstain': 0}
+    assert box.slots is room['slots'] is room['phase'].slots
+    assert room['phase'].finished_voting == {1}
+    assert 2 in room['rotation']
+    assert state['logged_in_users'] == {1, 2}
+
+
+def test_missing_file_is_no_snapshot(tmp_path):
+    assert snapshot.read_snapshot(str(tmp_path / 'none.snapshot')) is None
+
+
+def test_other_format_versions_are_rejected():
+    data = bytearray(snapshot.encode({'a': 1}))
+    magic, _version, crc = snapshot.HEADER.unpack_from(data)
+    snapshot.HEADER.pack_into(data, 0, magic, snapshot.FORMAT_VERSION + 1, crc)
+    with pytest.raises(snapshot.SnapshotError, match='not supported'):
+        snapshot.decode(bytes(data))
+
+
+@pytest.mark.parametrize('damage, message', [
+    (lambda data: data[:5], 'truncated'),
+    (lambda data: b'NOTSNP' + data[6:], 'Not a snapshot'),
+    (lambda data: data[:-1] + bytes([data[-1] ^ 1]), 'checksum'),
+])
+def test_damaged_files_are_rejected(damage, message):
+    data = snapshot.encode({'a': 1})
+    with pytest.raises(snapshot.SnapshotError, match=message):
+        snapshot.decode(damage(data))
+
+
+def test_a_payload_that_is_not_zlib_is_rejected():
+    payload = b'not compressed'
+    data = snapshot.HEADER.pack(snapshot.MAGIC, snapshot.FORMAT_VERSION, snapshot.zlib.crc32(payload)) + payload
+    with pytest.raises(snapshot.SnapshotError, match='could not be decoded'):
+        snapshot.decode(data)
+
+
+def test_writer_retries_a_capture_that_raced(tmp_path):
+    attempts = []
+
+    def capture():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError('dictionary changed size during iteration')
+        return {'ok': True}
+
+    writer = snapshot.SnapshotWriter(str(tmp_path / 'state.snapshot'), capture, interval=0)
+    assert writer.save_now() == writer.last_size
+    assert len(attempts) == 3
+    assert snapshot.read_snapshot(writer.path) == {'ok': True}
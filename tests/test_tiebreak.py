@@ -0,0 +1,80 @@
+import pytest
+
+import tiebreak
+from ballots import VoterSlots
+
+MEMBERS = {1, 2, 3}
+
+
+@pytest.fixture
+def phase():
+    return tiebreak.RoomPhase(VoterSlots())
+
+
+def test_voting_waits_for_every_active_member(phase):
+    phase.finished_voting |= {1, 2}
+    assert phase.advance(MEMBERS, lambda: []) == tiebreak.VOTING
+    assert phase.progress(MEMBERS) == (2, 3)
+
+
+def test_voting_without_ties_is_final(phase):
+    phase.finished_voting |= MEMBERS
+    assert phase.advance(MEMBERS, lambda: []) == tiebreak.FINAL
+    assert phase.tied == []
+
+
+def test_a_tie_runs_through_every_phase(phase):
+    calls = []
+
+    def find_ties():
+        calls.append(1)
+        return [2]
+
+    phase.finished_voting |= MEMBERS
+    assert phase.advance(MEMBERS, find_ties) == tiebreak.TIE_DETECTED
+    assert phase.tied == [2]
+
+    phase.agreed.add(1)
+    assert phase.advance(MEMBERS, find_ties) == tiebreak.AGREEMENT
+    phase.agreed |= MEMBERS
+    assert phase.advance(MEMBERS, find_ties) == tiebreak.ARRIVAL
+
+    phase.arrived |= {1, 2}
+    assert phase.advance(MEMBERS, find_ties) == tiebreak.ARRIVAL
+    phase.arrived.add(3)
+    assert phase.advance(MEMBERS, find_ties) == tiebreak.TIEBREAK_VOTING
+    assert list(phase.tiebreaker_votes) == [2]
+    assert phase.tiebreaker_votes[2].slots is phase.slots
+
+    phase.finished_tiebreak |= MEMBERS
+    assert phase.advance(MEMBERS, find_ties) == tiebreak.FINAL
+    assert calls == [1]  # Ties are only looked for when voting closes
+    assert phase.is_past(tiebreak.ARRIVAL)
+
+
+def test_a_rejection_skips_the_tiebreak(phase):
+    phase.finished_voting |= MEMBERS
+    phase.advance(MEMBERS, lambda: [1])
+    phase.rejected = True
+    assert phase.advance(MEMBERS, lambda: [1]) == tiebreak.FINAL
+
+
+def test_an_empty_room_never_advances(phase):
+    assert phase.advance(set(), lambda: []) == tiebreak.VOTING
+
+
+def test_inactive_members_do_not_hold_up_a_phase(phase):
+    phase.finished_voting |= {1, 2}
+    assert phase.advance({1, 2}, lambda: []) == tiebreak.FINAL
+
+
+def test_discard_member_and_reset(phase):
+    for done in (phase.finished_voting, phase.agreed, phase.arrived, phase.finished_tiebreak):
+        done |= {1, 2}
+    phase.discard_member(1)
+    assert phase.finished_voting == phase.agreed == phase.arrived == phase.finished_tiebreak == {2}
+    phase.finished_voting |= MEMBERS
+    phase.advance(MEMBERS, lambda: [])
+    phase.reset()
+    assert phase.phase == tiebreak.VOTING
+    assert not phase.finished_voting and not phase.tied and not phase.tiebreaker_votes
@@ -0,0 +1,108 @@
+"""
+Per-room voting phase machine.
+
+Each room moves through voting -> tie_detected -> agreement -> arrival ->
+tiebreak_voting -> final. Clients only report events (finished voting,
+agreed, arrived, finished tie breaking); the server applies a transition as
+soon as its condition holds, so nobody has to call a "reset" endpoint and the
+status endpoints are plain reads of in-memory state.
+"""
+
+import time
+
+from ballots import BallotBox
+
+VOTING = 'voting'
+TIE_DETECTED = 'tie_detected'
+AGREEMENT = 'agreement'
+ARRIVAL = 'arrival'
+TIEBREAK_VOTING = 'tiebreak_voting'
+FINAL = 'final'
+
+PHASES = (VOTING, TIE_DETECTED, AGREEMENT, ARRIVAL, TIEBREAK_VOTING, FINAL)
+_PHASE_INDEX = {phase: i for i, phase in enumerate(PHASES)}
+
+
+class RoomPhase:
+    """Voting and tiebreak state for one room.
+
+    ``slots`` is the room's VoterSlots, shared by the tiebreak ballot boxes.
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.reset()
+
+    def reset(self):
+        """Start a fresh round"""
+        self.phase = VOTING
+        self.changed_at = time.time()
+        self.finished_voting = set()  # Users who finished regular voting
+        self.tied = []  # Proposer ids tied when voting closed
+        self.agreed = set()  # Users who agreed to break the tie
+        self.rejected = False  # Someone declined: skip the tiebreak for everyone
+        self.arrived = set()  # Users who loaded the tiebreaker page
+        self.tiebreaker_votes = {}  # Format: {proposer_user_id: BallotBox}
+        self.finished_tiebreak = set()  # Users who finished tie breaking
+
+    def is_past(self, phase):
+        """True once the room has moved beyond the given phase"""
+        return _PHASE_INDEX[self.phase] > _PHASE_INDEX[phase]
+
+    def progress(self, active_users):
+        """(done, total) among the active users for the step the room is waiting on"""
+        done = {
+            VOTING: self.finished_voting,
+            TIE_DETECTED: self.agreed,
+            AGREEMENT: self.agreed,
+            ARRIVAL: self.arrived,
+            TIEBREAK_VOTING: self.finished_tiebreak,
+        }.get(self.phase)
+        if done is None:
+            return len(active_users), len(active_users)
+        return len(active_users & done), len(active_users)
+
+    def discard_member(self, user_id):
+        """Forget a user who left the room or logged out"""
+        self.finished_voting.discard(user_id)
+        self.agreed.discard(user_id)
+        self.arrived.discard(user_id)
+        self.finished_tiebreak.discard(user_id)
+
+    def advance(self, active_users, find_ties):
+        """Apply every transition whose condition holds for the active users.
+
+        ``find_ties`` is called once, when voting closes, and returns the
+        proposer ids that ended in a tie.
+        """
+        while True:
+            next_phase = self._next_phase(active_users, find_ties)
+            if next_phase is None:
+                return self.phase
+            self.phase = next_phase
+            self.changed_at = time.time()
+
+    def _next_phase(self, active_users, find_ties):
+        def everyone(done):
+            return bool(active_users) and active_users <= done
+
+        if self.phase == VOTING:
+            if everyone(self.finished_voting):
+                self.tied = list(find_ties())
+                return TIE_DETECTED if self.tied else FINAL
+        elif self.phase in (TIE_DETECTED, AGREEMENT):
+            if self.rejected:
+                return FINAL
+            if self.phase == TIE_DETECTED and self.agreed:
+                return AGREEMENT
+            if self.phase == AGREEMENT and everyone(self.agreed):
+                return ARRIVAL
+        elif self.phase == ARRIVAL:
+            if everyone(self.arrived):
+                self.tiebreaker_votes = {proposer_id: BallotBox(self.slots) for proposer_id in self.tied}
+                self.finished_tiebreak.clear()
+                return TIEBREAK_VOTING
+        elif self.phase == TIEBREAK_VOTING:
+            if everyone(self.finished_tiebreak):
+                return FINAL
+        return None
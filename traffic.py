@@ -0,0 +1,519 @@
+"""
+Record real sessions and replay them against the app.
+
+Set TRAFFIC_RECORD=traffic.jsonl and app.py wraps itself in TrafficRecorder,
+which appends one JSON line per request: when it arrived, an anonymous
+session id (a random cookie the recorder sets), method, path, the JSON body
+with every string replaced by a keyed pseudonym (equal inputs get equal
+pseudonyms, so a login still matches its registration), the status, the
+latency and the shape of the JSON response. The pseudonym key is random per process and never written out,
+so run a single recording process, or give each worker its own file with
+{pid} in the path and one key via TRAFFIC_RECORD_KEY (hex) so pseudonyms
+agree across them; replay merges the files.
+
+Replay the trace in-process or against a running server:
+
+    python traffic.py replay traffic.jsonl                    # in-process, as fast as possible
+    python traffic.py replay traffic.jsonl --speed 10         # 10x the recorded pace
+    python traffic.py replay traffic.jsonl --url http://127.0.0.1:8000 --speed 1
+    python traffic.py replay traffic-*.jsonl                  # several workers' files
+
+At full speed requests are sent one at a time in recorded order; at a fixed
+speed every session replays on its own thread at the recorded pace, and a
+request waits for every request that had already finished when it was
+recorded (so a join never overtakes the create it depends on). Room
+codes, user ids and proposal ids differ between runs, so the replayer maps
+them from the responses that created them. Strings in request bodies are
+pseudonymized again with a key per replay, so a trace can be replayed
+repeatedly against the same database without its users colliding. The report gives latency
+percentiles per route next to the recorded ones, and lists responses whose
+status or JSON shape differ from the recording.
+"""
+
+import argparse
+import hashlib
+import hmac
+import http.client
+import importlib
+import io
+import json
+import os
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+from werkzeug.http import dump_cookie, parse_cookie
+
+TRACE_COOKIE = 'vw_trace'
+TRACE_VERSION = 1
+VERBATIM_KEYS = {'vote', 'room_code'}  # Body fields replayed as recorded (or remapped), not pseudonymized
+MIN_PSEUDONYM = 12
+FLUSH_EVERY = 64
+MAX_DIFFERENCES = 20
+
+# Responses that introduce ids the rest of a session refers to
+ID_SOURCES = {
+    ('POST', '/login'): {'user_id': 'user'},
+    ('POST', '/register'): {'user_id': 'user'},
+    ('POST', '/api/room/create'): {'room_code': 'room'},
+    ('POST', '/api/room/join'): {'room_code': 'room'},
+    ('POST', '/api/proposals'): {'id': 'proposal'},
+}
+# Path segments holding those ids: (pattern, kind); group 2 is the id
+PATH_IDS = [
+    (re.compile(r'^(/api/users/)(\d+)(/ready)$'), 'user'),
+    (re.compile(r'^(/api/(?:vote-on-submission|submission-results|tiebreaker-vote)/)(\d+)()$'), 'user'),
+    (re.compile(r'^(/api/proposals/)(\d+)(/\w+)$'), 'proposal'),
+    (re.compile(r'^(/api/room/(?:info/)?)([A-Za-z0-9]{6})((?:/\w+)?)$'), 'room'),
+    (re.compile(r'^(/api/ledger/proof/)(\d+)()$'), 'index'),
+]
+ROOM_WORDS = {'create'}  # /api/room/<six letters> that is a route, not a room code
+
+
+def pseudonym(key, value):
+    """Same-length (at least MIN_PSEUDONYM) stand-in for a string"""
+    if not value:
+        return value
+    digest = hmac.new(key, value.encode(), hashlib.sha256).hexdigest()
+    length = max(len(value), MIN_PSEUDONYM)
+    return (digest * (length // len(digest) + 1))[:length]
+
+
+def anonymize(key, value):
+    if isinstance(value, dict):
+        return {k: v if k in VERBATIM_KEYS else anonymize(key, v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize(key, v) for v in value]
+    if isinstance(value, str):
+        return pseudonym(key, value)
+    return value
+
+
+def shape(value):
+    """Type skeleton of a JSON value, used to spot responses that changed"""
+    if isinstance(value, dict):
+        return {k: shape(v) for k, v in sorted(value.items())}
+    if isinstance(value, list):
+        return [shape(value[0])] if value else []
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'num'
+    if value is None:
+        return 'null'
+    return 'str'
+
+
+def same_shape(recorded, replayed):
+    """Shapes match if they only differ where one side is null or an empty list"""
+    if recorded == 'null' or replayed == 'null':
+        return True
+    if isinstance(recorded, dict) and isinstance(replayed, dict):
+        return recorded.keys() == replayed.keys() and all(same_shape(recorded[k], replayed[k]) for k in recorded)
+    if isinstance(recorded, list) and isinstance(replayed, list):
+        return not recorded or not replayed or same_shape(recorded[0], replayed[0])
+    return recorded == replayed
+
+
+def split_path(path):
+    return path.split('?', 1) if '?' in path else (path, '')
+
+
+def route_of(path):
+    """Path with ids replaced by placeholders, for grouping latencies"""
+    path, _query = split_path(path)
+    for pattern, kind in PATH_IDS:
+        match = pattern.match(path)
+        if match and not (kind == 'room' and match.group(2).lower() in ROOM_WORDS):
+            return f'{match.group(1)}<{kind}>{match.group(3)}'
+    return path
+
+
+def _json_or_none(data):
+    try:
+        return json.loads(data) if data else None
+    except ValueError:
+        return None
+
+
+class TrafficRecorder:
+    """WSGI middleware that appends every request to a trace file"""
+
+    def __init__(self, app, path, key=None):
+        self.app = app
+        self.path_template = path
+        self.path = None
+        self.key = key or os.urandom(16)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def _open(self):
+        # Opened on first write in each process, so a preloaded app's forked workers get their own files
+        self._pid = os.getpid()
+        self.path = self.path_template.replace('{pid}', str(self._pid))
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._pending = 0
+        if self._file.tell() == 0:
+            self._write({'trace': TRACE_VERSION, 'started': time.time()})
+
+    def __call__(self, environ, start_response):
+        arrived = time.time()
+        start = time.perf_counter()
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else b''
+        environ['wsgi.input'] = io.BytesIO(body)
+
+        trace_id = parse_cookie(environ.get('HTTP_COOKIE', '')).get(TRACE_COOKIE)
+        new_trace_id = None if trace_id else secrets.token_hex(8)
+        captured = {}
+
+        def recording_start_response(status, headers, exc_info=None):
+            captured['status'] = int(status.split(' ', 1)[0])
+            captured['json'] = any(k.lower() == 'content-type' and 'json' in v for k, v in headers)
+            if new_trace_id:
+                headers = list(headers) + [('Set-Cookie', dump_cookie(TRACE_COOKIE, new_trace_id, path='/', httponly=True, samesite='Lax'))]
+            return start_response(status, headers, exc_info)
+
+        result = self.app(environ, recording_start_response)
+        try:
+            chunks = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        elapsed = time.perf_counter() - start
+
+        try:
+            self.record(environ, trace_id or new_trace_id, body, captured, b''.join(chunks), arrived, elapsed)
+        except Exception as e:
+            print(f'Traffic recording failed: {e}')
+        return chunks
+
+    def record(self, environ, trace_id, body, captured, response_body, arrived, elapsed):
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path = f"{path}?{environ['QUERY_STRING']}"
+        request_json = _json_or_none(body)
+        response_json = _json_or_none(response_body) if captured.get('json') else None
+
+        entry = {
+            't': round(arrived, 4),
+            's': trace_id,
+            'm': method,
+            'p': path,
+            'b': anonymize(self.key, request_json) if request_json is not None else None,
+            'st': captured.get('status'),
+            'ms': round(elapsed * 1000, 3),
+            'r': shape(response_json) if response_json is not None else None,
+        }
+        sources = ID_SOURCES.get((method, path))
+        if sources and isinstance(response_json, dict):
+            entry['ids'] = {key: response_json[key] for key in sources if key in response_json}
+        with self._lock:
+            self._write(entry)
+
+    def _write(self, entry):
+        if self._pid != os.getpid():
+            self._open()
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._pending += 1
+        if self._pending >= FLUSH_EVERY:
+            self._file.flush()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid() and not self._file.closed:
+                self._file.close()
+
+
+def load_traces(paths):
+    """Entries from one or more trace files in arrival order, with t in seconds from the first"""
+    entries = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            entries.extend(entry for entry in map(json.loads, filter(str.strip, f)) if 'trace' not in entry)
+    entries.sort(key=lambda entry: entry['t'])
+    if entries:
+        first = entries[0]['t']
+        for entry in entries:
+            entry['t'] -= first
+    return entries
+
+
+class InProcessSession:
+    """One replayed browser session against a WSGI app in this process"""
+
+    def __init__(self, app):
+        from werkzeug.test import Client
+        self.client = Client(app)
+
+    def send(self, method, path, body):
+        response = self.client.open(path, method=method, json=body) if body is not None else self.client.open(path, method=method)
+        return response.status_code, response.get_data()
+
+
+class HttpSession:
+    """One replayed browser session against a server, keeping its own cookies"""
+
+    def __init__(self, url):
+        self.url = urlsplit(url)
+        self.cookies = {}
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            conn_class = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            self._conn = conn_class(self.url.hostname, self.url.port, timeout=30)
+        return self._conn
+
+    def send(self, method, path, body):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        try:
+            conn = self._connection()
+            conn.request(method, path, body=data, headers=headers)
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            # The server closed the keep-alive connection; retry once on a new one
+            self._conn = None
+            conn = self._connection()
+            conn.request(method, path, body=data, headers=headers)
+            response = conn.getresponse()
+        payload = response.read()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                if morsel['max-age'] == '0' or not morsel.value or 'Thu, 01 Jan 1970' in morsel['expires']:
+                    self.cookies.pop(name, None)
+                else:
+                    self.cookies[name] = morsel.value
+        return response.status, payload
+
+
+class Replayer:
+    def __init__(self, entries, make_session):
+        self.entries = entries
+        self.make_session = make_session
+        self.ids = {}  # Format: {(kind, recorded id): replayed id}
+        self.key = os.urandom(16)
+        self.results = []  # Format: [(entry, status, ms, response shape)]
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._finished = threading.Condition()
+        self._done = [False] * len(entries)
+        self._done_prefix = 0  # Every entry before this index has finished
+
+    def session(self, alias):
+        with self._lock:
+            if alias not in self._sessions:
+                self._sessions[alias] = self.make_session()
+            return self._sessions[alias]
+
+    def remap_path(self, path):
+        path, query = split_path(path)
+        for pattern, kind in PATH_IDS:
+            match = pattern.match(path)
+            if match and not (kind == 'room' and match.group(2).lower() in ROOM_WORDS):
+                recorded = match.group(2).upper() if kind == 'room' else int(match.group(2))
+                replayed = self.ids.get((kind, recorded), recorded)
+                path = f'{match.group(1)}{replayed}{match.group(3)}'
+                break
+        return f'{path}?{query}' if query else path
+
+    def remap_body(self, body):
+        body = anonymize(self.key, body)
+        if isinstance(body, dict) and isinstance(body.get('room_code'), str):
+            body = dict(body, room_code=self.ids.get(('room', body['room_code'].upper()), body['room_code']))
+        return body
+
+    def learn_ids(self, entry, payload):
+        sources = ID_SOURCES.get((entry['m'], entry['p']))
+        if not sources or not entry.get('ids'):
+            return
+        data = _json_or_none(payload)
+        if not isinstance(data, dict):
+            return
+        for key, kind in sources.items():
+            recorded = entry['ids'].get(key)
+            if recorded is not None and key in data:
+                self.ids[(kind, recorded.upper() if kind == 'room' else recorded)] = data[key]
+
+    def send(self, entry):
+        session = self.session(entry['s'])
+        method, path, body = entry['m'], self.remap_path(entry['p']), self.remap_body(entry['b'])
+        start = time.perf_counter()
+        status, payload = session.send(method, path, body)
+        ms = (time.perf_counter() - start) * 1000
+
+        if (method, entry['p']) == ('POST', '/login') and status == 401 and entry['st'] == 200 and body:
+            # The user registered before recording started; create them and retry
+            session.send('POST', '/register', {'name': body.get('name'), 'password': body.get('password'), 'position': 'Delegate'})
+            start = time.perf_counter()
+            status, payload = session.send(method, path, body)
+            ms = (time.perf_counter() - start) * 1000
+
+        self.learn_ids(entry, payload)
+        response_json = _json_or_none(payload)
+        with self._lock:
+            self.results.append((entry, status, ms, shape(response_json) if response_json is not None else None))
+
+    def run(self, speed=None):
+        """Replay every entry; speed=None sends them back to back in recorded order"""
+        started = time.perf_counter()
+        if speed is None:
+            for entry in self.entries:
+                self.send(entry)
+        else:
+            dependencies = self._dependencies()
+            by_session = {}
+            for turn, entry in enumerate(self.entries):
+                by_session.setdefault(entry['s'], []).append((turn, entry))
+            threads = [
+                threading.Thread(target=self._run_session, args=(entries, started, speed, dependencies), daemon=True)
+                for entries in by_session.values()
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return time.perf_counter() - started
+
+    def _dependencies(self):
+        """For each entry: (prefix, extra) where the entries before prefix and
+        those in extra had finished by the time it arrived in the recording"""
+        ends = [entry['t'] + entry['ms'] / 1000 for entry in self.entries]
+        longest = max((entry['ms'] for entry in self.entries), default=0) / 1000
+        dependencies = []
+        prefix = 0
+        for turn, entry in enumerate(self.entries):
+            while prefix < turn and self.entries[prefix]['t'] + longest <= entry['t']:
+                prefix += 1
+            dependencies.append((prefix, [i for i in range(prefix, turn) if ends[i] <= entry['t']]))
+        return dependencies
+
+    def _mark_done(self, turn):
+        with self._finished:
+            self._done[turn] = True
+            while self._done_prefix < len(self._done) and self._done[self._done_prefix]:
+                self._done_prefix += 1
+            self._finished.notify_all()
+
+    def _run_session(self, entries, started, speed, dependencies):
+        for turn, entry in entries:
+            delay = started + entry['t'] / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            prefix, extra = dependencies[turn]
+            with self._finished:
+                self._finished.wait_for(lambda: self._done_prefix >= prefix and all(self._done[i] for i in extra))
+            try:
+                self.send(entry)
+            except Exception as e:
+                with self._lock:
+                    self.results.append((entry, None, 0.0, repr(e)))
+            finally:
+                self._mark_done(turn)
+
+    def report(self):
+        routes = {}
+        differences = []
+        for entry, status, ms, response_shape in self.results:
+            stats = routes.setdefault((entry['m'], route_of(entry['p'])), {'replay': [], 'recorded': []})
+            stats['replay'].append(ms)
+            stats['recorded'].append(entry['ms'])
+            if status != entry['st'] or (entry['r'] is not None and not same_shape(entry['r'], response_shape)):
+                differences.append({
+                    'method': entry['m'], 'path': entry['p'], 'session': entry['s'],
+                    'recorded_status': entry['st'], 'status': status,
+                    'shape_changed': status == entry['st'],
+                })
+        return {
+            'requests': len(self.results),
+            'routes': [
+                {
+                    'method': method, 'route': route, 'count': len(stats['replay']),
+                    **{f'p{p}_ms': percentile(stats['replay'], p) for p in (50, 90, 99)},
+                    'max_ms': round(max(stats['replay']), 3),
+                    'recorded_p50_ms': percentile(stats['recorded'], 50),
+                }
+                for (method, route), stats in sorted(routes.items(), key=lambda item: -len(item[1]['replay']))
+            ],
+            'differences': len(differences),
+            'first_differences': differences[:MAX_DIFFERENCES],
+        }
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 3)
+
+
+def in_process_app(spec):
+    """Import module:attr with a scratch database and no snapshots or ledger, then set it up"""
+    # Before the import, so nothing ever opens the real database, ledger or snapshot
+    os.environ['DATABASE'] = os.path.join(tempfile.mkdtemp(), 'replay.db')
+    os.environ['SNAPSHOT_ENABLED'] = '0'
+    os.environ['LEDGER_PATH'] = ''
+    module_name, _, attr = spec.partition(':')
+    module = importlib.import_module(module_name)
+    if hasattr(module, 'create_app'):
+        module.create_app()
+    return getattr(module, attr or 'app')
+
+
+def print_report(report, elapsed):
+    print(f"replayed {report['requests']} requests in {elapsed:.2f} s")
+    print(f"{'route':<48} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'rec p50':>8}")
+    for row in report['routes']:
+        print(f"{row['method'] + ' ' + row['route']:<48} {row['count']:>6} {row['p50_ms']:>8.2f} {row['p90_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['max_ms']:>8.2f} {row['recorded_p50_ms']:>8.2f}")
+    print(f"{report['differences']} responses differ from the recording")
+    for diff in report['first_differences']:
+        what = 'response shape changed' if diff['shape_changed'] else f"status {diff['recorded_status']} -> {diff['status']}"
+        print(f"  {diff['session']} {diff['method']} {diff['path']}: {what}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded traffic trace')
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay = sub.add_parser('replay', help='replay a trace and report latencies and differences')
+    replay.add_argument('traces', nargs='+', metavar='trace')
+    replay.add_argument('--speed', default='max', help="pace relative to the recording, e.g. 1 or 10, or 'max' (default)")
+    replay.add_argument('--url', help='server to replay against (default: in-process)')
+    replay.add_argument('--app', default='app:app', help='module:attr of the WSGI app for in-process replay')
+    replay.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    if speed is not None and speed <= 0:
+        parser.error('--speed must be positive or max')
+    if args.url:
+        make_session = lambda: HttpSession(args.url)
+    else:
+        app = in_process_app(args.app)
+        make_session = lambda: InProcessSession(app)
+
+    replayer = Replayer(load_traces(args.traces), make_session)
+    elapsed = replayer.run(speed)
+    report = replayer.report()
+    if args.json:
+        print(json.dumps(dict(report, elapsed_s=round(elapsed, 3)), indent=2))
+    else:
+        print_report(report, elapsed)
+    return 1 if report['differences'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())